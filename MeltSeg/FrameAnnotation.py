@@ -3,11 +3,22 @@ from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
 import math
 import json
-import os
+import time
+from framesource import FrameSource
+from prompts import prompt_entries
+
+
+# Delay after the last <Configure> event before the LANCZOS refinement
+RESIZE_DEBOUNCE_MS = 150
+# Minimum gap between the fast previews drawn while the window is dragged
+PREVIEW_INTERVAL = 0.03
+# Pyramid levels stop halving once the shorter side drops below this
+PYRAMID_MIN_SIZE = 256
 
 
 class ImageAnnotationTool:
-    def __init__(self, master, input_frame_dir: str | None):
+    def __init__(self, master, input_frame_dir: str | None,
+                 frames: FrameSource | None = None):
         self.master = master
         self.master.title("Image Annotation Tool")
 
@@ -22,11 +33,26 @@ class ImageAnnotationTool:
 
         self.master.geometry(
             f"{window_width}x{window_height}+{position_right}+{position_top}")
-        self.image_path = os.path.join(input_frame_dir, os.listdir(input_frame_dir)[0])
+        # A frame's position in the source is the frame index stored in the
+        # prompts JSON; passing the source on to SAM2 reuses its decodes
+        self.frames = frames or FrameSource.from_dir(input_frame_dir)
+        self.frame_paths = self.frames.paths
+        self.frame_idx = 0
+        self.image_path = self.frame_paths[0] if self.frame_paths else None
         self.original_image = None
         self.displayed_image = None
         self.photo = None
-        self.points = {"Object 1": []}
+        self.pyramid = []
+        self.refined_images = {}  # (width, height) -> LANCZOS resize
+        self.image_item = None
+        self.point_items = {}  # object name -> canvas ids, parallel to points
+        self.refine_job = None
+        self.last_preview = 0.0
+        self.canvas_size = None
+        # Points of the frame on screen; every annotated frame has its own
+        # {object name: points} dict in frame_points
+        self.points = {}
+        self.frame_points = {0: self.points}
         self.current_label = 'pos'
         self.current_object = 'Object 1'
         self.scale_factor = 1.0
@@ -40,7 +66,9 @@ class ImageAnnotationTool:
         self.canvas.bind("<Button-1>", self.on_left_click)
         self.canvas.bind("<Button-3>", self.on_right_click)
 
-        self.master.bind("<Configure>", self.on_resize)
+        # Bound on the canvas rather than the window so the toolbar widgets'
+        # own <Configure> events do not trigger redraws
+        self.canvas.bind("<Configure>", self.on_resize)
         self.master.after(100, self.wait_for_canvas_size)
         self.file_path = None
 
@@ -80,6 +108,29 @@ class ImageAnnotationTool:
                                        command=self.rename_object)
         self.rename_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        self.load_button = tk.Button(button_frame, text="Load JSON",
+                                     command=self.load_from_json)
+        self.load_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        self.next_button = tk.Button(button_frame, text="Next >",
+                                     command=lambda: self.show_frame(
+                                         self.frame_idx + 1))
+        self.next_button.pack(side=tk.RIGHT, padx=5, pady=5)
+
+        self.frame_count_label = tk.Label(
+            button_frame, text=f"/ {max(len(self.frame_paths) - 1, 0)}")
+        self.frame_count_label.pack(side=tk.RIGHT, pady=5)
+
+        self.frame_entry = tk.Entry(button_frame, width=6)
+        self.frame_entry.pack(side=tk.RIGHT, pady=5)
+        self.frame_entry.insert(0, "0")
+        self.frame_entry.bind("<Return>", self.on_frame_entered)
+
+        self.prev_button = tk.Button(button_frame, text="< Prev",
+                                     command=lambda: self.show_frame(
+                                         self.frame_idx - 1))
+        self.prev_button.pack(side=tk.RIGHT, padx=5, pady=5)
+
     def wait_for_canvas_size(self):
         if self.canvas.winfo_width() <= 1 or self.canvas.winfo_height() <= 1:
             # Canvas size not available yet, wait and check again
@@ -90,28 +141,92 @@ class ImageAnnotationTool:
 
     def load_image(self):
         if self.image_path:
-            self.original_image = Image.open(self.image_path)
+            self.original_image = self.frames.image(self.frame_idx)
+            self.build_pyramid()
             self.scale_and_display_image()
-            self.points = {}  # Clear existing points
+            self.draw_points()
             self.update_object_dropdown()
 
-    def scale_and_display_image(self):
+    def show_frame(self, frame_idx):
+        if not 0 <= frame_idx < len(self.frame_paths):
+            return
+        self.frame_idx = frame_idx
+        self.image_path = self.frame_paths[frame_idx]
+        # Every frame lists the same objects in the same order, so an
+        # object keeps its shape from frame to frame
+        points = self.frame_points.setdefault(frame_idx, {})
+        for object_name in self.points:
+            points.setdefault(object_name, [])
+        self.points = points
+        self.frame_entry.delete(0, tk.END)
+        self.frame_entry.insert(0, str(frame_idx))
+        self.load_image()
+
+    def on_frame_entered(self, event):
+        try:
+            self.show_frame(int(self.frame_entry.get()))
+        except ValueError:
+            messagebox.showwarning("Warning", "Please enter a frame number.")
+
+    def build_pyramid(self):
+        # Halved copies of the frame; resizes start from the smallest level
+        # that is still at least as large as the canvas, so a 4K frame is
+        # not resampled in full on every redraw
+        self.pyramid = [self.original_image]
+        while min(self.pyramid[-1].size) >= 2 * PYRAMID_MIN_SIZE:
+            self.pyramid.append(self.pyramid[-1].reduce(2))
+        self.refined_images = {}
+        self.displayed_image = None
+
+    def pyramid_level(self, width, height):
+        for level in reversed(self.pyramid):
+            if level.width >= width and level.height >= height:
+                return level
+        return self.pyramid[0]
+
+    def scale_and_display_image(self, resample=Image.Resampling.LANCZOS):
         if self.original_image:
             canvas_width = self.canvas.winfo_width()
             canvas_height = self.canvas.winfo_height()
 
             width_ratio = canvas_width / self.original_image.width
             height_ratio = canvas_height / self.original_image.height
-            self.scale_factor = min(width_ratio, height_ratio)
-            new_width = int(self.original_image.width * self.scale_factor)
-            new_height = int(self.original_image.height * self.scale_factor)
-            self.displayed_image = self.original_image.resize(
-                (new_width, new_height), Image.Resampling.LANCZOS)
+            scale_factor = min(width_ratio, height_ratio)
+            new_size = (max(1, int(self.original_image.width * scale_factor)),
+                        max(1, int(self.original_image.height * scale_factor)))
+            if (self.displayed_image is not None
+                    and self.displayed_image.size == new_size
+                    and (resample != Image.Resampling.LANCZOS
+                         or self.displayed_image
+                         is self.refined_images.get(new_size))):
+                return
+
+            if resample == Image.Resampling.LANCZOS:
+                if new_size not in self.refined_images:
+                    # Only the last few sizes are worth keeping
+                    if len(self.refined_images) >= 4:
+                        self.refined_images.pop(next(iter(self.refined_images)))
+                    self.refined_images[new_size] = self.pyramid_level(
+                        *new_size).resize(new_size, resample)
+                self.displayed_image = self.refined_images[new_size]
+            else:
+                self.displayed_image = self.pyramid_level(*new_size).resize(
+                    new_size, resample)
 
             self.photo = ImageTk.PhotoImage(self.displayed_image)
-            self.canvas.delete("all")
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
-            self.draw_points()
+            if self.image_item is None:
+                self.image_item = self.canvas.create_image(
+                    0, 0, anchor=tk.NW, image=self.photo)
+                self.canvas.tag_lower(self.image_item)
+            else:
+                self.canvas.itemconfigure(self.image_item, image=self.photo)
+            if scale_factor != self.scale_factor:
+                self.scale_factor = scale_factor
+                self.reposition_points()
+
+    def refine_display(self):
+        self.refine_job = None
+        self.scale_and_display_image(Image.Resampling.LANCZOS)
 
     def toggle_label(self):
         self.current_label = 'neg' if self.current_label == 'pos' else 'pos'
@@ -125,9 +240,10 @@ class ImageAnnotationTool:
             original_y = int(y / self.scale_factor)
             if self.current_object not in self.points:
                 self.points[self.current_object] = []
-            self.points[self.current_object].append(
-                (original_x, original_y, self.current_label))
-            self.draw_points()
+            point = (original_x, original_y, self.current_label)
+            self.points[self.current_object].append(point)
+            self.point_items.setdefault(self.current_object, []).append(
+                self.draw_point(self.current_object, point))
 
     def on_right_click(self, event):
         if self.displayed_image:
@@ -138,54 +254,105 @@ class ImageAnnotationTool:
 
     def remove_nearby_point(self, x, y):
         for obj, points in self.points.items():
-            for point in points:
+            for i, point in enumerate(points):
                 # 10 pixel radius for deletion
                 if math.sqrt((point[0] - x)**2 + (point[1] - y)**2) < 10:
-                    self.points[obj].remove(point)
-                    self.draw_points()
+                    del points[i]
+                    self.canvas.delete(self.point_items[obj].pop(i))
                     return
 
     def draw_points(self):
+        # Full redraw, only needed when the object order (and therefore the
+        # shapes) changes; clicks and resizes update items incrementally
         self.canvas.delete("point")
-        for i, (object_name, object_points) in enumerate(self.points.items()):
-            shape = self.shapes[i % len(self.shapes)]
-            for x, y, label in object_points:
-                scaled_x = int(x * self.scale_factor)
-                scaled_y = int(y * self.scale_factor)
-                color = "green" if label == 'pos' else "red"
-                self.draw_shape(scaled_x, scaled_y, shape, color)
+        self.point_items = {
+            object_name: [self.draw_point(object_name, point)
+                          for point in object_points]
+            for object_name, object_points in self.points.items()}
+
+    def draw_point(self, object_name, point):
+        i = list(self.points).index(object_name)
+        shape = self.shapes[i % len(self.shapes)]
+        x, y, label = point
+        color = "green" if label == 'pos' else "red"
+        return self.draw_shape(int(x * self.scale_factor),
+                               int(y * self.scale_factor), shape, color)
+
+    def reposition_points(self):
+        # Moves the existing items to the new scale instead of recreating them
+        if self.point_items.keys() != self.points.keys():
+            self.draw_points()
+            return
+        for object_name, items in self.point_items.items():
+            for item, (x, y, _) in zip(items, self.points[object_name]):
+                x0, y0, x1, y1 = self.canvas.bbox(item)
+                self.canvas.move(item,
+                                 int(x * self.scale_factor) - (x0 + x1) // 2,
+                                 int(y * self.scale_factor) - (y0 + y1) // 2)
 
     def draw_shape(self, x, y, shape, color):
         size = 5
         if shape == 'circle':
-            self.canvas.create_oval(x-size, y-size, x+size, y+size, fill=color,
-                                    outline='black', tags="point")
+            return self.canvas.create_oval(x-size, y-size, x+size, y+size,
+                                           fill=color, outline='black',
+                                           tags="point")
         elif shape == 'square':
-            self.canvas.create_rectangle(x-size, y-size, x+size, y+size,
-                                         fill=color, outline='black',
-                                         tags="point")
+            return self.canvas.create_rectangle(x-size, y-size, x+size,
+                                                y+size, fill=color,
+                                                outline='black', tags="point")
         elif shape == 'triangle':
-            self.canvas.create_polygon(x, y-size, x-size, y+size, x+size,
-                                       y+size, fill=color, outline='black',
-                                       tags="point")
+            return self.canvas.create_polygon(x, y-size, x-size, y+size,
+                                              x+size, y+size, fill=color,
+                                              outline='black', tags="point")
         elif shape == 'diamond':
-            self.canvas.create_polygon(x, y-size, x+size, y, x, y+size,
-                                       x-size, y, fill=color, outline='black',
-                                       tags="point")
+            return self.canvas.create_polygon(x, y-size, x+size, y, x,
+                                              y+size, x-size, y, fill=color,
+                                              outline='black', tags="point")
+
+    def has_points(self):
+        return any(object_points for points in self.frame_points.values()
+                   for object_points in points.values())
 
     def print_points(self):
-        if not self.points:
+        if not self.has_points():
             messagebox.showinfo("Info", "No points annotated yet.")
             return
         print("Annotated Points:")
-        for object_name, object_points in self.points.items():
-            print(f"\n{object_name}:")
-            for x, y, label in object_points:
-                print(f"  Coordinates: ({x}, {y}), "
-                      f"Label: {int(label == 'pos')}({label})")
+        for frame_idx in sorted(self.frame_points):
+            for object_name, object_points in self.frame_points[
+                    frame_idx].items():
+                if not object_points:
+                    continue
+                print(f"\n{object_name} (frame {frame_idx}):")
+                for x, y, label in object_points:
+                    print(f"  Coordinates: ({x}, {y}), "
+                          f"Label: {int(label == 'pos')}({label})")
+
+    def load_from_json(self):
+        # Opens earlier prompts so corrections can be added on later frames
+        file_path = filedialog.askopenfilename(
+            filetypes=[("JSON files", "*.json")])
+        if not file_path:
+            return
+        with open(file_path, 'r') as json_file:
+            prompts = json.load(json_file)
+        self.frame_points = {}
+        for entry in prompt_entries(prompts):
+            points = self.frame_points.setdefault(
+                entry["frame"], {object_name: [] for object_name in prompts})
+            points[entry["object"]] = [
+                (int(x), int(y), 'pos' if label else 'neg')
+                for (x, y), label in zip(entry["coordinates"],
+                                         entry["labels"])]
+        self.file_path = file_path
+        self.points = {object_name: [] for object_name in prompts}
+        if prompts:
+            self.current_object = next(iter(prompts))
+            self.object_var.set(self.current_object)
+        self.show_frame(self.frame_idx)
 
     def save_to_json(self):
-        if not self.points:
+        if not self.has_points():
             messagebox.showinfo("Info", "No points to save.")
             return
 
@@ -195,11 +362,16 @@ class ImageAnnotationTool:
             return  # User cancelled the save operation
         self.file_path = file_path
         json_data = {}
-        for object_name, object_points in self.points.items():
-            coordinates = [[point[0], point[1]] for point in object_points]
-            labels = [int(point[2] == "pos") for point in object_points]
-            json_data[object_name] = {"coordinates": coordinates,
-                                      "labels": labels}
+        for frame_idx in sorted(self.frame_points):
+            for object_name, object_points in self.frame_points[
+                    frame_idx].items():
+                if not object_points:
+                    continue
+                coordinates = [[point[0], point[1]] for point in object_points]
+                labels = [int(point[2] == "pos") for point in object_points]
+                json_data.setdefault(object_name, []).append(
+                    {"frame": frame_idx, "coordinates": coordinates,
+                     "labels": labels})
 
         with open(file_path, 'w') as json_file:
             json.dump(json_data, json_file, indent=2)
@@ -207,8 +379,21 @@ class ImageAnnotationTool:
         messagebox.showinfo("Success", f"Data saved to {file_path}")
 
     def on_resize(self, event):
-        if self.original_image:
-            self.scale_and_display_image()
+        if not self.original_image:
+            return
+        if (event.width, event.height) == self.canvas_size:
+            return
+        self.canvas_size = (event.width, event.height)
+        # Cheap bilinear previews while the window is being dragged, and a
+        # single LANCZOS pass once the events stop
+        now = time.perf_counter()
+        if now - self.last_preview >= PREVIEW_INTERVAL:
+            self.last_preview = now
+            self.scale_and_display_image(Image.Resampling.BILINEAR)
+        if self.refine_job is not None:
+            self.master.after_cancel(self.refine_job)
+        self.refine_job = self.master.after(RESIZE_DEBOUNCE_MS,
+                                            self.refine_display)
 
     def rename_object(self):
         old_name = self.current_object
@@ -221,8 +406,12 @@ class ImageAnnotationTool:
             messagebox.showwarning("Warning", "Object name already exists.")
             return
         if old_name in self.points:
-            self.points[new_name] = self.points.pop(old_name)
+            for points in self.frame_points.values():
+                if old_name in points:
+                    points[new_name] = points.pop(old_name)
             self.current_object = new_name
+            # The renamed object moves to the end, which changes the shapes
+            self.draw_points()
             self.update_object_dropdown()
             self.object_var.set(new_name)
             messagebox.showinfo("Success",
@@ -239,6 +428,7 @@ class ImageAnnotationTool:
             self.rename_object()
         else:
             self.points[new_object_name] = []
+            self.point_items[new_object_name] = []
             self.current_object = new_object_name
             self.update_object_dropdown()
             self.object_var.set(new_object_name)
@@ -1,17 +1,67 @@
 import os
+import math
+import re
+import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+from pipelinecache import PipelineCache, link_file, link_tree
+from instrumentation import RunMetrics
+from framestore import FRAME_STORE_NAME, FrameStore, write_frame_store
+
+
+# Extension and ffmpeg encoder options for each frame output format. SAM2's
+# init_state only reads JPEG directories, PNG and raw (uncompressed PPM) are
+# for lossless analysis or for the overlay stage. "store" decodes the video
+# once into a single memory-mapped frames.msf (see framestore.py) that every
+# later stage reads without decoding.
+FRAME_FORMATS = {
+    "jpeg": ("jpg", lambda quality: ['-q:v', str(quality)]),
+    "png": ("png", lambda quality: ['-compression_level', '1']),
+    "raw": ("ppm", lambda quality: []),
+    "store": ("msf", lambda quality: ['-f', 'image2pipe', '-c:v', 'ppm']),
+}
+# The formats the frame source can segment from
+SEGMENTATION_FORMATS = ("jpeg", "store")
+# Names the extraction writes (%05d grows past 99999); the output folder is
+# picked by the user and may hold other images that must be left alone
+FRAME_NAME = re.compile(r"^\d{5,}\.(jpg|png|ppm)$")
 
 
 class VideoProcessing:
-    def __init__(self):
-        self.video_path = None
-        self.output_folder = None
+    def __init__(self, video_path: str | None = None,
+                 output_folder: str | None = None, fps: int | None = None,
+                 interactive: bool = True, shards: int = 1,
+                 scale: str | None = None, crop: str | None = None,
+                 image_format: str = "jpeg", jpeg_quality: int = 2,
+                 cache: PipelineCache | None = None,
+                 metrics: RunMetrics | None = None):
+        if image_format not in FRAME_FORMATS:
+            raise ValueError(f"Unknown frame format: {image_format}")
+        if image_format == "store" and shards > 1:
+            raise ValueError("The frame store is written in a single pass; "
+                             "use shards=1")
+        self.video_path = video_path
+        self.output_folder = output_folder
         self.input_fps = None
-        self.fps = None
-        self.process()
+        self.fps = fps
+        # shards > 1 extracts that many time ranges concurrently
+        self.shards = shards
+        # ffmpeg filter arguments, e.g. scale="1280:-2", crop="640:480:0:0"
+        self.scale = scale
+        self.crop = crop
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.extraction_stats = None
+        self.cache = cache
+        self.metrics = metrics or RunMetrics()
+        # Identifies the extracted frames for the mask cache
+        self.frames_key = None
+        if interactive:
+            self.process()
 
     def select_file(self):
         while True:
@@ -47,15 +97,53 @@ class VideoProcessing:
                 else:
                     messagebox.showinfo("Info", "Please select an existing folder or create a new one.")
 
+    def probe_fps(self):
+        video = cv2.VideoCapture(self.video_path)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        self.input_fps = fps
+        video.release()
+        return fps
+
+    def probe_duration(self):
+        video = cv2.VideoCapture(self.video_path)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        frame_count = video.get(cv2.CAP_PROP_FRAME_COUNT)
+        video.release()
+        if not fps or frame_count <= 0:
+            return None
+        return frame_count / fps
+
+    def probe_frame_size(self):
+        # (width, height) of the extracted frames; numeric crop and scale
+        # arguments are applied, -1/-2 keep the aspect ratio
+        video = cv2.VideoCapture(self.video_path)
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        video.release()
+        if self.crop:
+            size = self.crop.split(":")[:2]
+            if all(s.isdigit() for s in size):
+                width, height = int(size[0]), int(size[1])
+        if self.scale and width and height:
+            size = self.scale.split(":")[:2]
+            try:
+                new_width, new_height = (int(s) for s in size)
+            except ValueError:
+                return width, height
+            if new_width < 0 and new_height > 0:
+                new_width = round(width * new_height / height)
+            elif new_height < 0 and new_width > 0:
+                new_height = round(height * new_width / width)
+            if new_width > 0 and new_height > 0:
+                width, height = new_width, new_height
+        return width, height
+
     def get_fps(self):
         if self.video_path is None:
             messagebox.showinfo("Error", "No video file selected.")
             return None
 
-        video = cv2.VideoCapture(self.video_path)
-        fps = video.get(cv2.CAP_PROP_FPS)
-        self.input_fps = fps
-        video.release()
+        fps = self.probe_fps()
 
         temp_root = tk.Tk()
         temp_root.withdraw()
@@ -101,24 +189,185 @@ class VideoProcessing:
 
         return self.fps
         
+    def frame_filters(self, start_frame: int | None = None,
+                      end_frame: int | None = None):
+        filters = [f'fps={self.fps}']
+        # Output frame n has the timestamp n/fps; trimming half a frame
+        # before a shard's first and last frame keeps exactly its frames
+        trim = []
+        if start_frame:
+            trim.append(f'start={(start_frame - 0.5) / self.fps:.6f}')
+        if end_frame is not None:
+            trim.append(f'end={(end_frame - 0.5) / self.fps:.6f}')
+        if trim:
+            filters.append('trim=' + ':'.join(trim))
+        if self.crop:
+            filters.append(f'crop={self.crop}')
+        if self.scale:
+            filters.append(f'scale={self.scale}')
+        return ','.join(filters)
+
+    def extraction_command(self, output_pattern: str,
+                           start_frame: int | None = None,
+                           end_frame: int | None = None):
+        extension, encoder_options = FRAME_FORMATS[self.image_format]
+        command = ['ffmpeg', '-y']
+        if start_frame:
+            # Seeks a little before the shard and keeps the video's
+            # timestamps, less the container's start time as a single pass
+            # does, so the fps filter samples the same grid as a
+            # single-pass extraction and trim cuts on it
+            seek = max(0.0, (start_frame - 2) / self.fps)
+            command += ['-ss', f'{seek:.6f}', '-copyts', '-start_at_zero']
+        command += [
+            '-i', self.video_path,
+            '-vf', self.frame_filters(start_frame, end_frame),
+        ]
+        command += encoder_options(self.jpeg_quality)
+        if self.image_format != "store":
+            command += ['-start_number', '0']
+        command.append(output_pattern)
+        return command
+
+    def extract_sharded(self, extension: str):
+        duration = self.probe_duration()
+        if duration is None:
+            raise ValueError("Could not determine the video duration.")
+        # The duration only balances the shards: they are split on output
+        # timestamps and the last one runs to the end of the video, so a
+        # wrong container frame count cannot drop or repeat frames
+        total_frames = math.ceil(duration * self.fps)
+        per_shard = math.ceil(total_frames / self.shards)
+        shard_dirs = []
+        commands = []
+        for shard in range(self.shards):
+            start_frame = shard * per_shard
+            if start_frame >= total_frames:
+                break
+            end_frame = start_frame + per_shard
+            if end_frame >= total_frames:
+                end_frame = None
+            shard_dir = os.path.join(self.output_folder, f'.shard_{shard}')
+            os.makedirs(shard_dir, exist_ok=True)
+            shard_dirs.append(shard_dir)
+            commands.append(self.extraction_command(
+                os.path.join(shard_dir, f'%05d.{extension}'), start_frame,
+                end_frame))
+
+        frame_idx = 0
+        try:
+            with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+                list(executor.map(
+                    lambda command: subprocess.run(command, capture_output=True,
+                                                   text=True, check=True),
+                    commands))
+            # Renumber the shard outputs in order into the global %05d
+            # sequence
+            for shard_dir in shard_dirs:
+                names = sorted(os.listdir(shard_dir),
+                               key=lambda name: int(os.path.splitext(name)[0]))
+                for name in names:
+                    os.replace(os.path.join(shard_dir, name),
+                               os.path.join(self.output_folder,
+                                            f'{frame_idx:05d}.{extension}'))
+                    frame_idx += 1
+        finally:
+            for shard_dir in shard_dirs:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+        return frame_idx
+
+    def extraction_options(self):
+        # Everything besides the video and fps that changes the frames
+        return {"scale": self.scale, "crop": self.crop,
+                "format": self.image_format, "quality": self.jpeg_quality}
+
+    def run_extraction(self):
+        if not all([self.video_path, self.output_folder, self.fps]):
+            raise ValueError("Video path, output folder, or FPS not set.")
+        os.makedirs(self.output_folder, exist_ok=True)
+        extension = FRAME_FORMATS[self.image_format][0]
+        store_path = os.path.join(self.output_folder, FRAME_STORE_NAME)
+        self.clear_frames()
+
+        start = time.perf_counter()
+        with self.metrics.stage("extract") as stage:
+            cached = None
+            if self.cache is not None:
+                self.frames_key = self.cache.frames_key(
+                    self.video_path, self.fps, self.extraction_options())
+                cached = self.cache.lookup(self.frames_key)
+            if cached is not None:
+                link_tree(cached, self.output_folder)
+                frame_count = self.count_frames(cached)
+            elif self.image_format == "store":
+                frame_count = write_frame_store(
+                    self.extraction_command('pipe:1'), store_path)
+            elif self.shards > 1:
+                frame_count = self.extract_sharded(extension)
+            else:
+                output_pattern = os.path.join(self.output_folder,
+                                              f'%05d.{extension}')
+                subprocess.run(self.extraction_command(output_pattern),
+                               capture_output=True, text=True, check=True)
+                frame_count = len(self.frame_names(extension))
+            if self.cache is not None and cached is None:
+                with self.cache.insert(self.frames_key, "frames") as staging:
+                    names = ([FRAME_STORE_NAME] if self.image_format == "store"
+                             else self.frame_names(extension))
+                    for name in names:
+                        link_file(os.path.join(self.output_folder, name),
+                                  os.path.join(staging, name))
+            stage.frames += frame_count
+        seconds = time.perf_counter() - start
+        self.extraction_stats = {
+            "frames": frame_count,
+            "seconds": seconds,
+            "frames_per_second": frame_count / seconds if seconds else 0.0,
+            "shards": self.shards,
+            "format": self.image_format,
+            "cached": cached is not None,
+        }
+        return self.extraction_stats
+
+    def frame_names(self, extension: str | None = None):
+        # Extracted frames in the output folder, of any format or only
+        # extension's
+        return [name for name in os.listdir(self.output_folder)
+                if FRAME_NAME.match(name)
+                and (extension is None or name.endswith(f'.{extension}'))]
+
+    def clear_frames(self):
+        # Frames of an earlier extraction may be hard links into the cache;
+        # unlinking them first keeps ffmpeg from overwriting the cached
+        # files in place. It also drops frames the new extraction would
+        # not overwrite and an old frame store, which readers would prefer
+        # over the new images. Only names the extraction writes are removed.
+        names = self.frame_names() + [FRAME_STORE_NAME]
+        for name in names:
+            path = os.path.join(self.output_folder, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def count_frames(self, folder: str):
+        if self.image_format == "store":
+            store = FrameStore(os.path.join(folder, FRAME_STORE_NAME))
+            frame_count = len(store)
+            store.close()
+            return frame_count
+        return len(os.listdir(folder))
+
     def extract_frames(self):
         if not all([self.video_path, self.output_folder, self.fps]):
             messagebox.showinfo("Error", "Video path, output folder, or FPS not set.")
             return
 
-        output_pattern = os.path.join(self.output_folder, '%05d.jpg')
-        command = [
-            'ffmpeg',
-            '-i', self.video_path,
-            '-vf', f'fps={self.fps}',
-            '-q:v', '2',
-            '-start_number', '0',
-            output_pattern
-        ]
-
         try:
-            subprocess.run(command, capture_output=True, text=True, check=True)
-            messagebox.showinfo("Success", "Frames extracted successfully.")
+            stats = self.run_extraction()
+            messagebox.showinfo(
+                "Success",
+                f"Extracted {stats['frames']} frames in "
+                f"{stats['seconds']:.1f}s "
+                f"({stats['frames_per_second']:.1f} frames/s).")
         except subprocess.CalledProcessError as e:
             messagebox.showerror("Error", f"Error extracting frames: {e}")
 
@@ -0,0 +1,278 @@
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from WeldPathTime import VideoProcessing
+from sam2helpers import SAM2Pipeline
+from inferenceworker import InferenceClient
+from pipelinecache import PipelineCache
+from instrumentation import RunMetrics, write_prometheus_textfile
+from cpuaccel import apply_tuned_threads
+from batchjobs import (add_runner_arguments, load_manifest, parse_size,
+                       write_summary)
+
+
+class BatchRunner:
+    def __init__(self, jobs: list, summary_path: str,
+                 render_workers: int | None = 1,
+                 render_backend: str = "process",
+                 mask_spill_dir: str | None = None,
+                 mask_memory_limit: int | None = None,
+                 window_size: int | None = None,
+                 window_overlap: int = 1,
+                 cache: PipelineCache | None = None,
+                 fail_fast: bool = False,
+                 worker_address: str | None = None,
+                 prometheus_path: str | None = None,
+                 checkpoint_dir: str | None = None,
+                 checkpoint_interval: int = 500,
+                 precision: str = "bfloat16",
+                 quantize: bool = False):
+        self.jobs = jobs
+        self.summary_path = summary_path
+        self.prometheus_path = prometheus_path
+        self.job_metrics = []
+        self.pipeline_options = {
+            "render_workers": render_workers,
+            "render_backend": render_backend,
+            "mask_spill_dir": mask_spill_dir,
+            "mask_memory_limit": mask_memory_limit,
+            "window_size": window_size,
+            "window_overlap": window_overlap,
+            "cache": cache,
+            "precision": precision,
+            "quantize": quantize,
+        }
+        self.fail_fast = fail_fast
+        # Each job checkpoints into its own subdirectory
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.predictors = {}
+        self.results = []
+        # With a warm inference worker the models stay loaded across batches
+        self.client = None
+        if worker_address:
+            self.client = InferenceClient(worker_address)
+
+    def predictor(self, pipeline: SAM2Pipeline, timings: dict):
+        # Each checkpoint is loaded once and reused by every later job
+        if pipeline.model_version not in self.predictors:
+            start = time.perf_counter()
+            self.predictors[pipeline.model_version] = pipeline.load_predictor()
+            timings["load_model"] = time.perf_counter() - start
+        return self.predictors[pipeline.model_version]
+
+    def job_checkpoint_dir(self, job: dict):
+        if not self.checkpoint_dir:
+            return None
+        return os.path.join(self.checkpoint_dir, job["name"])
+
+    def run_job(self, job: dict, result: dict, metrics: RunMetrics):
+        timings = result["timings"]
+        with tempfile.TemporaryDirectory(prefix="meltseg_") as scratch:
+            frames_dir = job["frames_dir"] or os.path.join(scratch, "frames")
+            video = VideoProcessing(job["video"], frames_dir, job["fps"],
+                                    interactive=False, shards=job["shards"],
+                                    scale=job["scale"], crop=job["crop"],
+                                    image_format=job["image_format"],
+                                    jpeg_quality=job["jpeg_quality"],
+                                    cache=self.pipeline_options["cache"],
+                                    metrics=metrics)
+
+            start = time.perf_counter()
+            input_fps = video.probe_fps()
+            result["extraction"] = video.run_extraction()
+            timings["extract"] = time.perf_counter() - start
+
+            if self.client is not None:
+                response = self.client.segment(
+                    os.path.abspath(frames_dir), job["prompts"],
+                    job["model"], output=job["output"],
+                    output_fps=job["output_fps"] or input_fps,
+                    alpha=job["alpha"],
+                    masked_frames_dir=job["masked_frames_dir"],
+                    frames_key=video.frames_key, masks=job["masks"],
+                    coco=job["coco"], geometry=job["geometry"],
+                    checkpoint_dir=self.job_checkpoint_dir(job),
+                    checkpoint_interval=self.checkpoint_interval,
+                    roi_padding=job["roi_padding"],
+                    roi_track=job["roi_track"],
+                    skip_threshold=job["skip_threshold"],
+                    skip_max_gap=job["skip_max_gap"],
+                    skip_fill=job["skip_fill"], name=job["name"])
+                timings.update(response["timings"])
+                result["frames"] = response["frames"]
+                result["masks_cached"] = response["masks_cached"]
+                result["resumed_from"] = response["resumed_from"]
+                result["skipped_fraction"] = response["skipped_fraction"]
+                if response["restored_from"] is not None:
+                    result["restart"] = {
+                        "restored_from": response["restored_from"],
+                        "restore_seconds": response["restore_seconds"]}
+                result["worker_metrics"] = response["metrics"]
+                return
+
+            pipeline = SAM2Pipeline(frames_dir,
+                                    job["output_fps"] or input_fps,
+                                    model_version=job["model"],
+                                    frames_key=video.frames_key,
+                                    metrics=metrics,
+                                    geometry_path=job["geometry"],
+                                    checkpoint_dir=self.job_checkpoint_dir(job),
+                                    checkpoint_interval=self.checkpoint_interval,
+                                    roi_padding=job["roi_padding"],
+                                    roi_track=job["roi_track"],
+                                    skip_threshold=job["skip_threshold"],
+                                    skip_max_gap=job["skip_max_gap"],
+                                    skip_fill=job["skip_fill"],
+                                    **self.pipeline_options)
+            try:
+                prompts = pipeline.load_prompts(job["prompts"])
+
+                start = time.perf_counter()
+                # A mask cache hit skips loading the model altogether
+                cached = pipeline.load_cached_masks(prompts)
+                timings["propagate"] = time.perf_counter() - start
+                if not cached:
+                    predictor = self.predictor(pipeline, timings)
+                    start = time.perf_counter()
+                    if job["masked_frames_dir"]:
+                        pipeline.propagate(prompts, predictor)
+                        timings["propagate"] = time.perf_counter() - start
+                    else:
+                        # Compositing and encoding overlap propagation
+                        pipeline.propagate_and_encode(prompts, job["alpha"],
+                                                      job["output"], predictor)
+                        timings["propagate_render"] = (time.perf_counter()
+                                                       - start)
+                        del timings["propagate"]
+                result["frames"] = len(pipeline.video_segments)
+                result["masks_cached"] = pipeline.masks_from_cache
+                result["resumed_from"] = pipeline.resumed_from
+                result["skipped_fraction"] = pipeline.skipped_fraction
+                if pipeline.restored_from is not None:
+                    # Time spent reloading an interrupted run's checkpoint
+                    result["restart"] = {
+                        "restored_from": pipeline.restored_from,
+                        "restore_seconds": pipeline.restore_seconds}
+
+                if "propagate_render" not in timings:
+                    start = time.perf_counter()
+                    pipeline.export_video(job["alpha"], job["output"],
+                                          job["masked_frames_dir"])
+                    timings["render"] = time.perf_counter() - start
+                if job["masks"] or job["coco"]:
+                    start = time.perf_counter()
+                    pipeline.export_masks(job["masks"], job["coco"])
+                    timings["export_masks"] = time.perf_counter() - start
+            finally:
+                pipeline.close()
+
+    def run_one(self, job: dict):
+        # Returns (summary entry, metrics) of one job; errors are recorded in
+        # the entry instead of raised
+        result = {
+            "name": job["name"],
+            "video": job["video"],
+            "output": job["output"],
+            "model": job["model"],
+            "status": "ok",
+            "frames": 0,
+            "timings": {},
+        }
+        # "job" is the label Prometheus sets to the scrape target
+        metrics = RunMetrics({"meltseg_job": job["name"]})
+        start = time.perf_counter()
+        try:
+            self.run_job(job, result, metrics)
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+            result["traceback"] = traceback.format_exc()
+        result["timings"]["total"] = time.perf_counter() - start
+        result["metrics"] = metrics.report()
+        return result, metrics
+
+    def run(self):
+        try:
+            for job in self.jobs:
+                result, metrics = self.run_one(job)
+                self.results.append(result)
+                self.job_metrics.append(metrics)
+                self.write_summary()
+                if self.prometheus_path:
+                    write_prometheus_textfile(self.prometheus_path,
+                                              self.job_metrics)
+                print(f"[{len(self.results)}/{len(self.jobs)}] "
+                      f"{job['name']}: {result['status']} "
+                      f"({result['timings']['total']:.1f}s)")
+                if self.fail_fast and result["status"] != "ok":
+                    break
+        finally:
+            self.close()
+        return self.results
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def write_summary(self):
+        write_summary(self.summary_path, self.results)
+
+
+def runner_options(args: argparse.Namespace) -> dict:
+    # BatchRunner keyword arguments for parsed add_runner_arguments options
+    cache = None
+    if args.cache_dir:
+        cache = PipelineCache(args.cache_dir, parse_size(args.cache_size))
+    return {
+        "render_workers": args.render_workers or None,
+        "render_backend": args.render_backend,
+        "mask_spill_dir": args.mask_spill_dir,
+        "mask_memory_limit": args.mask_memory_limit,
+        "window_size": args.window_size,
+        "window_overlap": args.window_overlap,
+        "cache": cache,
+        "fail_fast": args.fail_fast,
+        "worker_address": getattr(args, "worker", None),
+        "prometheus_path": args.prometheus_textfile,
+        "checkpoint_dir": args.checkpoint_dir,
+        "checkpoint_interval": args.checkpoint_interval,
+        "precision": args.precision or (
+            "auto" if args.cpu_mode else "bfloat16"),
+        "quantize": args.cpu_mode,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run frame extraction, SAM2 propagation and overlay "
+                    "rendering for every job in a manifest, without dialogs")
+    parser.add_argument("manifest", help="JSON manifest of jobs")
+    parser.add_argument("--summary", help="Summary JSON path (default: "
+                        "<manifest>_summary.json)")
+    parser.add_argument("--worker", metavar="ADDRESS",
+                        help="Send jobs to a running inferenceworker.py "
+                             "instead of loading models in this process")
+    add_runner_arguments(parser)
+    args = parser.parse_args(argv)
+
+    summary_path = args.summary or (
+        os.path.splitext(args.manifest)[0] + "_summary.json")
+    if args.cpu_mode:
+        apply_tuned_threads()
+    runner = BatchRunner(load_manifest(args.manifest), summary_path,
+                         **runner_options(args))
+    # Preemption usually arrives as SIGTERM; raising SystemExit lets the
+    # running job write its last checkpoint on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    results = runner.run()
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import shutil
+from WeldPathTime import SEGMENTATION_FORMATS
+from modelprofile import choose_model, load_profile
+from sam2models import resolve_model_version
+from cpuaccel import PRECISIONS
+
+# Manifests, summaries and the shared job options of batch.py and
+# scheduler.py. Nothing here imports torch or SAM2, so the scheduler can
+# read a manifest before its job processes set their thread limits.
+
+
+JOB_DEFAULTS = {
+    "fps": None,
+    "output_fps": None,
+    "model": "base-plus",
+    "alpha": 0.25,
+    "frames_dir": None,
+    "masked_frames_dir": None,
+    "masks": None,
+    "coco": None,
+    "geometry": None,
+    "shards": 1,
+    "scale": None,
+    "crop": None,
+    "image_format": "jpeg",
+    "jpeg_quality": 2,
+    "memory": None,
+    "model_profile": None,
+    "min_iou": 0.9,
+    "roi_padding": None,
+    "roi_track": False,
+    "skip_threshold": None,
+    "skip_max_gap": 10,
+    "skip_fill": "nearest",
+}
+
+
+def load_manifest(manifest_path: str):
+    # A manifest is either a list of jobs or {"defaults": {...}, "jobs": [...]}
+    # with every job naming a video, prompts JSON, fps and output video.
+    # Relative paths are resolved against the manifest's directory.
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+    defaults = {**JOB_DEFAULTS, **manifest.get("defaults", {})}
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    jobs = []
+    for i, entry in enumerate(manifest["jobs"]):
+        job = {**defaults, **entry}
+        missing = [key for key in ("video", "prompts", "fps", "output")
+                   if not job.get(key)]
+        if missing:
+            raise ValueError(f"Job {i} is missing {', '.join(missing)}")
+        for key in ("video", "prompts", "output", "frames_dir",
+                    "masked_frames_dir", "masks", "coco", "geometry",
+                    "model_profile"):
+            if job[key]:
+                job[key] = os.path.join(base_dir, job[key])
+        if job["model"] == "auto":
+            # The fastest model that met min_iou in a modelprofile.py report
+            if not job["model_profile"]:
+                raise ValueError(f"Job {i} uses model \"auto\" without a "
+                                 f"model_profile")
+            job["model"] = choose_model(load_profile(job["model_profile"]),
+                                        job["min_iou"])
+            if job["model"] is None:
+                raise ValueError(f"Job {i}: no profiled model reaches a mean "
+                                 f"IoU of {job['min_iou']}")
+        if job["image_format"] not in SEGMENTATION_FORMATS:
+            # The frame source only reads JPEG directories and frame stores
+            raise ValueError(f"Job {i}: image_format must be one of "
+                             f"{', '.join(SEGMENTATION_FORMATS)} to segment")
+        job["model"] = resolve_model_version(job["model"])
+        job.setdefault("name", os.path.splitext(
+            os.path.basename(job["video"]))[0])
+        jobs.append(job)
+    return jobs
+
+
+def parse_size(size: str | None):
+    if size is None:
+        return None
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def write_summary(summary_path: str, results: list):
+    summary = {
+        "jobs": results,
+        "succeeded": sum(r["status"] == "ok" for r in results),
+        "failed": sum(r["status"] != "ok" for r in results),
+    }
+    # Written after every job so a crashed batch keeps what it finished
+    tmp_path = summary_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    shutil.move(tmp_path, summary_path)
+
+
+def add_runner_arguments(parser: argparse.ArgumentParser):
+    # Per-job options shared with scheduler.py
+    parser.add_argument("--render-workers", type=int, default=1,
+                        help="Overlay render workers, 0 for every core")
+    parser.add_argument("--render-backend", choices=["process", "thread"],
+                        default="process")
+    parser.add_argument("--mask-spill-dir")
+    parser.add_argument("--mask-memory-limit", type=int,
+                        help="Bytes of packed masks kept in RAM before "
+                             "spilling to --mask-spill-dir")
+    parser.add_argument("--window-size", type=int,
+                        help="Propagate in overlapping windows of this many "
+                             "frames to keep memory flat on long videos")
+    parser.add_argument("--window-overlap", type=int, default=1,
+                        help="Frames shared between consecutive windows")
+    parser.add_argument("--cache-dir",
+                        help="Reuse extracted frames and propagated masks "
+                             "from this content-addressed cache")
+    parser.add_argument("--cache-size",
+                        help="Evict least recently used cache entries above "
+                             "this size, e.g. 200G")
+    parser.add_argument("--prometheus-textfile",
+                        help="Write per-stage metrics of every job to this "
+                             ".prom file for node exporter")
+    parser.add_argument("--checkpoint-dir",
+                        help="Save propagated masks here as they complete so "
+                             "a rerun of an interrupted batch resumes each "
+                             "job where it stopped")
+    parser.add_argument("--checkpoint-interval", type=int, default=500,
+                        help="Frames between checkpoints")
+    parser.add_argument("--precision", choices=PRECISIONS,
+                        help="Propagation precision (default: bfloat16, "
+                             "auto with --cpu-mode)")
+    parser.add_argument("--cpu-mode", action="store_true",
+                        help="Quantize the model's linear layers to int8 on "
+                             "the CPU and use the thread counts tuned by "
+                             "cpuaccel.py (the scheduler keeps its "
+                             "--threads-per-worker)")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="Stop after the first failed job")
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+
+
+class PropagationCheckpoint:
+    # Completed masks of a propagation run, saved every `interval` frames as
+    # append-only MaskStore segments listed in checkpoint.json. The
+    # signature ties a checkpoint to its frames, prompts, model and window
+    # options; a checkpoint with a different signature is discarded.
+
+    def __init__(self, directory: str, signature: str, mask_store,
+                 interval: int = 500):
+        self.directory = directory
+        self.signature = signature
+        self.mask_store = mask_store
+        self.interval = interval
+        self.path = os.path.join(directory, "checkpoint.json")
+        self.segments = []
+        self.pending = []
+
+    def restore(self):
+        # Loads the saved masks into the store and returns how many frames
+        # were restored
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if state is None or state.get("signature") != self.signature:
+            self.remove()
+            return 0
+        frames = 0
+        for segment in state["segments"]:
+            self.mask_store.load(os.path.join(self.directory, segment))
+            frames = len(self.mask_store)
+        self.segments = state["segments"]
+        return frames
+
+    def add(self, frame_idx: int):
+        self.pending.append(frame_idx)
+        if len(self.pending) >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        segment = f"segment_{len(self.segments):05d}"
+        self.mask_store.save(os.path.join(self.directory, segment),
+                             frames=self.pending)
+        self.segments.append(segment)
+        self.pending = []
+        # The segment is complete before checkpoint.json names it, so a
+        # kill at any point leaves a readable checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"signature": self.signature,
+                       "segments": self.segments}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.segments = []
+        self.pending = []
@@ -0,0 +1,267 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import tempfile
+import time
+
+# torch is imported inside the functions, so the GUI can import this module
+# before torch loads, and the tuning runs happen in spawned processes (see
+# modelprofile.run_profile)
+
+PRECISIONS = ("auto", "bfloat16", "float32")
+# CPU flags of native bf16 arithmetic; without them autocast emulates bf16
+# and is usually slower than float32
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+DEFAULT_TUNING_PATH = os.path.join(os.path.expanduser("~"), ".meltseg",
+                                   "cpu_tuning.json")
+
+
+def _cpuinfo() -> dict:
+    # First processor's entries of /proc/cpuinfo, empty where there is none
+    info = {}
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                key, _, value = line.partition(":")
+                info[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return info
+
+
+def cpu_supports_bf16() -> bool:
+    flags = _cpuinfo().get("flags", "").split()
+    return any(flag in flags for flag in BF16_CPU_FLAGS)
+
+
+def resolve_precision(precision: str, device_type: str,
+                      quantize: bool = False) -> str:
+    # "bfloat16" or "float32" for propagation on device_type. int8 dynamic
+    # quantization only exists on the CPU and its layers take float32.
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {', '.join(PRECISIONS)}")
+    if quantize and device_type == "cpu":
+        if precision == "bfloat16":
+            raise ValueError("int8 quantized layers run in float32; use "
+                             "precision \"float32\" or \"auto\"")
+        return "float32"
+    if precision == "auto":
+        if device_type == "cuda" or cpu_supports_bf16():
+            return "bfloat16"
+        return "float32"
+    return precision
+
+
+def autocast(device_type: str, precision: str):
+    # The context propagation and init_state run in
+    import torch
+    if precision == "bfloat16":
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def quantize_linear(predictor):
+    # Swaps every nn.Linear of the predictor for a dynamically quantized
+    # int8 one: weights are stored as int8, activations are quantized per
+    # batch at run time. Convolutions and attention stay in float32.
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    return quantize_dynamic(predictor.eval(), {torch.nn.Linear},
+                            dtype=torch.qint8, inplace=True)
+
+
+def machine_key() -> str:
+    # Tuned settings only carry over to an identical machine
+    cpu = _cpuinfo().get("model name") or platform.processor() or "unknown"
+    return f"{socket.gethostname()}/{cpu}/{os.cpu_count()}"
+
+
+def tuning_path() -> str:
+    return os.environ.get("MELTSEG_CPU_TUNING", DEFAULT_TUNING_PATH)
+
+
+def load_tuning(path: str | None = None) -> dict | None:
+    # This machine's entry of the tuning file, None if it was never tuned
+    try:
+        with open(path or tuning_path(), "r") as f:
+            return json.load(f).get(machine_key())
+    except (OSError, ValueError):
+        return None
+
+
+def save_tuning(settings: dict, path: str | None = None):
+    path = path or tuning_path()
+    try:
+        with open(path, "r") as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        tuning = {}
+    tuning[machine_key()] = settings
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(tuning, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def apply_threads(num_threads: int, interop_threads: int):
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        # Only possible before torch has run anything in parallel
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        pass
+
+
+def apply_tuned_threads() -> dict | None:
+    # Applies this machine's tuned thread counts, if there are any
+    settings = load_tuning()
+    if settings is None:
+        print(f"No CPU tuning for this machine in {tuning_path()}; run "
+              f"cpuaccel.py to create it")
+        return None
+    apply_threads(settings["num_threads"], settings["interop_threads"])
+    return settings
+
+
+def thread_candidates(cpu_count: int | None = None) -> list:
+    # (intra-op, inter-op) thread counts tried by the warm-up
+    cpu_count = cpu_count or os.cpu_count() or 1
+    intra = sorted({max(1, cpu_count // d) for d in (1, 2, 4)}, reverse=True)
+    interop = sorted({min(n, cpu_count) for n in (1, 2, 4)})
+    return [(i, j) for i in intra for j in interop]
+
+
+def prompts_before(prompts: dict, frame_count: int) -> dict:
+    # The prompts placed on the first frame_count frames
+    kept = {}
+    for obj_id, object_prompts in prompts.items():
+        if isinstance(object_prompts, dict):
+            object_prompts = [object_prompts]
+        object_prompts = [p for p in object_prompts
+                          if int(p.get("frame", 0)) < frame_count]
+        if object_prompts:
+            kept[obj_id] = object_prompts
+    return kept
+
+
+def tune(model: str, frames_dir: str, prompts: dict, workdir: str,
+         precision: str = "auto", quantize: bool = True,
+         warmup_frames: int = 16) -> dict:
+    # Times every thread candidate on the first warmup_frames frames, each
+    # in a fresh process since inter-op threads are fixed once set. Then
+    # runs the whole clip with the fastest one and with the default path
+    # (bfloat16 autocast, torch's default threads, no quantization) and
+    # compares speed and masks.
+    from framesource import FrameSource
+    from maskstore import MaskStore
+    from modelprofile import run_profile, store_iou
+    warmup_prompts = prompts_before(prompts, warmup_frames)
+    if not warmup_prompts:
+        raise ValueError(f"No prompts on the first {warmup_frames} frames")
+    warmup_dir = os.path.join(workdir, "warmup")
+    os.makedirs(warmup_dir)
+    frames = FrameSource.from_dir(frames_dir)
+    frames.export_jpegs(warmup_dir,
+                        range(min(warmup_frames, len(frames))))
+    frames.close()
+
+    options = {"precision": precision, "quantize": quantize}
+    candidates = []
+    for num_threads, interop_threads in thread_candidates():
+        masks_dir = os.path.join(
+            workdir, f"candidate_{num_threads}_{interop_threads}")
+        result = run_profile(model, warmup_dir, warmup_prompts, masks_dir,
+                             options, (num_threads, interop_threads))
+        if result["status"] != "ok":
+            raise RuntimeError(f"Warm-up failed: {result['error']}")
+        print(f"{num_threads} threads, {interop_threads} inter-op: "
+              f"{result['frames_per_second']:.2f} frames/s")
+        candidates.append({"num_threads": num_threads,
+                           "interop_threads": interop_threads,
+                           "frames_per_second": result["frames_per_second"]})
+    best = max(candidates, key=lambda c: c["frames_per_second"])
+
+    baseline = run_profile(model, frames_dir, prompts,
+                           os.path.join(workdir, "baseline"))
+    tuned = run_profile(model, frames_dir, prompts,
+                        os.path.join(workdir, "tuned"), options,
+                        (best["num_threads"], best["interop_threads"]))
+    for name, result in (("Default", baseline), ("Tuned", tuned)):
+        if result["status"] != "ok":
+            raise RuntimeError(f"{name} run failed: {result['error']}")
+    agreement = store_iou(MaskStore().load(os.path.join(workdir, "tuned")),
+                          MaskStore().load(os.path.join(workdir, "baseline")))
+    return {
+        "model": model,
+        "precision": tuned["precision"],
+        "quantize": quantize,
+        "num_threads": best["num_threads"],
+        "interop_threads": best["interop_threads"],
+        "warmup_frames": warmup_frames,
+        "candidates": candidates,
+        "default_frames_per_second": baseline["frames_per_second"],
+        "frames_per_second": tuned["frames_per_second"],
+        "speedup": (tuned["frames_per_second"]
+                    / baseline["frames_per_second"]
+                    if baseline["frames_per_second"] else None),
+        **agreement,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tune CPU inference on this machine: time thread counts "
+                    "on a warm-up clip, cache the fastest, and compare the "
+                    "tuned CPU mode with the default path")
+    parser.add_argument("prompts", help="Prompts JSON for the clip")
+    parser.add_argument("--frames-dir", required=True,
+                        help="Extracted frames of the clip")
+    parser.add_argument("--model", default="base-plus",
+                        help="Short name or checkpoint id")
+    parser.add_argument("--precision", choices=PRECISIONS, default="auto")
+    parser.add_argument("--no-quantize", action="store_true",
+                        help="Keep the linear layers in floating point")
+    parser.add_argument("--warmup-frames", type=int, default=16,
+                        help="Frames each thread setting is timed on")
+    parser.add_argument("--output", help="Also write the report JSON here")
+    args = parser.parse_args(argv)
+
+    from sam2models import resolve_model_version
+    with open(args.prompts, "r") as f:
+        prompts = json.load(f)
+    workdir = tempfile.mkdtemp(prefix="meltseg_cputune_")
+    try:
+        settings = tune(resolve_model_version(args.model),
+                        os.path.abspath(args.frames_dir), prompts, workdir,
+                        args.precision, not args.no_quantize,
+                        args.warmup_frames)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    save_tuning(settings)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(settings, f, indent=2)
+    print(f"Saved to {tuning_path()} for {machine_key()}")
+    print(f"{settings['num_threads']} threads, {settings['interop_threads']} "
+          f"inter-op, {settings['precision']}"
+          f"{', int8 linear layers' if settings['quantize'] else ''}")
+    print(f"Default path: {settings['default_frames_per_second']:.2f} "
+          f"frames/s, CPU mode: {settings['frames_per_second']:.2f} frames/s "
+          f"({settings['speedup']:.2f}x)")
+    print(f"Mask IoU against the default path: mean "
+          f"{settings['mean_iou']:.3f}, min {settings['min_iou']:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
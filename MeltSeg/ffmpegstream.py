@@ -0,0 +1,83 @@
+import subprocess
+import tempfile
+import numpy as np
+
+
+class FFmpegFrameWriter:
+    def __init__(self, output_path: str, width: int, height: int,
+                 fps: float, codec: str = 'h264', crf: int = 23,
+                 pix_fmt: str = 'yuv420p'):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        self.log = ''
+
+        # yuv420p needs even dimensions, pad by one pixel when required
+        command = [
+            'ffmpeg', '-y',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{width}x{height}',
+            '-framerate', str(fps),
+            '-i', '-',
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', codec,
+            '-pix_fmt', pix_fmt,
+            '-crf', str(crf),
+            output_path
+        ]
+        # ffmpeg logs to stderr continuously; a spooled file avoids the pipe
+        # filling up and stalling the encoder on long recordings
+        self._log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=self._log)
+
+    def write(self, frame: np.ndarray):
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError(
+                f"Frame size {frame.shape[1]}x{frame.shape[0]} does not "
+                f"match stream size {self.width}x{self.height}")
+        if frame.ndim == 2:
+            frame = np.stack([frame] * 3, axis=-1)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            # Encoder exited early; the frame never reached it, so this
+            # fails with its log whatever its exit status
+            returncode = self._finish()
+            raise subprocess.CalledProcessError(
+                returncode, self.process.args, stderr=self.log) from None
+        self.frames_written += 1
+
+    def _finish(self):
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        if not self._log.closed:
+            self._log.seek(0)
+            self.log = self._log.read().decode(errors='replace')
+            self._log.close()
+        return returncode
+
+    def close(self):
+        returncode = self._finish()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.process.args,
+                                                stderr=self.log)
+        return self.frames_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.process.kill()
+            self._finish()
+        else:
+            self.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import cv2
+
+
+# Fill-in modes for frames SAM2 skipped
+FILL_MODES = ("nearest", "interpolate")
+
+
+def select_keyframes(frames, threshold: float, max_gap: int = 10,
+                     keep=(), width: int = 64) -> list:
+    # Indices of the frames of a FrameSource worth segmenting: a frame is
+    # kept once the mean absolute difference of its thumbnail (in 0-255
+    # gray levels) from the last kept frame's exceeds threshold, or max_gap
+    # frames after it. The first and last frames and every index in keep
+    # are always kept.
+    keep = set(keep)
+    keyframes = []
+    reference = None
+    for frame_idx in range(len(frames)):
+        thumbnail = frames.thumbnail(frame_idx, width)
+        if (reference is None or frame_idx in keep
+                or frame_idx == len(frames) - 1
+                or frame_idx - keyframes[-1] >= max_gap
+                or np.abs(thumbnail - reference).mean() > threshold):
+            keyframes.append(frame_idx)
+            reference = thumbnail
+    return keyframes
+
+
+def _signed_distance(mask: np.ndarray) -> np.ndarray:
+    # Negative inside the mask, positive outside
+    mask = mask.astype(np.uint8)
+    inside = cv2.distanceTransform(mask, cv2.DIST_L2, 3)
+    outside = cv2.distanceTransform(1 - mask, cv2.DIST_L2, 3)
+    return outside - inside
+
+
+def fill_gap(store, first: int, last: int, mode: str = "nearest"):
+    # Fills the frames strictly between two segmented frames of a MaskStore
+    # and returns their indices. "nearest" copies the earlier frame's packed
+    # masks: select_keyframes measured every skipped frame against it, so
+    # it is the nearest in content even when the later one is closer in
+    # time. "interpolate" blends the signed distance fields of both, for
+    # objects present on both sides, which suits slow drift.
+    first, last = sorted((first, last))
+    filled = list(range(first + 1, last))
+    if not filled:
+        return filled
+    shared = [obj_id for obj_id in store.object_ids(first)
+              if obj_id in store.object_ids(last)]
+    distances = {}
+    if mode == "interpolate":
+        distances = {obj_id: (_signed_distance(store.get(first, obj_id)[0]),
+                              _signed_distance(store.get(last, obj_id)[0]))
+                     for obj_id in shared}
+    for frame_idx in filled:
+        t = (frame_idx - first) / (last - first)
+        for obj_id in store.object_ids(first):
+            if obj_id in distances:
+                before, after = distances[obj_id]
+                mask = ((1 - t) * before + t * after) < 0
+                store.put(frame_idx, obj_id, mask[None])
+            else:
+                store.put_packed(frame_idx, obj_id,
+                                 store.get_packed(first, obj_id).tobytes())
+    return filled
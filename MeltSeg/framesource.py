@@ -0,0 +1,294 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from overlay import to_rgb_array
+from framestore import FrameStore, frame_store_path
+
+# torch is only imported by the SAM2 adapters below: the annotation tool
+# uses FrameSource before anything has loaded torch
+
+
+# Normalisation SAM2 applies to its input frames
+SAM2_IMG_MEAN = (0.485, 0.456, 0.406)
+SAM2_IMG_STD = (0.229, 0.224, 0.225)
+
+
+def list_frame_paths(frame_dir: str):
+    # Same order and filter as SAM2's JPEG loader, so a frame's position is
+    # its SAM2 frame index
+    frame_names = [
+        p for p in os.listdir(frame_dir)
+        if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
+    ]
+    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+    return [os.path.join(frame_dir, p) for p in frame_names]
+
+
+def link_frames(frame_paths: list, window_dir: str):
+    # Exposes a slice of the frames directory under local 0-based names
+    for local_idx, path in enumerate(frame_paths):
+        target = os.path.join(window_dir,
+                              f"{local_idx:05d}{os.path.splitext(path)[1]}")
+        try:
+            os.symlink(os.path.abspath(path), target)
+        except OSError:
+            shutil.copy(path, target)
+
+
+def _gray_thumbnail(img: Image.Image, width: int) -> np.ndarray:
+    img = img.convert("L")
+    height = max(1, round(img.height * width / img.width))
+    return np.asarray(img.resize((width, height), Image.Resampling.BILINEAR),
+                      dtype=np.float32)
+
+
+class FrameSource:
+    # Decodes frames on demand on background threads and keeps the
+    # cache_frames most recently used ones as read-only RGB arrays. Every
+    # get() also queues the next `prefetch` frames in the reader's direction
+    # of access, so a pass over the video rarely waits on a decode. One
+    # source is shared by the annotation tool, inference and the overlay;
+    # each passes its own reader name so that, e.g., compositing running
+    # alongside a reverse propagation pass does not flip its direction.
+
+    # Path of the memory-mapped frame store frames come from, if any
+    store_path = None
+
+    def __init__(self, frame_paths: list, cache_frames: int = 64,
+                 workers: int = 2, prefetch: int = 8):
+        self.paths = list(frame_paths)
+        self.cache_frames = max(cache_frames, prefetch + 1)
+        self.prefetch_frames = prefetch
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._loading = {}
+        # Last frame index each reader asked for
+        self._last = {}
+        self._lock = threading.Lock()
+        # Subclasses that never decode pass workers=0
+        self._executor = None
+        if workers:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="meltseg-frames")
+
+    @classmethod
+    def from_dir(cls, frame_dir: str, **kwargs):
+        # A frame store written at extraction takes the place of the images
+        store_path = frame_store_path(frame_dir)
+        if store_path is not None:
+            return StoredFrameSource(FrameStore(store_path))
+        return cls(list_frame_paths(frame_dir), **kwargs)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _decode(self, frame_idx: int):
+        try:
+            with Image.open(self.paths[frame_idx]) as img:
+                frame = to_rgb_array(img)
+            frame.flags.writeable = False
+            with self._lock:
+                self._cache[frame_idx] = frame
+                self._cache.move_to_end(frame_idx)
+                while len(self._cache) > self.cache_frames:
+                    self._cache.popitem(last=False)
+            return frame
+        finally:
+            with self._lock:
+                self._loading.pop(frame_idx, None)
+
+    def _request(self, frame_idx: int):
+        # Caller holds the lock; returns the cached frame or a pending decode
+        if frame_idx in self._cache:
+            self._cache.move_to_end(frame_idx)
+            return self._cache[frame_idx]
+        if frame_idx not in self._loading:
+            self._loading[frame_idx] = self._executor.submit(self._decode,
+                                                             frame_idx)
+        return self._loading[frame_idx]
+
+    def get(self, frame_idx: int, reader: str | None = None) -> np.ndarray:
+        with self._lock:
+            step = -1 if frame_idx < self._last.get(reader, -1) else 1
+            self._last[reader] = frame_idx
+            frame = self._request(frame_idx)
+            if isinstance(frame, np.ndarray):
+                self.hits += 1
+            else:
+                self.misses += 1
+            for ahead in range(1, self.prefetch_frames + 1):
+                idx = frame_idx + step * ahead
+                if 0 <= idx < len(self.paths):
+                    self._request(idx)
+        if not isinstance(frame, np.ndarray):
+            frame = frame.result()
+        return frame
+
+    def image(self, frame_idx: int) -> Image.Image:
+        return Image.fromarray(self.get(frame_idx))
+
+    def thumbnail(self, frame_idx: int, width: int = 64) -> np.ndarray:
+        # Grayscale thumbnail for cheap frame comparisons; draft() lets the
+        # JPEG decoder downscale by up to 8x in the DCT domain, so this
+        # costs a fraction of a full decode
+        with Image.open(self.paths[frame_idx]) as img:
+            img.draft("L", (width, width))
+            return _gray_thumbnail(img, width)
+
+    def export_jpegs(self, directory: str, frame_indices=None):
+        # The frames under local 0-based names, for SAM2's own loader
+        if frame_indices is None:
+            frame_indices = range(len(self))
+        link_frames([self.paths[i] for i in frame_indices], directory)
+
+    def video_index(self, frame_idx: int) -> int:
+        return frame_idx
+
+    def window(self, start: int, end: int):
+        return FrameSubset(self, range(start, end))
+
+    def subset(self, frame_indices):
+        return FrameSubset(self, frame_indices)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._cache.clear()
+
+
+class StoredFrameSource(FrameSource):
+    # Frames read from a memory-mapped frame store: get() returns a view of
+    # the mapped file, so there is nothing to decode, cache or prefetch and
+    # every reader shares the same page-cache pages
+    def __init__(self, store: FrameStore):
+        directory = os.path.dirname(os.path.abspath(store.path))
+        # Frame names for exports and checkpoints; no file exists under them
+        super().__init__([os.path.join(directory, f"{i:05d}")
+                          for i in range(len(store))], workers=0,
+                         prefetch=0)
+        self.store = store
+        self.store_path = store.path
+
+    def get(self, frame_idx: int, reader: str | None = None) -> np.ndarray:
+        self.hits += 1
+        return self.store.get(frame_idx)
+
+    def thumbnail(self, frame_idx: int, width: int = 64) -> np.ndarray:
+        return _gray_thumbnail(Image.fromarray(self.get(frame_idx)), width)
+
+    def export_jpegs(self, directory: str, frame_indices=None):
+        if frame_indices is None:
+            frame_indices = range(len(self))
+        for local_idx, frame_idx in enumerate(frame_indices):
+            Image.fromarray(self.get(frame_idx)).save(
+                os.path.join(directory, f"{local_idx:05d}.jpg"), quality=95)
+
+    def close(self):
+        super().close()
+        self.store.close()
+
+
+class FrameSubset:
+    # The given frames of a FrameSource (a window, or the frames kept by
+    # frame skipping) renumbered from zero, sharing its decode cache
+    def __init__(self, source: FrameSource, frame_indices):
+        self.source = source
+        self.frame_indices = frame_indices
+        self.paths = [source.paths[i] for i in frame_indices]
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    def get(self, frame_idx: int, reader: str | None = None) -> np.ndarray:
+        return self.source.get(self.frame_indices[frame_idx], reader)
+
+    def video_index(self, frame_idx: int) -> int:
+        return self.frame_indices[frame_idx]
+
+    def export_jpegs(self, directory: str):
+        self.source.export_jpegs(directory, self.frame_indices)
+
+    def window(self, start: int, end: int):
+        return FrameSubset(self.source, self.frame_indices[start:end])
+
+
+class SAM2Frames:
+    # Stands in for the frame tensors SAM2's loader returns: indexing yields
+    # the normalised (3, image_size, image_size) tensor of a frame, decoded
+    # through the frame source only when SAM2 asks for it
+    def __init__(self, frames, image_size: int, device):
+        import torch
+        self.frames = frames
+        self.image_size = image_size
+        self.device = device
+        self.mean = torch.tensor(SAM2_IMG_MEAN, dtype=torch.float32)[:, None, None]
+        self.std = torch.tensor(SAM2_IMG_STD, dtype=torch.float32)[:, None, None]
+        self.video_height, self.video_width = frames.get(0).shape[:2]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, frame_idx: int):
+        import torch
+        img = Image.fromarray(self.frames.get(frame_idx, "sam2")).resize(
+            (self.image_size, self.image_size))
+        img = torch.from_numpy(np.asarray(img, dtype=np.float32) / 255.0)
+        img = (img.permute(2, 0, 1) - self.mean) / self.std
+        return img.to(self.device, non_blocking=True)
+
+
+_loader_lock = threading.Lock()
+
+
+def _loader_module(predictor):
+    # The module whose load_video_frames the predictor's init_state calls
+    for cls in type(predictor).__mro__:
+        if "init_state" in vars(cls):
+            return sys.modules.get(cls.__module__)
+    return None
+
+
+def init_state(predictor, frames, **kwargs):
+    # SAM2's init_state only takes a JPEG directory and decodes all of it
+    # up front. Its frame loader is swapped for the frame source while it
+    # runs, so only frame 0 is decoded before propagation starts. Without
+    # that hook the frames are linked into a directory and SAM2 loads them
+    # asynchronously itself.
+    module = _loader_module(predictor)
+    load_video_frames = getattr(module, "load_video_frames", None)
+    if load_video_frames is None:
+        window_dir = tempfile.TemporaryDirectory(prefix="meltseg_frames_")
+        frames.export_jpegs(window_dir.name)
+        state = predictor.init_state(window_dir.name,
+                                     async_loading_frames=True, **kwargs)
+        # Lives as long as the state's loader reads from it
+        state["meltseg_frames_dir"] = window_dir
+        return state
+
+    def load_from_source(video_path, image_size, offload_video_to_cpu=False,
+                         compute_device=None, **_):
+        import torch
+        if offload_video_to_cpu:
+            device = torch.device("cpu")
+        elif compute_device is not None:
+            device = compute_device
+        else:
+            device = torch.device("cuda")
+        images = SAM2Frames(frames, image_size, device)
+        return images, images.video_height, images.video_width
+
+    with _loader_lock:
+        module.load_video_frames = load_from_source
+        try:
+            return predictor.init_state(os.path.dirname(frames.paths[0]),
+                                        **kwargs)
+        finally:
+            module.load_video_frames = load_video_frames
@@ -0,0 +1,172 @@
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+import numpy as np
+
+
+# A frame store is one file holding every extracted frame as raw RGB:
+#   header   magic, version, width, height, channels, frame count and the
+#            offset of the index
+#   frames   frame_count * height * width * channels bytes from DATA_OFFSET
+#   index    frame_count little-endian uint64 offsets, one per frame
+# Readers map the file and hand out views into it, so annotation, SAM2 and
+# the overlay all share the same page-cache pages and nothing is decoded.
+FRAME_STORE_NAME = "frames.msf"
+MAGIC = b"MSFRAMES"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIQQ")
+# Page-aligned so the first frame starts on a page boundary
+DATA_OFFSET = 4096
+
+
+def frame_store_path(frames_dir: str) -> str | None:
+    path = os.path.join(frames_dir, FRAME_STORE_NAME)
+    return path if os.path.exists(path) else None
+
+
+class FrameStoreWriter:
+    # Appends frames to a temporary file and moves it into place on close(),
+    # so readers never see a store without its index
+    def __init__(self, path: str, width: int, height: int,
+                 channels: int = 3):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.frame_bytes = width * height * channels
+        self.offsets = []
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".msf.tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.file.seek(DATA_OFFSET)
+
+    def write(self, frame):
+        # An (height, width, channels) uint8 array or its raw bytes
+        frame = memoryview(np.ascontiguousarray(frame, dtype=np.uint8)
+                           if isinstance(frame, np.ndarray) else frame)
+        if frame.nbytes != self.frame_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not match "
+                             f"the store's {self.width}x{self.height}x"
+                             f"{self.channels}")
+        self.offsets.append(self.file.tell())
+        self.file.write(frame)
+
+    def close(self):
+        index_offset = self.file.tell()
+        self.file.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.width, self.height,
+                                    self.channels, len(self.offsets),
+                                    index_offset))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return len(self.offsets)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class FrameStore:
+    # Read-only memory map of a frame store; get() returns a read-only view
+    # of the mapped frame without copying it
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, width, height, channels, frame_count,
+         index_offset) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a frame store")
+        if version != VERSION:
+            raise ValueError(f"Unsupported frame store version {version}")
+        self.width = width
+        self.height = height
+        self.shape = (height, width, channels)
+        self.frame_bytes = height * width * channels
+        # Copied so that no array but the frame views holds on to the map
+        self.offsets = np.frombuffer(self._map, dtype="<u8",
+                                     count=frame_count,
+                                     offset=index_offset).copy()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, frame_idx: int) -> np.ndarray:
+        # The view holds a buffer export on the map until it is freed
+        return np.frombuffer(self._map, dtype=np.uint8,
+                             count=self.frame_bytes,
+                             offset=int(self.offsets[frame_idx])
+                             ).reshape(self.shape)
+
+    def close(self):
+        # Unmaps the file now, or, while views are still alive, when the
+        # last of them is freed and releases its export
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self.offsets = None
+        self._map = None
+
+
+def _read_ppm_header(stream):
+    # ffmpeg's PPM encoder writes a fixed "P6\n<width> <height>\n255\n"
+    magic = stream.readline()
+    if not magic:
+        return None
+    if magic.strip() != b"P6":
+        raise ValueError("Expected a PPM frame from ffmpeg")
+    width, height = (int(v) for v in stream.readline().split())
+    if int(stream.readline()) != 255:
+        raise ValueError("Only 8-bit PPM frames are supported")
+    return width, height
+
+
+def write_frame_store(command: list, path: str) -> int:
+    # Runs an ffmpeg command that writes PPM frames to stdout (image2pipe)
+    # and stores them, taking the frame size from the stream itself
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=log)
+        writer = None
+        try:
+            while True:
+                size = _read_ppm_header(process.stdout)
+                if size is None:
+                    break
+                if writer is None:
+                    writer = FrameStoreWriter(path, *size)
+                elif size != (writer.width, writer.height):
+                    raise ValueError("Frame size changed mid-stream")
+                frame = process.stdout.read(writer.frame_bytes)
+                if len(frame) != writer.frame_bytes:
+                    raise ValueError("Truncated frame in ffmpeg output")
+                writer.write(frame)
+            returncode = process.wait()
+            if returncode != 0:
+                log.seek(0)
+                raise subprocess.CalledProcessError(
+                    returncode, command,
+                    stderr=log.read().decode(errors="replace"))
+            if writer is None:
+                raise ValueError("ffmpeg produced no frames")
+        except BaseException:
+            process.kill()
+            process.wait()
+            if writer is not None:
+                writer.abort()
+            raise
+        return writer.close()
@@ -0,0 +1,153 @@
+import csv
+import numpy as np
+import torch
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+GEOMETRY_COLUMNS = [
+    "frame", "object", "area", "centroid_x", "centroid_y",
+    "bbox_x0", "bbox_y0", "bbox_x1", "bbox_y1",
+    "length", "width", "orientation", "perimeter",
+]
+
+
+def mask_geometry(masks: torch.Tensor) -> np.ndarray:
+    # Per-object melt pool geometry of an (objects, height, width) boolean
+    # tensor, in pixels, as one row per object of GEOMETRY_COLUMNS[2:].
+    # Only row/column projections and edge counts leave the device; the
+    # moments are finished in float64 on the CPU. length and width are the
+    # axes of the ellipse with the same second moments, orientation is the
+    # major axis angle in degrees from +x towards +y (down the image) and
+    # perimeter counts pixel edges. Empty masks give NaN centroids, boxes
+    # and axes.
+    _, height, width = masks.shape
+    # Under the bf16 autocast of propagation the matmul would lose precision
+    with torch.autocast(masks.device.type, enabled=False):
+        row_counts = masks.sum(dim=2)
+        col_counts = masks.sum(dim=1)
+        xs = torch.arange(width, device=masks.device, dtype=torch.float32)
+        row_x = masks.to(torch.float32) @ xs
+        edges = ((masks[:, 1:] != masks[:, :-1]).sum(dim=(1, 2))
+                 + (masks[:, :, 1:] != masks[:, :, :-1]).sum(dim=(1, 2))
+                 + masks[:, 0].sum(dim=1) + masks[:, -1].sum(dim=1)
+                 + masks[:, :, 0].sum(dim=1) + masks[:, :, -1].sum(dim=1))
+    row_counts, col_counts, row_x, edges = (
+        t.cpu().numpy().astype(np.float64)
+        for t in (row_counts, col_counts, row_x, edges))
+
+    ys = np.arange(height, dtype=np.float64)
+    xs = np.arange(width, dtype=np.float64)
+    area = row_counts.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cx = col_counts @ xs / area
+        cy = row_counts @ ys / area
+        mu20 = col_counts @ xs ** 2 / area - cx ** 2
+        mu02 = row_counts @ ys ** 2 / area - cy ** 2
+        mu11 = row_x @ ys / area - cx * cy
+    half_sum = (mu20 + mu02) / 2
+    half_diff = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    length = 4 * np.sqrt(np.maximum(half_sum + half_diff, 0))
+    minor = 4 * np.sqrt(np.maximum(half_sum - half_diff, 0))
+    orientation = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+
+    rows = row_counts > 0
+    cols = col_counts > 0
+    bbox = np.stack([cols.argmax(axis=1), rows.argmax(axis=1),
+                     width - cols[:, ::-1].argmax(axis=1),
+                     height - rows[:, ::-1].argmax(axis=1)],
+                    axis=1).astype(np.float64)
+    empty = area == 0
+    bbox[empty] = np.nan
+    length[empty] = minor[empty] = orientation[empty] = np.nan
+    return np.column_stack([area, cx, cy, bbox, length, minor, orientation,
+                            edges])
+
+
+class GeometryWriter:
+    # Streams geometry rows to CSV, or to Parquet in row groups of
+    # row_group_size when the path ends in .parquet (needs pyarrow). Rows
+    # arrive in propagation order (the reverse pass first); close() rewrites
+    # the file in frame order if they were not already.
+    def __init__(self, path: str, row_group_size: int = 4096):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._pending = []
+        self._last_frame = -1
+        self._in_order = True
+        if self.parquet:
+            if pyarrow is None:
+                raise ImportError("Parquet geometry output needs pyarrow")
+            schema = pyarrow.schema(
+                [("frame", pyarrow.int64()), ("object", pyarrow.string())]
+                + [(name, pyarrow.float64())
+                   for name in GEOMETRY_COLUMNS[2:]])
+            self._writer = pyarrow.parquet.ParquetWriter(path, schema)
+        else:
+            self._file = open(path, "w", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(GEOMETRY_COLUMNS)
+
+    def write(self, frame_idx: int, object_ids: list, masks: torch.Tensor):
+        if not len(object_ids):
+            return
+        if frame_idx < self._last_frame:
+            self._in_order = False
+        self._last_frame = frame_idx
+        stats = mask_geometry(masks)
+        for obj_id, values in zip(object_ids, stats):
+            row = [frame_idx, str(obj_id), *values.tolist()]
+            if self.parquet:
+                self._pending.append(row)
+            else:
+                self._writer.writerow(row)
+        self.rows += len(object_ids)
+        if len(self._pending) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            columns = list(zip(*self._pending))
+            self._writer.write_table(pyarrow.table(
+                {name: list(values)
+                 for name, values in zip(GEOMETRY_COLUMNS, columns)},
+                schema=self._writer.schema))
+            self._pending = []
+
+    def close(self):
+        if self.parquet:
+            self._flush()
+            self._writer.close()
+        else:
+            self._file.close()
+        if not self._in_order:
+            self._sort()
+
+    def _sort(self):
+        # Stable, so a frame's objects keep the order they were written in
+        if self.parquet:
+            table = pyarrow.parquet.read_table(self.path)
+            pyarrow.parquet.write_table(
+                table.sort_by([("frame", "ascending")]), self.path,
+                row_group_size=self.row_group_size)
+            return
+        with open(self.path, "r", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = sorted(reader, key=lambda row: int(row[0]))
+        with open(self.path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,357 @@
+import argparse
+import gc
+import os
+import secrets
+import stat
+import time
+import traceback
+from collections import OrderedDict, deque
+from multiprocessing.connection import Client, Listener
+import torch
+from sam2helpers import SAM2Pipeline
+from sam2models import resolve_model_version
+from pipelinecache import PipelineCache
+from instrumentation import RunMetrics, write_prometheus_textfile
+from cpuaccel import PRECISIONS, apply_tuned_threads
+from batchjobs import parse_size
+
+
+DEFAULT_ADDRESS = os.path.join(os.path.expanduser("~"), ".meltseg",
+                               "worker.sock")
+# Requests are pickled, so whoever holds the key can run code in the worker
+KEY_PATH = os.path.join(os.path.expanduser("~"), ".meltseg", "worker.key")
+
+
+def parse_address(address: str):
+    # "host:port" for TCP on platforms without Unix sockets, else a path
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in host:
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def explicit_authkey() -> bool:
+    return bool(os.environ.get("MELTSEG_WORKER_AUTHKEY"))
+
+
+def authkey(create: bool = False) -> bytes:
+    # MELTSEG_WORKER_AUTHKEY, else a random key kept in KEY_PATH, readable
+    # only by its owner and created by the first worker that serves
+    if explicit_authkey():
+        return os.environ["MELTSEG_WORKER_AUTHKEY"].encode()
+    if create and not os.path.exists(KEY_PATH):
+        os.makedirs(os.path.dirname(KEY_PATH), mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    try:
+        mode = os.stat(KEY_PATH).st_mode
+    except FileNotFoundError:
+        raise RuntimeError(f"No worker key in {KEY_PATH}; start the worker "
+                           f"first or set MELTSEG_WORKER_AUTHKEY") from None
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RuntimeError(f"{KEY_PATH} is accessible by other users; "
+                           f"chmod 600 it")
+    with open(KEY_PATH, "r") as f:
+        return f.read().strip().encode()
+
+
+def module_nbytes(module) -> int:
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class PredictorCache:
+    def __init__(self, memory_budget: int | None = None):
+        self.memory_budget = memory_budget
+        self.predictors = OrderedDict()  # model_version -> (predictor, bytes)
+        self.load_times = {}
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self.predictors.values())
+
+    def get(self, model_version: str, pipeline: SAM2Pipeline):
+        # Returns (predictor, cold_start); least recently used models are
+        # evicted once a new load pushes the cache over its memory budget
+        if model_version in self.predictors:
+            self.predictors.move_to_end(model_version)
+            return self.predictors[model_version][0], False
+        start = time.perf_counter()
+        predictor = pipeline.load_predictor()
+        self.load_times[model_version] = time.perf_counter() - start
+        nbytes = module_nbytes(predictor)
+        self.predictors[model_version] = (predictor, nbytes)
+        self.evict(keep=model_version)
+        return predictor, True
+
+    def evict(self, keep: str | None = None, model_version: str | None = None):
+        if model_version is not None:
+            evicted = [model_version] if self.predictors.pop(
+                model_version, None) else []
+        else:
+            evicted = []
+            while (self.memory_budget is not None
+                   and self.nbytes > self.memory_budget):
+                oldest = next(iter(self.predictors))
+                if oldest == keep:
+                    break
+                del self.predictors[oldest]
+                evicted.append(oldest)
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return evicted
+
+    def status(self):
+        return [{"model": model, "bytes": nbytes,
+                 "load_seconds": self.load_times.get(model)}
+                for model, (_, nbytes) in self.predictors.items()]
+
+
+class InferenceWorker:
+    def __init__(self, address: str = DEFAULT_ADDRESS,
+                 memory_budget: int | None = None,
+                 prometheus_path: str | None = None, **pipeline_options):
+        self.address = parse_address(address)
+        self.prometheus_path = prometheus_path
+        # Metrics of the most recent jobs, exported to prometheus_path
+        self.recent_metrics = deque(maxlen=100)
+        self.cache = PredictorCache(memory_budget)
+        self.pipeline_options = pipeline_options
+        self.jobs_served = 0
+        self.running = False
+
+    def segment(self, request: dict):
+        timings = {}
+        model_version = resolve_model_version(request["model"])
+        name = request.get("name") or os.path.basename(
+            os.path.normpath(request["frames_dir"]))
+        metrics = RunMetrics({"meltseg_job": name, "model": model_version})
+        pipeline = SAM2Pipeline(request["frames_dir"],
+                                request.get("output_fps"),
+                                model_version=model_version,
+                                frames_key=request.get("frames_key"),
+                                metrics=metrics,
+                                geometry_path=request.get("geometry"),
+                                checkpoint_dir=request.get("checkpoint_dir"),
+                                checkpoint_interval=request.get(
+                                    "checkpoint_interval", 500),
+                                roi_padding=request.get("roi_padding"),
+                                roi_track=request.get("roi_track", False),
+                                skip_threshold=request.get("skip_threshold"),
+                                skip_max_gap=request.get("skip_max_gap", 10),
+                                skip_fill=request.get("skip_fill", "nearest"),
+                                **self.pipeline_options)
+        try:
+            prompts = request["prompts"]
+            if isinstance(prompts, str):
+                prompts = pipeline.load_prompts(prompts)
+
+            cold_start = False
+            rendered = False
+            start = time.perf_counter()
+            if not pipeline.load_cached_masks(prompts):
+                predictor, cold_start = self.cache.get(model_version, pipeline)
+                timings["load_model"] = time.perf_counter() - start
+                start = time.perf_counter()
+                if (request.get("output")
+                        and not request.get("masked_frames_dir")):
+                    # Compositing and encoding overlap propagation
+                    pipeline.propagate_and_encode(prompts,
+                                                  request.get("alpha", 0.25),
+                                                  request["output"], predictor)
+                    rendered = True
+                else:
+                    pipeline.propagate(prompts, predictor)
+            timings["propagate_render" if rendered else "propagate"] = (
+                time.perf_counter() - start)
+            frames = len(pipeline.video_segments)
+
+            if request.get("output") and not rendered:
+                start = time.perf_counter()
+                pipeline.export_video(request.get("alpha", 0.25),
+                                      request["output"],
+                                      request.get("masked_frames_dir"))
+                timings["render"] = time.perf_counter() - start
+            if request.get("masks") or request.get("coco"):
+                start = time.perf_counter()
+                pipeline.export_masks(request.get("masks"),
+                                      request.get("coco"))
+                timings["export_masks"] = time.perf_counter() - start
+        finally:
+            pipeline.close()
+        self.jobs_served += 1
+        self.recent_metrics.append(metrics)
+        if self.prometheus_path:
+            write_prometheus_textfile(self.prometheus_path,
+                                      list(self.recent_metrics))
+        return {"frames": frames, "cold_start": cold_start,
+                "masks_cached": pipeline.masks_from_cache,
+                "resumed_from": pipeline.resumed_from,
+                "skipped_fraction": pipeline.skipped_fraction,
+                "restored_from": pipeline.restored_from,
+                "restore_seconds": pipeline.restore_seconds,
+                "timings": timings, "metrics": metrics.report()}
+
+    def handle(self, request: dict):
+        command = request.get("cmd")
+        if command == "segment":
+            return self.segment(request)
+        if command == "status":
+            return {"models": self.cache.status(),
+                    "bytes": self.cache.nbytes,
+                    "memory_budget": self.cache.memory_budget,
+                    "jobs_served": self.jobs_served,
+                    "pid": os.getpid()}
+        if command == "evict":
+            return {"evicted": self.cache.evict(
+                model_version=resolve_model_version(request["model"]))}
+        if command == "shutdown":
+            self.running = False
+            return {}
+        raise ValueError(f"Unknown command: {command}")
+
+    def serve(self):
+        if not isinstance(self.address, str) and not explicit_authkey():
+            # The generated key only exists on this machine, and anyone who
+            # reaches the port could otherwise try the socket
+            raise RuntimeError("A TCP worker needs MELTSEG_WORKER_AUTHKEY")
+        key = authkey(create=True)
+        if isinstance(self.address, str):
+            os.makedirs(os.path.dirname(self.address) or ".", exist_ok=True)
+            if os.path.exists(self.address):
+                os.remove(self.address)
+        self.running = True
+        # Requests are served one at a time; the predictors are not
+        # thread-safe and a single job already uses every core
+        with Listener(self.address, authkey=key) as listener:
+            print(f"MeltSeg inference worker listening on {self.address}")
+            while self.running:
+                with listener.accept() as conn:
+                    while self.running:
+                        try:
+                            request = conn.recv()
+                        except EOFError:
+                            break
+                        try:
+                            response = {"status": "ok",
+                                        **self.handle(request)}
+                        except Exception as e:
+                            response = {"status": "error",
+                                        "error": f"{type(e).__name__}: {e}",
+                                        "traceback": traceback.format_exc()}
+                        conn.send(response)
+
+
+class InferenceClient:
+    def __init__(self, address: str = DEFAULT_ADDRESS):
+        self.conn = Client(parse_address(address), authkey=authkey())
+
+    def request(self, **request):
+        self.conn.send(request)
+        response = self.conn.recv()
+        if response["status"] != "ok":
+            raise RuntimeError(response["error"])
+        return response
+
+    def segment(self, frames_dir: str, prompts: str | dict, model: str,
+                output: str | None = None, output_fps: float | None = None,
+                alpha: float = 0.25, masked_frames_dir: str | None = None,
+                frames_key: str | None = None, masks: str | None = None,
+                coco: str | None = None, geometry: str | None = None,
+                checkpoint_dir: str | None = None,
+                roi_padding: int | None = None, roi_track: bool = False,
+                skip_threshold: float | None = None, skip_max_gap: int = 10,
+                skip_fill: str = "nearest", name: str | None = None,
+                checkpoint_interval: int = 500):
+        # name labels the job's metrics (default: the frames folder's name)
+        return self.request(cmd="segment", name=name, frames_dir=frames_dir,
+                            prompts=prompts, model=model, output=output,
+                            output_fps=output_fps, alpha=alpha,
+                            masked_frames_dir=masked_frames_dir,
+                            frames_key=frames_key, masks=masks, coco=coco,
+                            geometry=geometry, checkpoint_dir=checkpoint_dir,
+                            checkpoint_interval=checkpoint_interval,
+                            roi_padding=roi_padding, roi_track=roi_track,
+                            skip_threshold=skip_threshold,
+                            skip_max_gap=skip_max_gap, skip_fill=skip_fill)
+
+    def status(self):
+        return self.request(cmd="status")
+
+    def evict(self, model: str):
+        return self.request(cmd="evict", model=model)
+
+    def shutdown(self):
+        return self.request(cmd="shutdown")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Long-lived SAM2 worker that keeps predictors loaded "
+                    "between jobs")
+    parser.add_argument("command", choices=["serve", "status", "shutdown"])
+    parser.add_argument("--address", default=DEFAULT_ADDRESS,
+                        help="Unix socket path or host:port")
+    parser.add_argument("--memory-budget",
+                        help="Bytes of loaded model weights to keep, e.g. 6G")
+    parser.add_argument("--render-workers", type=int, default=1,
+                        help="Overlay render workers, 0 for every core")
+    parser.add_argument("--window-size", type=int,
+                        help="Propagate in overlapping windows of this many "
+                             "frames")
+    parser.add_argument("--window-overlap", type=int, default=1)
+    parser.add_argument("--cache-dir",
+                        help="Reuse propagated masks from this cache")
+    parser.add_argument("--cache-size")
+    parser.add_argument("--prometheus-textfile",
+                        help="Export stage metrics of recent jobs to this "
+                             ".prom file")
+    parser.add_argument("--precision", choices=PRECISIONS,
+                        help="Propagation precision (default: bfloat16, "
+                             "auto with --cpu-mode)")
+    parser.add_argument("--cpu-mode", action="store_true",
+                        help="Quantize the models' linear layers to int8 on "
+                             "the CPU and use the thread counts tuned by "
+                             "cpuaccel.py")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if args.cpu_mode:
+            apply_tuned_threads()
+        InferenceWorker(args.address, parse_size(args.memory_budget),
+                        prometheus_path=args.prometheus_textfile,
+                        render_workers=args.render_workers or None,
+                        window_size=args.window_size,
+                        window_overlap=args.window_overlap,
+                        precision=args.precision or (
+                            "auto" if args.cpu_mode else "bfloat16"),
+                        quantize=args.cpu_mode,
+                        cache=PipelineCache(args.cache_dir,
+                                            parse_size(args.cache_size))
+                        if args.cache_dir else None).serve()
+        return 0
+    with InferenceClient(args.address) as client:
+        response = getattr(client, args.command)()
+    print(response)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def current_rss() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_peak_rss() -> int:
+    # High-water mark of this process since it started
+    try:
+        import resource
+    except ImportError:
+        return current_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.frames = 0
+        self.peak_rss = 0
+        self.frame_latencies = []
+        self._last_tick = None
+
+    def tick(self, frames: int = 1, latency: bool = True):
+        # Call once per produced frame; the gaps become latency percentiles.
+        # Frames produced without work of their own (e.g. filled in between
+        # keyframes) pass latency=False and are only counted.
+        self.frames += frames
+        if not latency:
+            return
+        now = time.perf_counter()
+        if self._last_tick is not None:
+            self.frame_latencies.append(now - self._last_tick)
+        self._last_tick = now
+
+    def summary(self):
+        summary = {
+            "seconds": self.seconds,
+            "frames": self.frames,
+            "frames_per_second": (self.frames / self.seconds
+                                  if self.seconds else 0.0),
+            "peak_rss_bytes": self.peak_rss,
+        }
+        if self.frame_latencies:
+            latencies = np.asarray(self.frame_latencies)
+            summary["frame_latency_seconds"] = {
+                "p50": float(np.percentile(latencies, 50)),
+                "p90": float(np.percentile(latencies, 90)),
+                "p99": float(np.percentile(latencies, 99)),
+                "max": float(latencies.max()),
+            }
+        return summary
+
+
+class _RSSSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+class RunMetrics:
+    # Per-stage wall time, throughput, frame latency and peak RSS for one run.
+    # Stages with the same name accumulate, so windowed or chunked work can
+    # re-enter a stage.
+
+    def __init__(self, labels: dict | None = None,
+                 rss_interval: float = 0.05):
+        self.labels = labels or {}
+        self.rss_interval = rss_interval
+        self.stages = {}
+        # Run-level numbers that are not stage timings, e.g. the fraction of
+        # frames frame skipping left out
+        self.values = {}
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name: str, frames: int | None = None):
+        stage = self.stages.setdefault(name, StageMetrics(name))
+        sampler = _RSSSampler(self.rss_interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            stage.peak_rss = max(stage.peak_rss, sampler.stop())
+            stage._last_tick = None
+            if frames is not None:
+                stage.frames += frames
+
+    def report(self):
+        return {
+            "labels": self.labels,
+            "started": self.started,
+            "process_peak_rss_bytes": process_peak_rss(),
+            "stages": {name: stage.summary()
+                       for name, stage in self.stages.items()},
+            "values": self.values,
+        }
+
+    def write_report(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def prometheus_lines(self):
+        lines = []
+        for name, stage in self.stages.items():
+            summary = stage.summary()
+            labels = {**self.labels, "stage": name}
+            lines.append(("meltseg_stage_seconds", labels,
+                          summary["seconds"]))
+            lines.append(("meltseg_stage_frames_total", labels,
+                          summary["frames"]))
+            lines.append(("meltseg_stage_frames_per_second", labels,
+                          summary["frames_per_second"]))
+            lines.append(("meltseg_stage_peak_rss_bytes", labels,
+                          summary["peak_rss_bytes"]))
+            for quantile, key in (("0.5", "p50"), ("0.9", "p90"),
+                                  ("0.99", "p99")):
+                if "frame_latency_seconds" in summary:
+                    lines.append(("meltseg_stage_frame_latency_seconds",
+                                  {**labels, "quantile": quantile},
+                                  summary["frame_latency_seconds"][key]))
+        for name, value in self.values.items():
+            lines.append((f"meltseg_{name}", self.labels, value))
+        return lines
+
+
+METRIC_HELP = {
+    "meltseg_stage_seconds": ("gauge", "Wall time spent in a pipeline stage"),
+    "meltseg_stage_frames_total": ("gauge", "Frames processed by a stage"),
+    "meltseg_stage_frames_per_second": ("gauge", "Stage throughput"),
+    "meltseg_stage_peak_rss_bytes": ("gauge",
+                                     "Peak resident memory during a stage"),
+    "meltseg_stage_frame_latency_seconds": ("gauge",
+                                            "Per-frame latency quantiles"),
+    "meltseg_skipped_frame_fraction": ("gauge",
+                                       "Fraction of frames not sent to SAM2"),
+}
+
+
+def _label_value(value) -> str:
+    return re.sub(r'(["\\])', r'\\\1', str(value)).replace("\n", "\\n")
+
+
+def write_prometheus_textfile(path: str, runs: list):
+    # Node exporter's textfile collector reads *.prom files; writing to a
+    # temporary file and renaming keeps it from seeing a partial file. It
+    # rejects a file with the same series twice, so of several runs with
+    # the same labels only the last one is written.
+    samples = {}
+    for metrics in runs:
+        for metric, labels, value in metrics.prometheus_lines():
+            series = tuple(sorted((key, str(val))
+                                  for key, val in labels.items()))
+            samples.setdefault(metric, {})[series] = (labels, value)
+    out = []
+    for metric, values in samples.items():
+        # Run values added without a METRIC_HELP entry are plain gauges
+        kind, help_text = METRIC_HELP.get(metric, ("gauge", ""))
+        if help_text:
+            out.append(f"# HELP {metric} {help_text}")
+        out.append(f"# TYPE {metric} {kind}")
+        for labels, value in values.values():
+            label_text = ",".join(f'{key}="{_label_value(val)}"'
+                                  for key, val in labels.items())
+            out.append(f"{metric}{{{label_text}}} {float(value)}")
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".prom.tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(out) + "\n")
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
@@ -1,13 +1,69 @@
-from WeldPathTime import VideoProcessing
+import os
+from WeldPathTime import SEGMENTATION_FORMATS, VideoProcessing
 from FrameAnnotation import ImageAnnotationTool
+from framesource import FrameSource
 import tkinter as tk
-from sam2helpers import SAM2Boot
+from sam2models import SAM2ModelSelector
+from preload import ModelPreloader
+from cpuaccel import apply_tuned_threads
+from pipelinecache import PipelineCache
+from instrumentation import RunMetrics
+
+# sam2helpers (and with it torch and SAM2) is imported by the preloader
+# thread or after annotation, not before the first dialog
 
 if __name__ == "__main__":
-    video_preprocessing = VideoProcessing()
+    cache = PipelineCache.from_env()
+    metrics = RunMetrics()
+    # MELTSEG_CPU_MODE=1 runs the model with int8 linear layers, float32
+    # unless the CPU computes in bf16, and cpuaccel.py's tuned thread counts
+    cpu_mode = os.environ.get("MELTSEG_CPU_MODE") == "1"
+    precision = "auto" if cpu_mode else "bfloat16"
+    # MELTSEG_FRAME_FORMAT=store decodes the video once into a memory-mapped
+    # frame store instead of writing JPEGs
+    frame_format = os.environ.get("MELTSEG_FRAME_FORMAT", "jpeg")
+    if frame_format not in SEGMENTATION_FORMATS:
+        # The frame source only reads JPEG directories and frame stores
+        raise ValueError(f"MELTSEG_FRAME_FORMAT must be one of "
+                         f"{', '.join(SEGMENTATION_FORMATS)}")
+    video_preprocessing = VideoProcessing(
+        cache=cache, metrics=metrics, image_format=frame_format)
+    # Frames decoded while annotating are already cached for propagation
+    frames = FrameSource.from_dir(video_preprocessing.output_folder)
     root = tk.Tk()
     frameannotation = ImageAnnotationTool(root,
-                                          video_preprocessing.output_folder)
+                                          video_preprocessing.output_folder,
+                                          frames=frames)
+    # Chosen up front so the model loads while the user annotates
+    selector = SAM2ModelSelector(root)
+    root.wait_window(selector.top)
+    preloader = None
+    if selector.result:
+        preloader = ModelPreloader(selector.result, frames, metrics,
+                                   precision=precision, quantize=cpu_mode,
+                                   tuned_threads=cpu_mode)
+        preloader.start()
     root.mainloop()
+    predictor = inference_state = None
+    if preloader is not None:
+        try:
+            predictor, inference_state = preloader.result()
+        except Exception as e:
+            # The annotations are kept; SAM2Boot loads the model itself
+            print(f"Preloading {selector.result} failed ({e!r}); loading it "
+                  f"again after annotation")
+    if predictor is None and cpu_mode:
+        apply_tuned_threads()
+    from sam2helpers import SAM2Boot
+    # MELTSEG_CHECKPOINT_DIR keeps propagation progress across crashes
+    checkpoint_dir = os.environ.get("MELTSEG_CHECKPOINT_DIR")
+    if checkpoint_dir:
+        checkpoint_dir = os.path.join(checkpoint_dir, os.path.basename(
+            os.path.normpath(video_preprocessing.output_folder)))
     sam2 = SAM2Boot(video_preprocessing.output_folder,
-                    frameannotation.file_path, video_preprocessing.input_fps)
+                    frameannotation.file_path, video_preprocessing.input_fps,
+                    cache=cache, frames_key=video_preprocessing.frames_key,
+                    metrics=metrics, checkpoint_dir=checkpoint_dir,
+                    frame_source=frames, model_version=selector.result,
+                    predictor=predictor, inference_state=inference_state,
+                    precision=precision, quantize=cpu_mode)
@@ -0,0 +1,216 @@
+import json
+import os
+import zipfile
+import numpy as np
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+MASK_FORMATS = {
+    ".npz": "npz",
+    ".zarr": "zarr",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+}
+
+
+def mask_format(path: str) -> str:
+    extension = os.path.splitext(path.rstrip(os.sep))[1].lower()
+    if extension not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask export format for {path}; use one "
+                         f"of {', '.join(MASK_FORMATS)}")
+    return MASK_FORMATS[extension]
+
+
+def rle_counts(mask: np.ndarray) -> np.ndarray:
+    # COCO run lengths: column-major, starting with a run of zeros
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts
+
+
+def rle_string(counts) -> str:
+    # pycocotools' compressed "counts" string: deltas against the count two
+    # runs back, as 5-bit little-endian groups offset by 48
+    chars = []
+    for i, x in enumerate(int(c) for c in counts):
+        if i > 2:
+            x -= int(counts[i - 2])
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def encode_rle(mask: np.ndarray) -> dict:
+    return {"size": list(mask.shape),
+            "counts": rle_string(rle_counts(mask))}
+
+
+class _NPZWriter:
+    # One deflated .npy member per (object, frame); np.load reads members
+    # lazily, so any frame can be read without the rest
+    def __init__(self, path: str, frame_count: int, mask_shape: tuple):
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, frame_idx: int, obj_id, mask: np.ndarray):
+        with self.zip.open(f"{obj_id}/{frame_idx:06d}.npy", "w",
+                           force_zip64=True) as f:
+            np.lib.format.write_array(f, mask, allow_pickle=False)
+
+    def close(self):
+        self.zip.close()
+
+
+class _ZarrWriter:
+    # One (frames, height, width) boolean array per object, chunked by frame
+    def __init__(self, path: str, frame_count: int, mask_shape: tuple):
+        if zarr is None:
+            raise ImportError("Zarr mask export needs the zarr package")
+        self.group = zarr.open_group(path, mode="w")
+        self.shape = (frame_count, *mask_shape)
+        self.arrays = {}
+
+    def write(self, frame_idx: int, obj_id, mask: np.ndarray):
+        if obj_id not in self.arrays:
+            create = (getattr(self.group, "create_array", None)
+                      or self.group.create_dataset)
+            self.arrays[obj_id] = create(str(obj_id), shape=self.shape,
+                                         chunks=(1, *self.shape[1:]),
+                                         dtype=bool, fill_value=False)
+        self.arrays[obj_id][frame_idx] = mask
+
+    def close(self):
+        self.arrays = {}
+
+
+class _HDF5Writer:
+    def __init__(self, path: str, frame_count: int, mask_shape: tuple):
+        if h5py is None:
+            raise ImportError("HDF5 mask export needs the h5py package")
+        self.file = h5py.File(path, "w")
+        self.shape = (frame_count, *mask_shape)
+
+    def write(self, frame_idx: int, obj_id, mask: np.ndarray):
+        name = str(obj_id)
+        if name not in self.file:
+            self.file.create_dataset(name, shape=self.shape, dtype=bool,
+                                     chunks=(1, *self.shape[1:]),
+                                     compression="gzip", fillvalue=False)
+        self.file[name][frame_idx] = mask
+
+    def close(self):
+        self.file.close()
+
+
+MASK_WRITERS = {
+    "npz": _NPZWriter,
+    "zarr": _ZarrWriter,
+    "hdf5": _HDF5Writer,
+}
+
+
+class COCOWriter:
+    # Streams annotations into a COCO JSON with compressed RLE masks; only
+    # the image and category lists are held until close
+    def __init__(self, path: str, frame_names: list | None = None):
+        self.file = open(path, "w")
+        self.file.write('{"annotations": [\n')
+        self.frame_names = frame_names
+        self.images = {}
+        self.categories = {}
+        self.annotations = 0
+
+    def write(self, frame_idx: int, obj_id, mask: np.ndarray):
+        height, width = mask.shape
+        if frame_idx not in self.images:
+            file_name = (self.frame_names[frame_idx] if self.frame_names
+                         else f"{frame_idx:05d}.jpg")
+            self.images[frame_idx] = {"id": frame_idx,
+                                      "file_name": file_name,
+                                      "width": width, "height": height}
+        category = self.categories.setdefault(
+            obj_id, {"id": len(self.categories) + 1, "name": str(obj_id)})
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        bbox = ([int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1),
+                 int(rows[-1] - rows[0] + 1)] if rows.size else [0, 0, 0, 0])
+        annotation = {
+            "id": self.annotations + 1,
+            "image_id": frame_idx,
+            "category_id": category["id"],
+            "segmentation": encode_rle(mask),
+            "area": int(mask.sum()),
+            "bbox": bbox,
+            "iscrowd": 0,
+        }
+        if self.annotations:
+            self.file.write(",\n")
+        json.dump(annotation, self.file)
+        self.annotations += 1
+
+    def close(self):
+        self.file.write('\n],\n"images": ')
+        json.dump([self.images[i] for i in sorted(self.images)], self.file)
+        self.file.write(',\n"categories": ')
+        json.dump(list(self.categories.values()), self.file)
+        self.file.write("}\n")
+        self.file.close()
+
+
+class MaskExporter:
+    # Writes masks one frame at a time to a chunked, compressed store picked
+    # by extension (.npz, .zarr, .h5) and/or a COCO RLE JSON, so exporting
+    # never unpacks more than one frame's masks
+    def __init__(self, path: str | None, frame_count: int, mask_shape: tuple,
+                 coco_path: str | None = None,
+                 frame_names: list | None = None):
+        self.writers = []
+        for target in (path, coco_path):
+            if target:
+                os.makedirs(os.path.dirname(os.path.abspath(target)),
+                            exist_ok=True)
+        try:
+            if path:
+                self.writers.append(MASK_WRITERS[mask_format(path)](
+                    path, frame_count, tuple(mask_shape)))
+            if coco_path:
+                self.writers.append(COCOWriter(coco_path, frame_names))
+        except BaseException:
+            self.close()
+            raise
+
+    def write(self, frame_idx: int, masks: dict):
+        for obj_id, mask in masks.items():
+            # SAM2 masks carry a leading channel axis
+            mask = np.asarray(mask, dtype=bool).reshape(mask.shape[-2:])
+            for writer in self.writers:
+                writer.write(frame_idx, obj_id, mask)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
@@ -0,0 +1,203 @@
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+
+
+class MaskStore:
+    # Drop-in for the {frame_idx: {obj_id: mask}} dict of boolean arrays.
+    # Masks are packed to one bit per pixel; once max_memory_bytes is
+    # exceeded (immediately for 0) they spill to a memory-mapped file.
+    # Masks may be read on one thread while another stores new frames.
+
+    def __init__(self, spill_dir: str | None = None,
+                 max_memory_bytes: int | None = None):
+        self.spill_dir = spill_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.mask_shape = None
+        self.record_size = 0
+        self._index = {}  # frame_idx -> {obj_id: record slot or bytes}
+        self._memory = 0
+        self._spill_file = None
+        self._spill_path = None
+        self._num_records = 0
+        self._mmap = None
+        self._mmap_records = 0
+        self._lock = threading.RLock()
+
+    @property
+    def spilled(self):
+        return self._spill_file is not None
+
+    @property
+    def nbytes(self):
+        return self._memory
+
+    def _pack(self, mask: np.ndarray):
+        mask = np.asarray(mask, dtype=bool)
+        if self.mask_shape is None:
+            self.mask_shape = mask.shape
+            self.record_size = (mask.size + 7) // 8
+        elif mask.shape != self.mask_shape:
+            raise ValueError(f"Mask shape {mask.shape} does not match "
+                             f"store shape {self.mask_shape}")
+        return np.packbits(mask.ravel()).tobytes()
+
+    def _unpack(self, packed):
+        bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8),
+                             count=int(np.prod(self.mask_shape)))
+        return bits.view(bool).reshape(self.mask_shape)
+
+    def _open_spill(self):
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        fd, self._spill_path = tempfile.mkstemp(prefix="masks_",
+                                                suffix=".bin",
+                                                dir=self.spill_dir)
+        self._spill_file = os.fdopen(fd, "w+b")
+        # Move everything currently held in memory to disk
+        for masks in self._index.values():
+            for obj_id, packed in masks.items():
+                masks[obj_id] = self._append_record(packed)
+        self._memory = 0
+
+    def _append_record(self, packed: bytes):
+        self._spill_file.seek(self._num_records * self.record_size)
+        self._spill_file.write(packed)
+        slot = self._num_records
+        self._num_records += 1
+        return slot
+
+    def _read_record(self, slot: int):
+        if slot >= self._mmap_records:
+            self._spill_file.flush()
+            self._mmap = np.memmap(self._spill_file, dtype=np.uint8,
+                                   mode="r",
+                                   shape=(self._num_records,
+                                          self.record_size))
+            self._mmap_records = self._num_records
+        return self._mmap[slot]
+
+    def _should_spill(self):
+        if self.spilled or self.max_memory_bytes is None:
+            return False
+        return self._memory > self.max_memory_bytes
+
+    def put(self, frame_idx: int, obj_id, mask: np.ndarray):
+        self.put_packed(frame_idx, obj_id, self._pack(mask))
+
+    def put_packed(self, frame_idx: int, obj_id, packed: bytes):
+        with self._lock:
+            self._put_packed(frame_idx, obj_id, packed)
+
+    def _put_packed(self, frame_idx: int, obj_id, packed: bytes):
+        masks = self._index.setdefault(frame_idx, {})
+        if self.spilled:
+            masks[obj_id] = self._append_record(packed)
+        else:
+            if obj_id in masks:
+                self._memory -= len(masks[obj_id])
+            masks[obj_id] = packed
+            self._memory += len(packed)
+            if self._should_spill():
+                self._open_spill()
+
+    def get_packed(self, frame_idx: int, obj_id) -> np.ndarray:
+        with self._lock:
+            entry = self._index[frame_idx][obj_id]
+            if isinstance(entry, bytes):
+                return np.frombuffer(entry, dtype=np.uint8)
+            return self._read_record(entry)
+
+    def get(self, frame_idx: int, obj_id):
+        return self._unpack(self.get_packed(frame_idx, obj_id))
+
+    def object_ids(self, frame_idx: int):
+        return list(self._index[frame_idx])
+
+    def __setitem__(self, frame_idx: int, masks: dict):
+        for obj_id, mask in masks.items():
+            self.put(frame_idx, obj_id, mask)
+
+    def __getitem__(self, frame_idx: int):
+        return {obj_id: self.get(frame_idx, obj_id)
+                for obj_id in self._index[frame_idx]}
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def items(self):
+        for frame_idx in self._index:
+            yield frame_idx, self[frame_idx]
+
+    def values(self):
+        for frame_idx in self._index:
+            yield self[frame_idx]
+
+    def save(self, directory: str, frames: list | None = None):
+        # masks.npy holds one packed record per (frame, object) in index
+        # order; frames limits the save to those frames
+        os.makedirs(directory, exist_ok=True)
+        if frames is None:
+            frames = list(self._index)
+        index = []
+        records = np.lib.format.open_memmap(
+            os.path.join(directory, "masks.npy"), mode="w+", dtype=np.uint8,
+            shape=(sum(len(self._index[f]) for f in frames),
+                   self.record_size))
+        for frame_idx in frames:
+            for obj_id in self._index[frame_idx]:
+                records[len(index)] = self.get_packed(frame_idx, obj_id)
+                index.append([frame_idx, obj_id])
+        records.flush()
+        del records
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({"mask_shape": self.mask_shape, "index": index}, f)
+
+    def load(self, directory: str, before: int | None = None,
+             objects=None):
+        # before drops the frames from that index on, objects keeps only
+        # the masks of those object ids
+        with open(os.path.join(directory, "index.json"), "r") as f:
+            meta = json.load(f)
+        if not meta["index"]:
+            return self
+        records = np.load(os.path.join(directory, "masks.npy"),
+                          mmap_mode="r")
+        if self.mask_shape is None:
+            self.mask_shape = tuple(meta["mask_shape"])
+            self.record_size = records.shape[1]
+        for slot, (frame_idx, obj_id) in enumerate(meta["index"]):
+            if before is not None and frame_idx >= before:
+                continue
+            if objects is not None and obj_id not in objects:
+                continue
+            self.put_packed(frame_idx, obj_id, records[slot].tobytes())
+        return self
+
+    def close(self):
+        self._mmap = None
+        self._mmap_records = 0
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_path)
+            self._spill_file = None
+        self._index.clear()
+        self._memory = 0
+        self._num_records = 0
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,255 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from sam2models import SAM2_MODELS, resolve_model_version
+
+# torch and SAM2 are only imported in the spawned profiling processes, so
+# the GUI can read a profile report without loading them
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    if not union:
+        return 1.0
+    return float(np.logical_and(a, b).sum() / union)
+
+
+def store_iou(store, reference) -> dict:
+    # Mean and worst per-frame, per-object IoU against the reference masks;
+    # a frame or object missing on one side counts as 0
+    ious = []
+    for frame_idx in reference.keys():
+        for obj_id in reference.object_ids(frame_idx):
+            if frame_idx in store and obj_id in store.object_ids(frame_idx):
+                ious.append(mask_iou(store.get(frame_idx, obj_id),
+                                     reference.get(frame_idx, obj_id)))
+            else:
+                ious.append(0.0)
+    if not ious:
+        return {"mean_iou": None, "min_iou": None}
+    return {"mean_iou": float(np.mean(ious)), "min_iou": float(np.min(ious))}
+
+
+def _profile_process(model_version: str, frames_dir: str, prompts: dict,
+                     masks_dir: str, conn, options: dict, threads):
+    # A fresh process per run, so load time is a cold load and the peak
+    # memory is this model's alone. options are SAM2Pipeline keyword
+    # arguments, threads an optional (intra-op, inter-op) thread count.
+    import torch
+    if threads is not None:
+        from cpuaccel import apply_threads
+        apply_threads(*threads)
+    from sam2helpers import SAM2Pipeline
+    from instrumentation import RunMetrics, process_peak_rss
+    try:
+        metrics = RunMetrics({"model": model_version})
+        pipeline = SAM2Pipeline(frames_dir, model_version=model_version,
+                                metrics=metrics, **options)
+        with metrics.stage("load_model"):
+            predictor = pipeline.load_predictor()
+        pipeline.propagate(prompts, predictor)
+        pipeline.video_segments.save(masks_dir)
+        propagate = metrics.stages["propagate"].summary()
+        result = {
+            "model": model_version,
+            "status": "ok",
+            "precision": pipeline.precision,
+            "load_seconds": metrics.stages["load_model"].seconds,
+            "propagate_seconds": propagate["seconds"],
+            "frames": propagate["frames"],
+            "frames_per_second": propagate["frames_per_second"],
+            "peak_rss_bytes": process_peak_rss(),
+            "peak_gpu_bytes": (torch.cuda.max_memory_allocated()
+                               if torch.cuda.is_available() else None),
+        }
+        pipeline.close()
+    except Exception as e:
+        result = {"model": model_version, "status": "error",
+                  "error": f"{type(e).__name__}: {e}"}
+    conn.send(result)
+    conn.close()
+
+
+def run_profile(model_version: str, frames_dir: str, prompts: dict,
+                masks_dir: str, options: dict | None = None,
+                threads: tuple | None = None) -> dict:
+    # Propagates the clip in a spawned process and saves its masks to
+    # masks_dir; returns the timings and memory of the run
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_profile_process,
+                              args=(model_version, frames_dir, prompts,
+                                    masks_dir, child_conn, options or {},
+                                    threads))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"model": model_version, "status": "error",
+                  "error": "Profiling process died"}
+    process.join()
+    return result
+
+
+def profile_models(models: list, frames_dir: str, prompts: dict,
+                   reference: str, workdir: str) -> list:
+    # Runs every model on the clip (the reference too if it is not listed)
+    # and scores each against the reference's masks
+    from maskstore import MaskStore
+    models = [resolve_model_version(m) for m in models]
+    reference = resolve_model_version(reference)
+    if reference not in models:
+        models.append(reference)
+    results = []
+    for model_version in models:
+        masks_dir = os.path.join(workdir, model_version.replace("/", "_"))
+        result = run_profile(model_version, frames_dir, prompts, masks_dir)
+        result["masks_dir"] = masks_dir
+        print(f"{model_version}: {result['status']}")
+        results.append(result)
+
+    by_model = {r["model"]: r for r in results}
+    if by_model[reference]["status"] != "ok":
+        raise RuntimeError(f"Reference model {reference} failed: "
+                           f"{by_model[reference]['error']}")
+    reference_masks = MaskStore().load(by_model[reference]["masks_dir"])
+    for result in results:
+        result["reference"] = reference
+        if result["status"] == "ok":
+            result.update(store_iou(MaskStore().load(result["masks_dir"]),
+                                    reference_masks))
+        del result["masks_dir"]
+    return results
+
+
+def choose_model(results: list, min_iou: float) -> str | None:
+    # Fastest profiled model whose mean IoU against the reference reaches
+    # min_iou
+    eligible = [r for r in results if r["status"] == "ok"
+                and r.get("mean_iou") is not None
+                and r["mean_iou"] >= min_iou]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda r: r["frames_per_second"])["model"]
+
+
+def load_profile(profile_path: str) -> list:
+    with open(profile_path, "r") as f:
+        return json.load(f)["models"]
+
+
+def model_label(model_version: str) -> str:
+    for label, version in SAM2_MODELS.values():
+        if version == model_version:
+            return label
+    return model_version
+
+
+TABLE_COLUMNS = [
+    ("model", "model", "{}"),
+    ("load_seconds", "load s", "{:.1f}"),
+    ("frames_per_second", "frames/s", "{:.2f}"),
+    ("peak_rss_bytes", "peak RSS MiB", "{:.0f}"),
+    ("peak_gpu_bytes", "peak GPU MiB", "{:.0f}"),
+    ("mean_iou", "mean IoU", "{:.3f}"),
+    ("min_iou", "min IoU", "{:.3f}"),
+]
+
+
+def table_rows(results: list):
+    rows = []
+    for result in results:
+        row = []
+        for key, _, fmt in TABLE_COLUMNS:
+            value = result.get(key)
+            if key == "model":
+                value = model_label(value)
+            elif key.endswith("_bytes") and value is not None:
+                value = value / (1 << 20)
+            row.append("-" if value is None else fmt.format(value))
+        if result["status"] != "ok":
+            row[1:] = [result["status"]] + ["-"] * (len(row) - 2)
+        rows.append(row)
+    return rows
+
+
+def print_table(results: list):
+    header = [title for _, title, _ in TABLE_COLUMNS]
+    rows = table_rows(results)
+    widths = [max(len(str(cell)) for cell in column)
+              for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(cell).rjust(width)
+                        for cell, width in zip(row, widths)))
+
+
+def write_csv(path: str, results: list):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([title for _, title, _ in TABLE_COLUMNS])
+        writer.writerows(table_rows(results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the SAM2 checkpoints on a reference clip: load "
+                    "time, frames/s, peak memory and mask IoU against the "
+                    "reference model")
+    parser.add_argument("prompts", help="Prompts JSON for the clip")
+    clip = parser.add_mutually_exclusive_group(required=True)
+    clip.add_argument("--frames-dir", help="Extracted frames of the clip")
+    clip.add_argument("--video", help="Clip to extract first (needs --fps)")
+    parser.add_argument("--fps", type=int, help="Extraction fps for --video")
+    parser.add_argument("--models", nargs="+", default=list(SAM2_MODELS),
+                        help="Short names or checkpoint ids (default: all)")
+    parser.add_argument("--reference", default="large",
+                        help="Model the IoU is measured against")
+    parser.add_argument("--min-iou", type=float, default=0.9,
+                        help="Accuracy target for the recommended model")
+    parser.add_argument("--output", default="model_profile.json",
+                        help="Report JSON, usable as a manifest's "
+                             "\"model_profile\"")
+    parser.add_argument("--csv", help="Also write the table as CSV")
+    args = parser.parse_args(argv)
+    if args.video and not args.fps:
+        parser.error("--video needs --fps")
+
+    with open(args.prompts, "r") as f:
+        prompts = json.load(f)
+    workdir = tempfile.mkdtemp(prefix="meltseg_profile_")
+    try:
+        frames_dir = args.frames_dir
+        if args.video:
+            from WeldPathTime import VideoProcessing
+            frames_dir = os.path.join(workdir, "frames")
+            VideoProcessing(args.video, frames_dir, args.fps,
+                            interactive=False).run_extraction()
+        results = profile_models(args.models, os.path.abspath(frames_dir),
+                                 prompts, args.reference, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    recommended = choose_model(results, args.min_iou)
+    with open(args.output, "w") as f:
+        json.dump({"clip": args.frames_dir or args.video,
+                   "prompts": os.path.abspath(args.prompts),
+                   "min_iou": args.min_iou, "recommended": recommended,
+                   "models": results}, f, indent=2)
+    if args.csv:
+        write_csv(args.csv, results)
+    print_table(results)
+    if recommended is None:
+        print(f"No model reaches a mean IoU of {args.min_iou}")
+        return 1
+    print(f"Fastest model with mean IoU >= {args.min_iou}: {recommended}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+PALETTE = np.array([
+    (255, 0, 0),     # Red
+    (0, 255, 0),     # Green
+    (0, 0, 255),     # Blue
+    (255, 255, 0),   # Yellow
+    (255, 0, 255),   # Magenta
+    (0, 255, 255),   # Cyan
+    (255, 128, 0),   # Orange
+    (128, 0, 255),   # Purple
+    (0, 255, 128),   # Spring Green
+    (255, 128, 128)  # Light Pink
+], dtype=np.uint8)
+
+
+def to_rgb_array(img) -> np.ndarray:
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img)
+
+
+def mask_bbox(label_map: np.ndarray):
+    # Bounding box (y0, y1, x0, x1) of all labelled pixels over the trailing
+    # two axes, None when nothing is labelled
+    labelled = label_map != 0
+    while labelled.ndim > 2:
+        labelled = labelled.any(axis=0)
+    rows = np.flatnonzero(labelled.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(labelled[rows[0]:rows[-1] + 1].any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+class OverlayCompositor:
+    def __init__(self, alpha: float, palette: np.ndarray = PALETTE):
+        self.alpha = alpha
+        self.palette = np.asarray(palette, dtype=np.uint8)
+        # lut[label, channel, value]: label 0 is the identity, label n blends
+        # with palette[n - 1]. The image term is float32 and the color term
+        # float64 as in the previous float path, so truncation matches it.
+        values = np.arange(256, dtype=np.float32)
+        blended = ((1 - alpha) * values[None, None, :]
+                   + alpha * self.palette[:, :, None])
+        identity = np.broadcast_to(values, (1, 3, 256))
+        self.lut = np.concatenate([identity, blended]).astype(np.uint8)
+        self._channels = np.arange(3)
+
+    def label_map(self, masks: dict, shape: tuple) -> np.ndarray:
+        # Later objects win where masks overlap
+        labels = np.zeros(shape, dtype=np.uint8)
+        for num_id, mask in enumerate(masks.values()):
+            labels[np.asarray(mask).reshape(shape)] = \
+                num_id % len(self.palette) + 1
+        return labels
+
+    def composite(self, image: np.ndarray, labels: np.ndarray,
+                  out: np.ndarray | None = None) -> np.ndarray:
+        # Works on a single (H, W, 3) frame or a (N, H, W, 3) batch; only
+        # the bounding box of the labelled pixels is touched
+        if out is None:
+            out = image.copy()
+        elif out is not image:
+            out[...] = image
+        bbox = mask_bbox(labels)
+        if bbox is None:
+            return out
+        y0, y1, x0, x1 = bbox
+        region = image[..., y0:y1, x0:x1, :]
+        region_labels = labels[..., y0:y1, x0:x1, None]
+        out[..., y0:y1, x0:x1, :] = self.lut[region_labels, self._channels,
+                                             region]
+        return out
+
+    def render(self, image: np.ndarray, masks: dict) -> np.ndarray:
+        labels = self.label_map(masks, image.shape[:2])
+        return self.composite(image, labels)
+
+    def render_batch(self, images: np.ndarray, masks_batch: list) -> np.ndarray:
+        labels = np.stack([self.label_map(masks, images.shape[1:3])
+                           for masks in masks_batch])
+        return self.composite(images, labels)
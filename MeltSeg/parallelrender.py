@@ -0,0 +1,227 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+from overlay import OverlayCompositor, to_rgb_array
+from framestore import FrameStore
+
+
+_compositors = {}
+_frame_stores = {}
+# Shared memory held by chunks submitted but not yet consumed
+MAX_INFLIGHT_BYTES = 1 << 30
+
+
+def _compositor(alpha: float):
+    if alpha not in _compositors:
+        _compositors[alpha] = OverlayCompositor(alpha)
+    return _compositors[alpha]
+
+
+def _frame_store(path: str) -> FrameStore:
+    # Mapped once per worker; the pages are shared with every other reader
+    if path not in _frame_stores:
+        _frame_stores[path] = FrameStore(path)
+    return _frame_stores[path]
+
+
+def _attach(name: str, shape: tuple, dtype):
+    # Pool workers share the parent's resource tracker, which unlinks the
+    # block if the parent dies without releasing it
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _render_chunk(task: dict, packed=None, out=None):
+    # Runs in a worker: decode, composite and optionally encode one chunk.
+    # Masks arrive bit-packed through shared memory, rendered frames go back
+    # through a second shared block unless they are saved as JPEGs here.
+    blocks = []
+    try:
+        if packed is None:
+            shm, packed = _attach(task["mask_shm"], task["mask_shape"],
+                                  np.uint8)
+            blocks.append(shm)
+        if out is None and task["out_shm"] is not None:
+            shm, out = _attach(task["out_shm"], task["out_shape"], np.uint8)
+            blocks.append(shm)
+        compositor = _compositor(task["alpha"])
+        height, width = task["frame_size"]
+        for i, (frame_idx, path) in enumerate(zip(task["frame_indices"],
+                                                   task["frame_paths"])):
+            masks = {
+                obj: np.unpackbits(packed[i, obj],
+                                   count=height * width).view(bool)
+                for obj in range(task["object_counts"][i])
+            }
+            if task["frame_store"]:
+                image = _frame_store(task["frame_store"]).get(frame_idx)
+            else:
+                image = to_rgb_array(Image.open(path))
+            labels = compositor.label_map(masks, (height, width))
+            if out is not None:
+                compositor.composite(image, labels, out=out[i])
+            else:
+                blended = compositor.composite(image, labels)
+                Image.fromarray(blended).save(os.path.join(
+                    task["output_dir"], f"masked_frame_{frame_idx}.jpg"))
+    finally:
+        del packed, out
+        for shm in blocks:
+            shm.close()
+    return task["frame_indices"]
+
+
+class _Chunk:
+    # Shared memory blocks backing one chunk of frames, owned by the parent
+    def __init__(self, mask_shape: tuple, out_shape: tuple | None):
+        self.mask_shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(mask_shape)))
+        self.packed = np.ndarray(mask_shape, dtype=np.uint8,
+                                 buffer=self.mask_shm.buf)
+        self.out_shm = None
+        self.out = None
+        if out_shape is not None:
+            self.out_shm = shared_memory.SharedMemory(
+                create=True, size=int(np.prod(out_shape)))
+            self.out = np.ndarray(out_shape, dtype=np.uint8,
+                                  buffer=self.out_shm.buf)
+        self.task = None
+        self.future = None
+
+    def release(self):
+        # Views must be dropped before the blocks can be closed
+        self.packed = None
+        self.out = None
+        for shm in (self.mask_shm, self.out_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.mask_shm = self.out_shm = None
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in (self.mask_shm, self.out_shm)
+                   if shm is not None)
+
+
+class ParallelRenderer:
+    def __init__(self, frame_paths: list, mask_store, alpha: float,
+                 workers: int | None = None, chunk_size: int = 16,
+                 backend: str = "process", frame_store: str | None = None,
+                 max_inflight_bytes: int = MAX_INFLIGHT_BYTES):
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown render backend: {backend}")
+        self.frame_paths = frame_paths
+        # Frames are read from this frame store instead of frame_paths
+        self.frame_store = frame_store
+        self.mask_store = mask_store
+        self.alpha = alpha
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.backend = backend
+        self.max_inflight_bytes = max_inflight_bytes
+
+    def _executor(self):
+        if self.backend == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers)
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def _chunks(self, output_dir: str | None):
+        frame_indices = sorted(self.mask_store.keys())
+        if not frame_indices:
+            return
+        # Smaller chunks for large frames, so that two per worker still fit
+        # in max_inflight_bytes and every worker gets some
+        height, width = self.mask_store.mask_shape[-2:]
+        frame_bytes = self.mask_store.record_size
+        if output_dir is None:
+            frame_bytes += height * width * 3
+        chunk_size = max(1, min(self.chunk_size, self.max_inflight_bytes
+                                // (2 * self.workers * frame_bytes)))
+        for start in range(0, len(frame_indices), chunk_size):
+            yield frame_indices[start:start + chunk_size]
+
+    def _pack_chunk(self, frame_indices: list, output_dir: str | None):
+        store = self.mask_store
+        height, width = store.mask_shape[-2:]
+        object_counts = [len(store.object_ids(f)) for f in frame_indices]
+        mask_shape = (len(frame_indices), max(max(object_counts), 1),
+                      store.record_size)
+        out_shape = (len(frame_indices), height, width, 3)
+        chunk = _Chunk(mask_shape, out_shape if output_dir is None else None)
+        for i, frame_idx in enumerate(frame_indices):
+            for obj, obj_id in enumerate(store.object_ids(frame_idx)):
+                chunk.packed[i, obj] = store.get_packed(frame_idx, obj_id)
+        chunk.task = {
+            "frame_indices": frame_indices,
+            "frame_paths": [self.frame_paths[f] for f in frame_indices],
+            "frame_store": self.frame_store,
+            "object_counts": object_counts,
+            "frame_size": (height, width),
+            "alpha": self.alpha,
+            "mask_shm": chunk.mask_shm.name,
+            "mask_shape": mask_shape,
+            "out_shm": chunk.out_shm.name if chunk.out_shm else None,
+            "out_shape": out_shape,
+            "output_dir": output_dir,
+        }
+        return chunk
+
+    def _run(self, output_dir: str | None):
+        # Keeps at most two chunks per worker and max_inflight_bytes of
+        # shared memory in flight (always at least one chunk), and hands
+        # them back in submission order so output is deterministic
+        pending = []
+        inflight = 0
+        with self._executor() as executor:
+            try:
+                for frame_indices in self._chunks(output_dir):
+                    chunk = self._pack_chunk(frame_indices, output_dir)
+                    if self.backend == "thread":
+                        chunk.future = executor.submit(
+                            _render_chunk, chunk.task, chunk.packed, chunk.out)
+                    else:
+                        chunk.future = executor.submit(_render_chunk,
+                                                       chunk.task)
+                    pending.append(chunk)
+                    inflight += chunk.nbytes
+                    while pending and (len(pending) >= 2 * self.workers
+                                       or inflight > self.max_inflight_bytes):
+                        chunk = pending.pop(0)
+                        inflight -= chunk.nbytes
+                        yield self._collect(chunk)
+                while pending:
+                    yield self._collect(pending.pop(0))
+            finally:
+                for chunk in pending:
+                    chunk.future.cancel()
+                for chunk in pending:
+                    if not chunk.future.cancelled():
+                        chunk.future.exception()
+                    chunk.release()
+
+    def _collect(self, chunk: _Chunk):
+        try:
+            chunk.future.result()
+        except BaseException:
+            chunk.release()
+            raise
+        return chunk
+
+    def frames(self):
+        # Yields (frame_idx, rgb uint8 array) in frame order
+        for chunk in self._run(None):
+            try:
+                for i, frame_idx in enumerate(chunk.task["frame_indices"]):
+                    yield frame_idx, chunk.out[i].copy()
+            finally:
+                chunk.release()
+
+    def save(self, output_dir: str):
+        count = 0
+        for chunk in self._run(output_dir):
+            count += len(chunk.task["frame_indices"])
+            chunk.release()
+        return count
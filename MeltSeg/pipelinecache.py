@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+CACHE_VERSION = 1
+
+
+def link_file(src: str, dst: str):
+    # Hard links make cache hits and inserts free when both sides share a
+    # filesystem; otherwise the file is copied. Both names then share one
+    # inode, so linked files must be replaced, never rewritten in place.
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def link_tree(src_dir: str, dst_dir: str):
+    os.makedirs(dst_dir, exist_ok=True)
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        dst = os.path.join(dst_dir, name)
+        if os.path.isdir(src):
+            link_tree(src, dst)
+        else:
+            link_file(src, dst)
+
+
+def tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def digest(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, str)):
+            part = json.dumps(part, sort_keys=True, default=str)
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class PipelineCache:
+    # Content-addressed store of extracted frame directories and propagated
+    # mask stores. Frames are keyed on the video's content hash, fps and
+    # extraction options; masks on the frames key, prompts and model
+    # version. manifest.json records sizes and last use so the least
+    # recently used entries are evicted once max_bytes is exceeded.
+
+    def __init__(self, root: str, max_bytes: int | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(os.path.join(root, "entries"), exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    @classmethod
+    def from_env(cls):
+        # MELTSEG_CACHE_DIR enables the cache for the GUI, with an optional
+        # MELTSEG_CACHE_MAX_BYTES budget
+        root = os.environ.get("MELTSEG_CACHE_DIR")
+        if not root:
+            return None
+        max_bytes = os.environ.get("MELTSEG_CACHE_MAX_BYTES")
+        return cls(root, int(max_bytes) if max_bytes else None)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == CACHE_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {"version": CACHE_VERSION, "entries": {}, "file_hashes": {}}
+
+    @contextmanager
+    def _manifest_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_manifest(self):
+        # Concurrent jobs share the cache, so entries another process added
+        # since this one read the manifest are merged in rather than lost
+        with self._manifest_lock():
+            on_disk = self._read_manifest()
+            for key, entry in on_disk["entries"].items():
+                if (key not in self.manifest["entries"]
+                        and os.path.exists(self.entry_path(key))):
+                    self.manifest["entries"][key] = entry
+            for memo_key, file_hash in on_disk["file_hashes"].items():
+                self.manifest["file_hashes"].setdefault(memo_key, file_hash)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root, "entries", key)
+
+    @property
+    def nbytes(self):
+        return sum(e["bytes"] for e in self.manifest["entries"].values())
+
+    def file_hash(self, path: str) -> str:
+        # Hashing a multi-GB recording is slow, so results are remembered
+        # per (path, size, mtime)
+        stat = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        hashes = self.manifest["file_hashes"]
+        if memo_key not in hashes:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 24), b""):
+                    h.update(block)
+            hashes[memo_key] = h.hexdigest()
+            self._write_manifest()
+        return hashes[memo_key]
+
+    def directory_key(self, frames_dir: str) -> str:
+        # Identity of a frames directory that did not come from the cache
+        listing = []
+        for name in sorted(os.listdir(frames_dir)):
+            stat = os.stat(os.path.join(frames_dir, name))
+            listing.append((name, stat.st_size, stat.st_mtime_ns))
+        return digest("dir", os.path.abspath(frames_dir), listing)
+
+    def frames_key(self, video_path: str, fps, options: dict) -> str:
+        return digest("frames", self.file_hash(video_path), fps, options)
+
+    def masks_key(self, frames_key: str, prompts: dict, model_version: str,
+                  options: dict | None = None) -> str:
+        return digest("masks", frames_key, prompts, model_version,
+                      options or {})
+
+    def lookup(self, key: str) -> str | None:
+        entry = self.manifest["entries"].get(key)
+        path = self.entry_path(key)
+        if entry is None or not os.path.exists(path):
+            return None
+        entry["last_used"] = time.time()
+        self._write_manifest()
+        return path
+
+    def find(self, kind: str, meta: dict):
+        # Keys of entries inserted with this kind and meta, most recently
+        # used first
+        entries = self.manifest["entries"]
+        keys = [key for key, entry in entries.items()
+                if entry["kind"] == kind and entry.get("meta") == meta
+                and os.path.exists(self.entry_path(key))]
+        return sorted(keys, key=lambda k: entries[k]["last_used"],
+                      reverse=True)
+
+    @contextmanager
+    def insert(self, key: str, kind: str, meta: dict | None = None):
+        # Yields a staging directory that is moved into place and recorded
+        # only if the block finishes without an exception. meta is stored
+        # with the entry so related entries can be found with find().
+        staging = tempfile.mkdtemp(prefix=f".{kind}_", dir=self.root)
+        try:
+            yield staging
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        path = self.entry_path(key)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(staging, path)
+        now = time.time()
+        self.manifest["entries"][key] = {
+            "kind": kind,
+            "bytes": tree_size(path),
+            "created": now,
+            "last_used": now,
+        }
+        if meta is not None:
+            self.manifest["entries"][key]["meta"] = meta
+        self.evict(keep=key)
+        self._write_manifest()
+
+    def evict(self, keep: str | None = None):
+        evicted = []
+        entries = self.manifest["entries"]
+        if self.max_bytes is None:
+            return evicted
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            del entries[key]
+            evicted.append(key)
+        return evicted
+
+    def clear(self):
+        for key in list(self.manifest["entries"]):
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+        self.manifest["entries"] = {}
+        self._write_manifest()
@@ -0,0 +1,93 @@
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class StageAborted(Exception):
+    # Raised by put() once another stage has failed
+    pass
+
+
+class PipelineStage(threading.Thread):
+    # Runs `process` on a worker thread for every item put into a bounded
+    # inbox and forwards whatever it yields to `downstream`. put() blocks
+    # while the inbox is full, so a slow stage throttles the ones feeding
+    # it instead of letting work pile up in memory. `finish` may yield
+    # trailing outputs once the input ends.
+
+    def __init__(self, name: str, process, downstream=None,
+                 maxsize: int = 8, finish=None):
+        super().__init__(name=f"meltseg-{name}", daemon=True)
+        self.stage_name = name
+        self.process = process
+        self.downstream = downstream
+        self.finish = finish
+        self.inbox = queue.Queue(maxsize)
+        self.failed = threading.Event()
+        self.error = None
+
+    def put(self, item):
+        while not self.failed.is_set():
+            try:
+                self.inbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise StageAborted(self.stage_name)
+
+    def close(self):
+        self.put(_DONE)
+
+    def _forward(self, outputs):
+        for output in outputs or ():
+            if self.downstream is not None:
+                self.downstream.put(output)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    item = self.inbox.get(timeout=0.1)
+                except queue.Empty:
+                    if self.failed.is_set():
+                        return
+                    continue
+                if item is _DONE:
+                    break
+                self._forward(self.process(item))
+            if self.finish is not None:
+                self._forward(self.finish())
+            if self.downstream is not None:
+                self.downstream.close()
+        except StageAborted:
+            pass
+        except BaseException as e:
+            self.error = e
+            self.failed.set()
+
+
+def run_pipeline(stages: list, produce):
+    # Starts the stages (first to last), runs produce(put) on this thread to
+    # feed the first one and waits for all of them to drain. The first
+    # error raised anywhere stops every stage and is re-raised here.
+    failed = threading.Event()
+    for stage in stages:
+        stage.failed = failed
+        stage.start()
+    try:
+        produce(stages[0].put)
+        stages[0].close()
+    except StageAborted:
+        pass
+    except BaseException:
+        failed.set()
+        for stage in stages:
+            stage.join()
+        raise
+    for stage in stages:
+        stage.join()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
@@ -0,0 +1,59 @@
+import threading
+from instrumentation import RunMetrics
+from cpuaccel import (apply_tuned_threads, autocast, quantize_linear,
+                      resolve_precision)
+
+
+class ModelPreloader(threading.Thread):
+    # Imports torch and SAM2, loads the predictor and initialises an
+    # inference state on the frames on a background thread, so all of that
+    # happens while the user is still annotating. result() waits for it and
+    # re-raises anything that went wrong.
+
+    def __init__(self, model_version: str, frames,
+                 metrics: RunMetrics | None = None,
+                 precision: str = "bfloat16", quantize: bool = False,
+                 tuned_threads: bool = False):
+        super().__init__(name="meltseg-preload", daemon=True)
+        self.model_version = model_version
+        # As SAM2Pipeline's; tuned_threads applies cpuaccel.py's thread
+        # counts before torch runs anything
+        self.precision = precision
+        self.quantize = quantize
+        self.tuned_threads = tuned_threads
+        self.frames = frames
+        self.metrics = metrics or RunMetrics()
+        self.predictor = None
+        self.inference_state = None
+        self.error = None
+
+    def run(self):
+        try:
+            with self.metrics.stage("preload"):
+                import torch
+                if self.tuned_threads:
+                    apply_tuned_threads()
+                from framesource import init_state
+                # Leaves nothing heavy for the main thread to import later
+                from sam2helpers import SAM2VideoPredictor
+                self.predictor = SAM2VideoPredictor.from_pretrained(
+                    self.model_version)
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                if self.quantize and device == "cpu":
+                    self.predictor = quantize_linear(self.predictor)
+                # Same contexts as SAM2Pipeline.propagate, which the frame 0
+                # features computed here end up being used in
+                with torch.inference_mode(), autocast(
+                        device, resolve_precision(self.precision, device,
+                                                  self.quantize)):
+                    self.inference_state = init_state(self.predictor,
+                                                      self.frames)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        # (predictor, inference_state) once loading has finished
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.predictor, self.inference_state
@@ -0,0 +1,36 @@
+import json
+
+
+def prompt_entries(prompts: dict) -> list:
+    # A prompts JSON maps each object to {"coordinates", "labels"} and an
+    # optional "frame" (default 0), or to a list of those for objects
+    # annotated on several frames. Returns one entry per (frame, object),
+    # ordered by frame, with points given twice for the same pair merged
+    # because SAM2 replaces earlier clicks on a frame rather than adding.
+    merged = {}
+    for obj_id, object_prompts in prompts.items():
+        if isinstance(object_prompts, dict):
+            object_prompts = [object_prompts]
+        for prompt in object_prompts:
+            frame_idx = int(prompt.get("frame", 0))
+            entry = merged.setdefault((frame_idx, obj_id), {
+                "frame": frame_idx,
+                "object": obj_id,
+                "coordinates": [],
+                "labels": [],
+            })
+            entry["coordinates"].extend(prompt["coordinates"])
+            entry["labels"].extend(prompt["labels"])
+    return sorted(merged.values(), key=lambda entry: entry["frame"])
+
+
+def first_changed_frame(old_entries: list, new_entries: list):
+    # Earliest frame whose prompts differ (added, removed or moved points),
+    # or None if the two sets of prompt entries are identical
+    def signature(entry):
+        return (entry["frame"], str(entry["object"]),
+                json.dumps(entry["coordinates"]), json.dumps(entry["labels"]))
+
+    changed = ({signature(e) for e in old_entries}
+               ^ {signature(e) for e in new_entries})
+    return min(frame for frame, *_ in changed) if changed else None
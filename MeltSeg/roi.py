@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from overlay import mask_bbox
+from prompts import prompt_entries
+
+
+class RegionOfInterest:
+    # A fixed-size crop of the frame that SAM2 segments instead of the whole
+    # frame. The crop starts as the box around every prompt point grown by
+    # `padding` pixels. With `track`, it is recentred on the masks whenever
+    # they come within `margin` (a fraction of the crop size) of its edge.
+    # Each frame keeps the crop position it was first read with, so
+    # prompts, seeds and masks of a frame always use the same coordinates;
+    # prompted frames are pinned to the initial crop that contains their
+    # points.
+
+    def __init__(self, box: tuple, frame_size: tuple, track: bool = False,
+                 margin: float = 0.2, pinned_frames=()):
+        x0, y0, x1, y1 = box
+        self.frame_width, self.frame_height = frame_size
+        self.width = x1 - x0
+        self.height = y1 - y0
+        self.track = track
+        self.margin = margin
+        self.current = (x0, y0)
+        self.pinned = set(pinned_frames)
+        self.origins = {frame_idx: (x0, y0) for frame_idx in pinned_frames}
+
+    @classmethod
+    def from_prompts(cls, prompts: dict, frame_size: tuple,
+                     padding: int = 128, **kwargs):
+        entries = prompt_entries(prompts)
+        points = np.array([point for entry in entries
+                           for point in entry["coordinates"]], dtype=float)
+        if not len(points):
+            raise ValueError("An ROI needs at least one prompt point")
+        width, height = frame_size
+        x0, y0 = np.floor(points.min(axis=0)).astype(int) - padding
+        x1, y1 = np.ceil(points.max(axis=0)).astype(int) + 1 + padding
+        box = (int(max(x0, 0)), int(max(y0, 0)), int(min(x1, width)),
+               int(min(y1, height)))
+        return cls(box, frame_size,
+                   pinned_frames=[entry["frame"] for entry in entries],
+                   **kwargs)
+
+    def origin(self, frame_idx: int):
+        return self.origins.setdefault(frame_idx, self.current)
+
+    def crop(self, frame_idx: int, frame: np.ndarray) -> np.ndarray:
+        x0, y0 = self.origin(frame_idx)
+        return np.ascontiguousarray(
+            frame[y0:y0 + self.height, x0:x0 + self.width])
+
+    def to_local_points(self, frame_idx: int, points: np.ndarray):
+        x0, y0 = self.origin(frame_idx)
+        return points - np.array([x0, y0], dtype=points.dtype)
+
+    def to_local_mask(self, frame_idx: int, mask: np.ndarray) -> np.ndarray:
+        # A stored full-frame mask as SAM2 sees it inside the crop
+        x0, y0 = self.origin(frame_idx)
+        return mask[y0:y0 + self.height, x0:x0 + self.width]
+
+    def to_full(self, frame_idx: int, logits: torch.Tensor) -> torch.Tensor:
+        # (objects, 1, h, w) mask logits in crop coordinates to boolean
+        # full-frame masks
+        x0, y0 = self.origin(frame_idx)
+        local = logits > 0.0
+        full = torch.zeros((*local.shape[:-2], self.frame_height,
+                            self.frame_width), dtype=torch.bool,
+                           device=local.device)
+        full[..., y0:y0 + self.height, x0:x0 + self.width] = local
+        if self.track:
+            bbox = mask_bbox(local.any(dim=0).any(dim=0).cpu().numpy())
+            if bbox is not None:
+                by0, by1, bx0, bx1 = bbox
+                self.follow(frame_idx, (by0 + y0, by1 + y0, bx0 + x0,
+                                        bx1 + x0))
+        return full
+
+    def follow_from(self, frame_idx: int):
+        # Frames read from now on continue from the crop of frame_idx, e.g.
+        # when propagation turns around at a prompted frame
+        self.current = self.origins.get(frame_idx, self.current)
+
+    def release(self, frame_idx: int):
+        # Lets an unprompted frame that was only read ahead of time (SAM2's
+        # init_state reads the first frame) take the crop that tracking has
+        # reached when propagation gets to it
+        if frame_idx not in self.pinned:
+            self.origins.pop(frame_idx, None)
+
+    def follow(self, frame_idx: int, bbox: tuple | None):
+        # Recentres the crop of the frames read from now on when the masks'
+        # (y0, y1, x0, x1) box on frame_idx nears the edge of its crop
+        if not self.track or bbox is None:
+            return
+        by0, by1, bx0, bx1 = bbox
+        x0, y0 = self.origins.get(frame_idx, self.current)
+        margin_x = self.width * self.margin
+        margin_y = self.height * self.margin
+        if (bx0 >= x0 + margin_x and bx1 <= x0 + self.width - margin_x
+                and by0 >= y0 + margin_y
+                and by1 <= y0 + self.height - margin_y):
+            return
+        x0 = round((bx0 + bx1 - self.width) / 2)
+        y0 = round((by0 + by1 - self.height) / 2)
+        self.current = (min(max(x0, 0), self.frame_width - self.width),
+                        min(max(y0, 0), self.frame_height - self.height))
+
+
+class ROIFrames:
+    # A frame source or subset seen through a RegionOfInterest
+    def __init__(self, frames, roi: RegionOfInterest):
+        self.frames = frames
+        self.roi = roi
+        self.paths = frames.paths
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, frame_idx: int, reader: str | None = None) -> np.ndarray:
+        return self.roi.crop(self.frames.video_index(frame_idx),
+                             self.frames.get(frame_idx, reader))
+
+    def export_jpegs(self, directory: str):
+        # For SAM2 builds that only read directories; every crop position is
+        # fixed here, so the crop cannot track
+        for frame_idx in range(len(self)):
+            Image.fromarray(self.get(frame_idx)).save(
+                os.path.join(directory, f"{frame_idx:05d}.jpg"), quality=95)
@@ -1,104 +1,914 @@
 import json
+from bisect import bisect_left
 import torch
 from sam2.sam2_video_predictor import SAM2VideoPredictor
+from sam2models import SAM2ModelSelector
 import numpy as np
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from tkinter import filedialog, messagebox
 import os
+import gc
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import subprocess
+from ffmpegstream import FFmpegFrameWriter
+from maskstore import MaskStore
+from maskexport import MaskExporter
+from geometry import GeometryWriter
+from overlay import OverlayCompositor, mask_bbox
+from parallelrender import ParallelRenderer
+from pipelinecache import PipelineCache, digest
+from checkpoint import PropagationCheckpoint
+from framesource import FrameSource, init_state
+from roi import RegionOfInterest, ROIFrames
+from framesampling import FILL_MODES, select_keyframes, fill_gap
+from prompts import prompt_entries, first_changed_frame
+from cpuaccel import autocast, quantize_linear, resolve_precision
+from pipelinestage import PipelineStage, run_pipeline
+from instrumentation import (RunMetrics, StageMetrics,
+                             write_prometheus_textfile)
 
 
-class SAM2ModelSelector:
-    def __init__(self, parent):
-        self.parent = parent
-        self.selected_model = tk.StringVar()
-        self.result = None
+class SAM2Pipeline:
+    # Dialog-free inference and rendering, shared by the GUI and batch runs
+    def __init__(self, input_frames_dir_path: str,
+                 output_video_fps: None | float = None,
+                 model_version: None | str = None,
+                 mask_spill_dir: None | str = None,
+                 mask_memory_limit: None | int = None,
+                 render_workers: None | int = 1,
+                 render_backend: str = "process",
+                 window_size: None | int = None,
+                 window_overlap: int = 1,
+                 cache: None | PipelineCache = None,
+                 frames_key: None | str = None,
+                 metrics: None | RunMetrics = None,
+                 geometry_path: None | str = None,
+                 checkpoint_dir: None | str = None,
+                 checkpoint_interval: int = 500,
+                 frame_source: None | FrameSource = None,
+                 roi_padding: None | int = None,
+                 roi_track: bool = False,
+                 skip_threshold: None | float = None,
+                 skip_max_gap: int = 10,
+                 skip_fill: str = "nearest",
+                 inference_state: None | dict = None,
+                 precision: str = "bfloat16",
+                 quantize: bool = False):
+        if window_size is not None and not 0 < window_overlap < window_size:
+            raise ValueError("window_overlap must be at least 1 and smaller "
+                             "than window_size")
+        if skip_fill not in FILL_MODES:
+            raise ValueError(f"skip_fill must be one of {', '.join(FILL_MODES)}")
+        self.input_frames_dir_path = input_frames_dir_path
+        self.output_video_fps = output_video_fps
+        self.model_version = model_version
+        # Propagate in overlapping windows of this many frames so the
+        # inference state never holds the whole video
+        self.window_size = window_size
+        self.window_overlap = window_overlap
+        self.cache = cache
+        self.frames_key = frames_key
+        self.masks_from_cache = False
+        # First changed prompt frame when the masks before it came from a
+        # cached run with the same prompts up to there
+        self.resumed_from = None
+        self.metrics = metrics or RunMetrics()
+        # Melt pool geometry rows (CSV or .parquet) written as masks arrive
+        self.geometry_path = geometry_path
+        self.geometry = None
+        # Completed masks are saved here every checkpoint_interval frames so
+        # an interrupted run restarts where it stopped
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = None
+        self.restored_from = None
+        self.restore_seconds = None
+        # Segment only a crop this many pixels around the prompt points,
+        # optionally following the masks; masks are mapped back to full
+        # frames as they are stored
+        self.roi_padding = roi_padding
+        self.roi_track = roi_track
+        self.roi = None
+        # Only frames differing from the last segmented one by more than
+        # skip_threshold gray levels (or skip_max_gap frames after it) go
+        # to SAM2; the masks of the frames in between are filled in from
+        # their neighbours with skip_fill
+        self.skip_threshold = skip_threshold
+        self.skip_max_gap = skip_max_gap
+        self.skip_fill = skip_fill
+        self.keyframes = None
+        self.skipped_fraction = None
+        # Decoded frames shared by inference and the overlay; created on
+        # first use unless the caller (e.g. the annotation tool) has one
+        self._frames = frame_source
+        # A state the caller already initialised on frame_source with the
+        # predictor it passes to propagate (see preload.py)
+        self.inference_state = inference_state
+        # Called with each frame index as soon as its masks are stored
+        self.frame_listener = None
+        # None uses every CPU core, 1 renders in this process
+        self.render_workers = render_workers
+        self.render_backend = render_backend
         self.masked_output_dir = None
+        self.video_segments = MaskStore(spill_dir=mask_spill_dir,
+                                        max_memory_bytes=mask_memory_limit)
+        self.device = self.selectdevice()
+        # On the CPU, quantize swaps the predictor's linear layers for int8
+        # ones and propagation runs in float32; "auto" precision uses
+        # bfloat16 autocast only where the hardware computes in bf16
+        self.quantize = quantize and self.device.type == "cpu"
+        self.precision = resolve_precision(precision, self.device.type,
+                                           quantize)
 
-        # Create the top-level window
-        self.top = tk.Toplevel(parent)
-        self.top.title("Select SAM2 Model Version")
-        screen_width = self.top.winfo_screenwidth()
-        screen_height = self.top.winfo_screenheight()
-        window_width = 300
-        window_height = 200
-        position_right = int((screen_width - window_width) / 2)
-        position_top = int((screen_height - window_height) / 2)
-        self.top.geometry(
-            f"{window_width}x{window_height}+{position_right}+{position_top}")
-        self.top.resizable(False, False)
-
-        # Make the popup modal
-        self.top.grab_set()
-
-        self.create_widgets()
-        
-        self.video_segments = {}
-
-    def create_widgets(self):
-        # Label
-        ttk.Label(self.top, text="Choose SAM2 Model Version:",
-                  padding=(10, 10)).pack()
-
-        # Radio buttons for model versions
-        models = [
-            ("SAM2 Tiny", "facebook/sam2.1-hiera-tiny"),
-            ("SAM2 Small", "facebook/sam2.1-hiera-small"),
-            ("SAM2 Base+", "facebook/sam2.1-hiera-base-plus"),
-            ("SAM2 Large", "facebook/sam2.1-hiera-large"),
-        ]
+    def selectdevice(self):
+        if torch.cuda.is_available():
+            device = torch.device("cuda")
+        else:
+            device = torch.device("cpu")
+        return device
+
+    @property
+    def frames(self) -> FrameSource:
+        if self._frames is None:
+            self._frames = FrameSource.from_dir(self.input_frames_dir_path)
+        return self._frames
+
+    def frame_source(self, frame_video_path: str) -> FrameSource:
+        if os.path.abspath(frame_video_path) == os.path.abspath(
+                self.input_frames_dir_path):
+            return self.frames
+        return FrameSource.from_dir(frame_video_path)
+
+    def load_predictor(self):
+        predictor = SAM2VideoPredictor.from_pretrained(self.model_version)
+        if self.quantize:
+            predictor = quantize_linear(predictor)
+        return predictor
 
-        for text, value in models:
-            ttk.Radiobutton(self.top, text=text, value=value,
-                            variable=self.selected_model).pack(padx=20, pady=5,
-                                                               anchor='w')
+    def load_prompts(self, prompts_file_path: str):
+        with open(prompts_file_path, "r") as f:
+            return json.load(f)
+
+    def add_prompts(self, predictor, state, prompts: dict,
+                    frame_offset: int = 0, frames: range | None = None):
+        # Adds the prompts on the given sample positions (all by default)
+        # to a state whose local frame 0 is frame_offset, and returns the
+        # local index of the earliest one (None if there were none)
+        first = None
+        for entry in prompt_entries(prompts):
+            position = self.sample_position(entry["frame"])
+            if frames is not None and position not in frames:
+                continue
+            local_idx = position - frame_offset
+            points_array = np.array(entry["coordinates"], dtype=np.float32)
+            if self.roi is not None:
+                points_array = self.roi.to_local_points(entry["frame"],
+                                                        points_array)
+            labels_array = np.array(entry["labels"], dtype=np.int64)
+
+            _, _, _ = predictor.add_new_points_or_box(
+                inference_state=state,
+                frame_idx=local_idx,
+                obj_id=entry["object"],
+                points=points_array,
+                labels=labels_array
+            )
+            if first is None:
+                first = local_idx
+        return first
 
-        # Set default selection
-        self.selected_model.set("SAM2 Base+")
+    def collect_masks(self, predictor, state, frame_offset: int = 0,
+                      keep: range | None = None, reverse: bool = False):
+        for out_frame_idx, object_ids, output_masks in predictor.propagate_in_video(
+                state, reverse=reverse):
+            if keep is not None and out_frame_idx not in keep:
+                continue
+            position = out_frame_idx + frame_offset
+            frame_idx = self.video_index(position)
+            if self.roi is not None:
+                binary = self.roi.to_full(frame_idx, output_masks)
+            else:
+                binary = output_masks > 0.0
+            self.record_geometry(frame_idx, object_ids, binary[:, 0])
+            binary = binary.cpu().numpy()
+            self.video_segments[frame_idx] = {
+                out_obj_id: binary[i]
+                for i, out_obj_id in enumerate(object_ids)
+            }
+            self.stored_frame(frame_idx)
+            if self.keyframes is not None:
+                self.fill_skipped(position)
 
-        # OK and Cancel buttons
-        button_frame = ttk.Frame(self.top, padding=(0, 10))
-        button_frame.pack(fill='x')
+    def stored_frame(self, frame_idx: int, filled: bool = False):
+        # Filled frames count towards the propagated frames but not the
+        # latency, which is SAM2's time per frame
+        if self.checkpoint is not None:
+            self.checkpoint.add(frame_idx)
+        if self.frame_listener is not None:
+            self.frame_listener(frame_idx)
+        if "propagate" in self.metrics.stages:
+            self.metrics.stages["propagate"].tick(latency=not filled)
 
-        ttk.Button(button_frame, text="OK", command=self.on_ok).pack(
-            side='right', padx=(0, 10))
-        ttk.Button(button_frame, text="Cancel", command=self.on_cancel).pack(
-            side='right', padx=(0, 10))
+    def fill_skipped(self, position: int):
+        # Fills the skipped frames between a just segmented keyframe and
+        # its neighbours once those are stored too
+        frame_idx = self.keyframes[position]
+        for neighbour in (position - 1, position + 1):
+            if not 0 <= neighbour < len(self.keyframes):
+                continue
+            other = self.keyframes[neighbour]
+            if other not in self.video_segments:
+                continue
+            filled = fill_gap(self.video_segments, frame_idx, other,
+                              self.skip_fill)
+            for filled_idx in filled:
+                if self.geometry_path is not None:
+                    self.record_stored_geometry(filled_idx)
+                self.stored_frame(filled_idx, filled=True)
 
-    def on_ok(self):
-        self.result = self.selected_model.get()
-        self.top.destroy()
+    def video_index(self, position: int) -> int:
+        # Video frame of a position in the frames SAM2 sees
+        return position if self.keyframes is None else self.keyframes[position]
+
+    def sample_position(self, frame_idx: int) -> int:
+        # Position of a video frame among the frames SAM2 sees, or of the
+        # first one after it when the frame was skipped
+        if self.keyframes is None:
+            return frame_idx
+        return bisect_left(self.keyframes, frame_idx)
+
+    def select_frames(self, prompts: dict):
+        if self.skip_threshold is None:
+            return
+        with self.metrics.stage("select_frames", len(self.frames)):
+            self.keyframes = select_keyframes(
+                self.frames, self.skip_threshold, self.skip_max_gap,
+                keep=[entry["frame"] for entry in prompt_entries(prompts)])
+        self.skipped_fraction = 1 - len(self.keyframes) / len(self.frames)
+        self.metrics.values["skipped_frame_fraction"] = self.skipped_fraction
+
+    def record_geometry(self, frame_idx: int, object_ids: list,
+                        masks: torch.Tensor):
+        # Computed on the (objects, height, width) tensor where it was
+        # produced, before the masks are copied off the device
+        if self.geometry_path is None:
+            return
+        if self.geometry is None:
+            self.geometry = GeometryWriter(self.geometry_path)
+        self.geometry.write(frame_idx, object_ids, masks)
+
+    def announce_stored_frames(self):
+        # Masks that came from the cache or a checkpoint rather than
+        # propagation still get geometry rows and reach the frame listener
+        for frame_idx in sorted(self.video_segments):
+            if self.frame_listener is not None:
+                self.frame_listener(frame_idx)
+            if self.geometry_path is not None:
+                self.record_stored_geometry(frame_idx)
+
+    def record_stored_geometry(self, frame_idx: int):
+        object_ids = self.video_segments.object_ids(frame_idx)
+        if not object_ids:
+            return
+        masks = np.stack([self.video_segments.get(frame_idx, obj_id)
+                          for obj_id in object_ids])
+        self.record_geometry(frame_idx, object_ids,
+                             torch.from_numpy(masks.reshape(
+                                 len(object_ids), *masks.shape[-2:])))
+
+    def close_geometry(self):
+        if self.geometry is not None:
+            self.geometry.close()
+            self.geometry = None
+
+    def masks_scope(self):
+        # Cached mask entries with the same scope differ only in prompts
+        if self.frames_key is None:
+            self.frames_key = self.cache.directory_key(
+                self.input_frames_dir_path)
+        return {"frames_key": self.frames_key,
+                "model_version": self.model_version,
+                "window_size": self.window_size,
+                "window_overlap": self.window_overlap,
+                **self.roi_options(), **self.skip_options(),
+                **self.precision_options()}
+
+    def roi_options(self):
+        # Left out without an ROI so earlier cache entries still match
+        if self.roi_padding is None:
+            return {}
+        return {"roi_padding": self.roi_padding,
+                "roi_track": self.roi_track}
+
+    def skip_options(self):
+        if self.skip_threshold is None:
+            return {}
+        return {"skip_threshold": self.skip_threshold,
+                "skip_max_gap": self.skip_max_gap,
+                "skip_fill": self.skip_fill}
+
+    def precision_options(self):
+        # Left out on the default path so earlier cache entries still match
+        if self.precision == "bfloat16" and not self.quantize:
+            return {}
+        return {"precision": self.precision, "quantize": self.quantize}
+
+    def masks_key(self, prompts: dict):
+        # Keyed on the normalized prompts so both JSON layouts share entries
+        scope = self.masks_scope()
+        return self.cache.masks_key(scope.pop("frames_key"),
+                                    prompt_entries(prompts),
+                                    scope.pop("model_version"), scope)
+
+    def load_cached_masks(self, prompts: dict):
+        # Fills video_segments from the cache and returns True on a hit
+        if self.cache is None:
+            return False
+        cached = self.cache.lookup(self.masks_key(prompts))
+        if cached is None:
+            return False
+        with self.metrics.stage("load_masks"):
+            self.video_segments.load(cached)
+            self.announce_stored_frames()
+            self.close_geometry()
+        self.masks_from_cache = True
+        return True
+
+    def load_resumable_masks(self, prompts: dict):
+        # Looks for a cached run whose prompts match these on every frame
+        # before some frame k, loads its masks for the positions before k
+        # and returns the positions (0, k) they cover, None to start over
+        if self.cache is None:
+            return None
+        entries = prompt_entries(prompts)
+        if not entries:
+            return None
+        best_key, resume = None, 0
+        for key in self.cache.find("masks", self.masks_scope()):
+            try:
+                cached_entries = prompt_entries(self.load_prompts(
+                    os.path.join(self.cache.entry_path(key), "prompts.json")))
+            except (OSError, ValueError):
+                continue
+            changed = first_changed_frame(cached_entries, entries)
+            if changed is not None and changed > resume:
+                best_key, resume = key, changed
+        if best_key is None:
+            return None
+        position = self.sample_position(resume)
+        # Frames before the first prompted frame come from its reverse
+        # pass, which a change on or before that frame invalidates too, so
+        # such a correction propagates the whole video again. The forward
+        # pass from k is seeded with the window_overlap positions before it.
+        if position <= max(self.window_overlap - 1,
+                           self.sample_position(entries[0]["frame"])):
+            return None
+        with self.metrics.stage("load_masks"):
+            # Frames skipped after position - 1 are filled again once the
+            # keyframe at position is segmented
+            self.video_segments.load(
+                self.cache.lookup(best_key),
+                before=self.video_index(position - 1) + 1,
+                objects={entry["object"] for entry in entries})
+            self.announce_stored_frames()
+        self.resumed_from = resume
+        return 0, position
+
+    def restore_checkpoint(self, prompts: dict):
+        # Reloads the masks an interrupted run saved and returns the
+        # positions (lo, hi) they cover, None to start over
+        frame_paths = self.list_frame_paths(self.input_frames_dir_path)
+        signature = digest("checkpoint",
+                           self.frames_key or [os.path.basename(p)
+                                               for p in frame_paths],
+                           prompt_entries(prompts), self.model_version,
+                           self.window_size, self.window_overlap,
+                           self.roi_options(), self.skip_options(),
+                           self.precision_options())
+        self.checkpoint = PropagationCheckpoint(self.checkpoint_dir,
+                                                signature,
+                                                self.video_segments,
+                                                self.checkpoint_interval)
+        start = time.perf_counter()
+        with self.metrics.stage("restore_checkpoint"):
+            if not self.checkpoint.restore():
+                return None
+        # Frames are stored outwards from the first prompt: its reverse
+        # pass, the forward pass, and the backward windows before the
+        # window holding it interleave, so only the stored run around the
+        # first prompted frame counts. The masks on it seed both passes.
+        lo, hi = self.stored_range(
+            self.sample_position(prompt_entries(prompts)[0]["frame"]))
+        if hi - lo < self.window_overlap:
+            self.video_segments.close()
+            self.checkpoint.remove()
+            return None
+        frame_count = len(self.keyframes or self.frames)
+        self.restored_from = (self.video_index(hi) if hi < frame_count
+                              else len(self.frames))
+        self.restore_seconds = time.perf_counter() - start
+        self.announce_stored_frames()
+        return lo, hi
+
+    def stored_range(self, position: int):
+        # The run of positions [lo, hi) around position whose masks are all
+        # stored; empty when position itself is not
+        frame_count = len(self.keyframes or self.frames)
+        if self.video_index(position) not in self.video_segments:
+            return position, position
+        lo, hi = position, position + 1
+        while lo > 0 and self.video_index(lo - 1) in self.video_segments:
+            lo -= 1
+        while (hi < frame_count
+               and self.video_index(hi) in self.video_segments):
+            hi += 1
+        return lo, hi
+
+    def propagate(self, prompts: dict, predictor=None):
+        try:
+            self._propagate(prompts, predictor)
+        except BaseException:
+            # Keeps the frames finished since the last checkpoint
+            if self.checkpoint is not None:
+                self.checkpoint.flush()
+            raise
+        finally:
+            self.close_geometry()
 
-    def on_cancel(self):
-        self.top.destroy()
+    def _propagate(self, prompts: dict, predictor=None):
+        if self.load_cached_masks(prompts):
+            return
+        self.select_frames(prompts)
+        # Positions among the frames SAM2 sees whose masks are already done
+        resume = None
+        if self.checkpoint_dir:
+            resume = self.restore_checkpoint(prompts)
+        if resume is None:
+            # A correction on frame k re-propagates only from k on
+            resume = self.load_resumable_masks(prompts)
+            if resume is not None and self.checkpoint is not None:
+                self.checkpoint.pending = list(self.video_segments.keys())
+                self.checkpoint.flush()
+        if predictor is None:
+            with self.metrics.stage("load_model"):
+                predictor = self.load_predictor()
 
+        frame_count = len(self.keyframes or self.frames)
+        if self.roi_padding is not None:
+            height, width = self.frames.get(0).shape[:2]
+            self.roi = RegionOfInterest.from_prompts(
+                prompts, (width, height), self.roi_padding,
+                track=self.roi_track)
+        with self.metrics.stage("propagate"), torch.inference_mode(), \
+                autocast(self.device.type, self.precision):
+            if resume is not None:
+                self.propagate_around(predictor, prompts, *resume)
+            elif self.window_size and frame_count > self.window_size:
+                self.propagate_windowed(predictor, prompts)
+            else:
+                state = self.full_video_state(predictor)
+                first = self.add_prompts(predictor, state, prompts)
+                if first:
+                    # Frames before the first prompt
+                    self.collect_masks(predictor, state, keep=range(first),
+                                       reverse=True)
+                    self.restart_roi(first)
+                self.collect_masks(predictor, state)
+        # SAM2 attends to every prompted frame, so the masks reused by a
+        # resumed run were computed with its old prompts after them; they
+        # are close to a full run's, but not cached as one
+        if self.cache is not None and resume is None:
+            with self.metrics.stage("cache_store"), \
+                    self.cache.insert(self.masks_key(prompts), "masks",
+                                      self.masks_scope()) as staging:
+                self.video_segments.save(staging)
+                with open(os.path.join(staging, "prompts.json"), "w") as f:
+                    json.dump(prompts, f)
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+            self.checkpoint = None
 
-class SAM2Boot(SAM2ModelSelector):
+    def full_video_state(self, predictor):
+        # The preloaded state covers every frame uncropped, so it only
+        # stands in for a new one without an ROI or frame skipping
+        state, self.inference_state = self.inference_state, None
+        if state is None or self.roi is not None or self.keyframes is not None:
+            return self.window_state(predictor, 0)
+        return state
+
+    def propagate_windowed(self, predictor, prompts: dict, start: int = 0):
+        # Each window gets its own small inference state. Windows after the
+        # first are seeded with the previous window's masks on the
+        # window_overlap frames they share, which are not written again.
+        # A non-zero start resumes from masks already in video_segments, in
+        # one window when window_size is not set. Frame numbers here are
+        # positions among the frames SAM2 sees.
+        frame_count = len(self.keyframes or self.frames)
+        seeded = start > 0
+        if seeded:
+            start -= self.window_overlap
+        window_size = self.window_size or frame_count - start
+        step = window_size - self.window_overlap
+        while True:
+            end = min(start + window_size, frame_count)
+            seeds = self.window_overlap if seeded else 0
+            if not seeded and not self.prompted_before(prompts, end):
+                # Nothing prompted yet; these frames are reached by the
+                # backward pass below
+                if end == frame_count:
+                    break
+                start += step
+                continue
+            if seeded:
+                self.resume_roi(start)
+            state = self.window_state(predictor, start, end)
+            if seeded:
+                self.seed_window(predictor, state, start)
+            first = self.add_prompts(predictor, state, prompts, start,
+                                     range(start + seeds, end))
+            if not seeded and first:
+                self.collect_masks(predictor, state, frame_offset=start,
+                                   keep=range(first), reverse=True)
+                self.restart_roi(start + first)
+            self.collect_masks(predictor, state, frame_offset=start,
+                               keep=range(seeds, end - start))
+            predictor.reset_state(state)
+            del state
+            gc.collect()
+            if not seeded and start:
+                self.propagate_backward(predictor, start, window_size)
+            seeded = True
+            if end == frame_count:
+                break
+            start += step
+
+    def propagate_around(self, predictor, prompts: dict, lo: int, hi: int):
+        # Completes a run whose positions lo to hi are already stored:
+        # backward from lo to frame 0, then forward from hi to the end
+        frame_count = len(self.keyframes or self.frames)
+        if lo:
+            self.propagate_backward(predictor, lo,
+                                    self.window_size or frame_count)
+        if hi < frame_count:
+            self.propagate_windowed(predictor, prompts, hi)
+
+    def resume_roi(self, position: int):
+        # A resumed run picks the crop up where the stored masks are
+        frame_idx = self.video_index(position)
+        if self.roi is not None and frame_idx not in self.roi.origins:
+            self.roi.follow(frame_idx, mask_bbox(np.stack(
+                list(self.video_segments[frame_idx].values()))))
+
+    def window_state(self, predictor, start: int, end: int | None = None):
+        state = init_state(predictor, self.model_frames(start, end))
+        if self.roi is not None and self.roi.track:
+            frame_idx = self.video_index(start)
+            if frame_idx not in self.video_segments:
+                self.roi.release(frame_idx)
+        return state
+
+    def restart_roi(self, position: int):
+        # The reverse pass moved a tracking crop towards the start of the
+        # video; the forward pass continues from the prompted frame's crop
+        if self.roi is not None:
+            self.roi.follow_from(self.video_index(position))
+
+    def prompted_before(self, prompts: dict, end: int) -> bool:
+        # Whether any prompt falls on a position before end
+        return any(self.sample_position(entry["frame"]) < end
+                   for entry in prompt_entries(prompts))
+
+    def propagate_backward(self, predictor, end: int, window_size: int):
+        # Reverse passes over the frames before position end, in windows
+        # going back to frame 0. Each is seeded with the masks on the
+        # window_overlap frames from end on, which are already stored.
+        # The forward crop is put back afterwards.
+        current = self.roi.current if self.roi is not None else None
+        while end > 0:
+            stop = end + self.window_overlap
+            start = max(0, stop - window_size)
+            if self.roi is not None:
+                self.resume_roi(end)
+                self.roi.follow_from(self.video_index(end))
+            state = self.window_state(predictor, start, stop)
+            self.seed_window(predictor, state, end, end - start)
+            self.collect_masks(predictor, state, frame_offset=start,
+                               keep=range(end - start), reverse=True)
+            predictor.reset_state(state)
+            del state
+            gc.collect()
+            end = start
+        if self.roi is not None:
+            self.roi.current = current
+
+    def model_frames(self, start: int, end: int | None = None):
+        # The frames SAM2 reads: the keyframes when skipping, a window of
+        # them, cropped to the ROI
+        frames = self.frames
+        if self.keyframes is not None:
+            frames = frames.subset(self.keyframes)
+        if end is not None:
+            frames = frames.window(start, end)
+        if self.roi is not None:
+            frames = ROIFrames(frames, self.roi)
+        return frames
+
+    def seed_window(self, predictor, state, start: int, local_start: int = 0):
+        # Adds the stored masks of the window_overlap positions from start
+        # on as the state's frames local_start onwards
+        for i in range(self.window_overlap):
+            local_idx = local_start + i
+            frame_idx = self.video_index(start + i)
+            for obj_id in self.video_segments.object_ids(frame_idx):
+                mask = self.video_segments.get(frame_idx, obj_id).squeeze(0)
+                if self.roi is not None:
+                    mask = self.roi.to_local_mask(frame_idx, mask)
+                predictor.add_new_mask(
+                    inference_state=state,
+                    frame_idx=local_idx,
+                    obj_id=obj_id,
+                    mask=mask
+                )
+    
+    def list_frame_paths(self, frame_video_path: str):
+        return self.frame_source(frame_video_path).paths
+
+    def parallel_renderer(self, frame_video_path: str, alpha: float):
+        frames = self.frame_source(frame_video_path)
+        return ParallelRenderer(frames.paths, self.video_segments, alpha,
+                                workers=self.render_workers,
+                                backend=self.render_backend,
+                                frame_store=frames.store_path)
+
+    def render_video_segments(self, frame_video_path: str, alpha: float):
+        if self.render_workers != 1:
+            yield from self.parallel_renderer(frame_video_path,
+                                              alpha).frames()
+            return
+        frames = self.frame_source(frame_video_path)
+        compositor = OverlayCompositor(alpha)
+        for frame_idx in sorted(self.video_segments):
+            masks = self.video_segments[frame_idx]
+            yield frame_idx, compositor.render(frames.get(frame_idx), masks)
+
+    def propagate_and_encode(self, prompts: dict, alpha: float,
+                             video_name: str, predictor=None,
+                             queue_size: int = 8):
+        # Propagation, compositing and encoding run concurrently: each frame
+        # leaving propagate_in_video is composited and piped to ffmpeg on
+        # other threads while SAM2 moves on to the next frame. Frames are
+        # composited in index order as they become available, by a pool of
+        # render_workers threads unless it is 1 (the frames and masks are
+        # already in this process, so no worker processes are started),
+        # and the bounded queues stall propagation when a later stage
+        # falls behind.
+        os.makedirs(os.path.dirname(video_name) or ".", exist_ok=True)
+        compositor = OverlayCompositor(alpha)
+        composite_metrics = self.metrics.stages.setdefault(
+            "composite", StageMetrics("composite"))
+        encode_metrics = self.metrics.stages.setdefault(
+            "encode", StageMetrics("encode"))
+        workers = self.render_workers or os.cpu_count() or 1
+        pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        rendering = deque()
+        ready = set()
+        next_frame = 0
+        writer = None
+
+        def render(frame_idx):
+            start = time.perf_counter()
+            # Usually still in the decode cache from propagation
+            blended = compositor.render(self.frames.get(frame_idx),
+                                        self.video_segments[frame_idx])
+            return blended, time.perf_counter() - start
+
+        def rendered(result):
+            blended, seconds = result
+            composite_metrics.seconds += seconds
+            composite_metrics.tick()
+            return blended
+
+        def submit(frame_idx):
+            # Yields finished frames in order, keeping up to two per worker
+            # in flight
+            if pool is None:
+                yield rendered(render(frame_idx))
+                return
+            rendering.append(pool.submit(render, frame_idx))
+            if len(rendering) >= 2 * workers:
+                yield rendered(rendering.popleft().result())
+
+        def composite(frame_idx):
+            nonlocal next_frame
+            # Overlapping passes announce their seed frames twice
+            if frame_idx < next_frame:
+                return
+            ready.add(frame_idx)
+            while next_frame in ready:
+                ready.discard(next_frame)
+                yield from submit(next_frame)
+                next_frame += 1
+
+        def composite_rest():
+            # Frames past a gap that propagation never filled
+            for frame_idx in sorted(ready):
+                yield from submit(frame_idx)
+            while rendering:
+                yield rendered(rendering.popleft().result())
+
+        def encode(blended):
+            nonlocal writer
+            start = time.perf_counter()
+            if writer is None:
+                height, width = blended.shape[:2]
+                writer = FFmpegFrameWriter(video_name, width, height,
+                                           self.output_video_fps)
+            writer.write(blended)
+            encode_metrics.seconds += time.perf_counter() - start
+            encode_metrics.tick()
+
+        def produce(put):
+            self.frame_listener = put
+            try:
+                self.propagate(prompts, predictor)
+            finally:
+                self.frame_listener = None
+
+        encoder = PipelineStage("encode", encode, maxsize=queue_size)
+        compositor_stage = PipelineStage("composite", composite, encoder,
+                                         maxsize=queue_size,
+                                         finish=composite_rest)
+        try:
+            with self.metrics.stage("pipeline"):
+                run_pipeline([compositor_stage, encoder], produce)
+                if writer is None:
+                    raise ValueError("No masked frames to encode")
+                return writer.close()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            if writer is not None and writer.process.poll() is None:
+                writer.process.kill()
+
+    def write_video_segments(self, frame_video_path: str, alpha: float,
+                             output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        with self.metrics.stage("composite") as stage:
+            if self.render_workers != 1:
+                # Workers decode, blend and encode their chunks independently
+                stage.frames += self.parallel_renderer(
+                    frame_video_path, alpha).save(output_dir)
+            else:
+                for frame_idx, blended_img in self.render_video_segments(
+                        frame_video_path, alpha):
+                    final_img = Image.fromarray(blended_img)
+                    final_img.save(os.path.join(output_dir, f'masked_frame_{frame_idx}.jpg'))
+                    stage.tick()
+        self.masked_output_dir = output_dir
+
+    def encode_video_segments(self, frame_video_path: str, alpha: float,
+                              video_name: str):
+        # Pipes blended frames straight into a single ffmpeg encoder so no
+        # intermediate masked_frame_*.jpg files are written or decoded again
+        writer = None
+        try:
+            with self.metrics.stage("render") as stage:
+                for _, blended_img in self.render_video_segments(
+                        frame_video_path, alpha):
+                    if writer is None:
+                        height, width = blended_img.shape[:2]
+                        writer = FFmpegFrameWriter(video_name, width, height,
+                                                   self.output_video_fps)
+                    writer.write(blended_img)
+                    stage.tick()
+                if writer is None:
+                    raise ValueError("No masked frames to encode")
+                return writer.close()
+        finally:
+            if writer is not None and writer.process.poll() is None:
+                writer.process.kill()
+
+    def encode_frames_dir(self, video_name: str):
+        input_pattern = os.path.join(self.masked_output_dir, "masked_frame_%d.jpg")
+        command = [
+            'ffmpeg',
+            '-framerate', str(self.output_video_fps),
+            '-i', input_pattern,
+            '-c:v', 'h264',
+            '-pix_fmt', 'yuv420p',
+            '-crf', '23',
+            video_name
+        ]
+        with self.metrics.stage("encode",
+                                frames=len(os.listdir(self.masked_output_dir))):
+            subprocess.run(command, capture_output=True, text=True, check=True)
+
+    def export_video(self, alpha: float, video_name: str,
+                     masked_frames_dir: str | None = None):
+        os.makedirs(os.path.dirname(video_name) or ".", exist_ok=True)
+        if masked_frames_dir:
+            self.write_video_segments(self.input_frames_dir_path, alpha,
+                                      masked_frames_dir)
+            self.encode_frames_dir(video_name)
+        else:
+            self.encode_video_segments(self.input_frames_dir_path, alpha,
+                                       video_name)
+
+    def export_masks(self, masks_path: str | None,
+                     coco_path: str | None = None):
+        # Unpacks one frame's masks at a time from video_segments
+        if not len(self.video_segments):
+            raise ValueError("No masks to export")
+        frame_paths = self.list_frame_paths(self.input_frames_dir_path)
+        with self.metrics.stage("export_masks") as stage, MaskExporter(
+                masks_path, len(frame_paths),
+                self.video_segments.mask_shape[-2:], coco_path,
+                [os.path.basename(p) for p in frame_paths]) as exporter:
+            for frame_idx in sorted(self.video_segments):
+                exporter.write(frame_idx, self.video_segments[frame_idx])
+                stage.tick()
+
+    def close(self):
+        self.inference_state = None
+        self.video_segments.close()
+        if self._frames is not None:
+            self._frames.close()
+
+    def write_metrics(self, report_path: str | None = None,
+                      prometheus_path: str | None = None):
+        if report_path:
+            self.metrics.write_report(report_path)
+        if prometheus_path:
+            write_prometheus_textfile(prometheus_path, [self.metrics])
+
+
+class SAM2Boot(SAM2ModelSelector, SAM2Pipeline):
     def __init__(self, input_frames_dir_path: None | str = None, 
                  prompts_file_path: None | str = None,
-                 output_video_fps: None | int = None):
-        self.input_frames_dir_path = input_frames_dir_path
-        self.output_video_fps = output_video_fps
-        if not self.input_frames_dir_path:
+                 output_video_fps: None | int = None,
+                 save_frames: bool = False,
+                 mask_spill_dir: None | str = None,
+                 mask_memory_limit: None | int = None,
+                 render_workers: None | int = 1,
+                 render_backend: str = "process",
+                 cache: None | PipelineCache = None,
+                 frames_key: None | str = None,
+                 metrics: None | RunMetrics = None,
+                 mask_export: None | str = None,
+                 coco_export: bool = False,
+                 geometry_path: None | str = None,
+                 checkpoint_dir: None | str = None,
+                 frame_source: None | FrameSource = None,
+                 roi_padding: None | int = None,
+                 roi_track: bool = False,
+                 skip_threshold: None | float = None,
+                 skip_max_gap: int = 10,
+                 skip_fill: str = "nearest",
+                 model_version: None | str = None,
+                 predictor=None,
+                 inference_state: None | dict = None,
+                 precision: str = "bfloat16",
+                 quantize: bool = False):
+        # model_version, predictor and inference_state come from main.py's
+        # ModelPreloader when the model was chosen before annotating
+        self.save_frames = save_frames
+        # Extension (".npz", ".zarr" or ".h5") of a mask store written next
+        # to the video, optionally with a COCO RLE JSON
+        self.mask_export = mask_export
+        self.coco_export = coco_export
+        if not input_frames_dir_path:
             messagebox.showerror("Error", "No input frames directory selected")
             exit()
         self.root = tk.Tk()
         self.root.withdraw()
-        super().__init__(self.root)
+        if model_version is None:
+            SAM2ModelSelector.__init__(self, self.root)
         self.root.quit()
-        self.device = self.selectdevice()
-        self.model_version = self.selectmodelversion()
-        self.run(prompts_file_path)
-        self.save_video_segments(self.input_frames_dir_path, 0.25)
-        self.convert_frames_to_video()
-
-    def selectdevice(self):
-        if torch.cuda.is_available():
-            device = torch.device("cuda")
+        SAM2Pipeline.__init__(self, input_frames_dir_path, output_video_fps,
+                              mask_spill_dir=mask_spill_dir,
+                              mask_memory_limit=mask_memory_limit,
+                              render_workers=render_workers,
+                              render_backend=render_backend,
+                              cache=cache, frames_key=frames_key,
+                              metrics=metrics, geometry_path=geometry_path,
+                              checkpoint_dir=checkpoint_dir,
+                              frame_source=frame_source,
+                              roi_padding=roi_padding, roi_track=roi_track,
+                              skip_threshold=skip_threshold,
+                              skip_max_gap=skip_max_gap, skip_fill=skip_fill,
+                              inference_state=inference_state,
+                              precision=precision, quantize=quantize)
+        self.model_version = model_version or self.selectmodelversion()
+        self.predictor = predictor
+        if self.save_frames:
+            self.run(prompts_file_path)
+            self.save_video_segments(self.input_frames_dir_path, 0.25)
+            self.convert_frames_to_video()
         else:
-            device = torch.device("cpu")
-        return device
+            self.run_pipelined(prompts_file_path, 0.25)
 
     def selectmodelversion(self):
         self.root.wait_window(self.top)
@@ -113,84 +923,33 @@ class SAM2Boot(SAM2ModelSelector):
         if not prompts_file_path:
             messagebox.showerror("Error", "No prompts file selected")
             exit()
-        with open(prompts_file_path, "r") as f:
-            prompts = json.load(f)
-        predictor = SAM2VideoPredictor.from_pretrained(self.model_version)
+        self.propagate(self.load_prompts(prompts_file_path), self.predictor)
+
+    def run_pipelined(self, prompts_file_path: str | None, alpha: float):
+        # The video name is asked up front so encoding can start with the
+        # first propagated frame
+        if not prompts_file_path:
+            messagebox.showerror("Error", "No prompts file selected")
+            exit()
+        prompts = self.load_prompts(prompts_file_path)
+        video_name = self.ask_video_name()
+        try:
+            self.propagate_and_encode(prompts, alpha, video_name,
+                                      self.predictor)
+            self.export_mask_files(video_name)
+            self.report_metrics(video_name)
+            messagebox.showinfo("Success", "Video created successfully.")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except subprocess.CalledProcessError as e:
+            messagebox.showerror("Error", f"Error creating video: {e}")
 
-        with torch.inference_mode(), torch.autocast(self.device.type,
-                                                    dtype=torch.bfloat16):
-            state = predictor.init_state(self.input_frames_dir_path)
-            for obj_id, (coordinates, labels) in prompts.items():
-                points_array = np.array(prompts[obj_id][coordinates],
-                                        dtype=np.float32)
-                labels_array = np.array(prompts[obj_id][labels],
-                                        dtype=np.int64)
-                
-                _, _, _ = predictor.add_new_points_or_box(
-                    inference_state=state,
-                    frame_idx=0,
-                    obj_id=obj_id,
-                    points=points_array,
-                    labels=labels_array
-                )
-            for out_frame_idx, object_ids, output_masks in predictor.propagate_in_video(state):
-                self.video_segments[out_frame_idx] = {
-                    out_obj_id: (output_masks[i] > 0.0).cpu().numpy()
-                    for i, out_obj_id in enumerate(object_ids)
-                }
-    
     def save_video_segments(self, frame_video_path: str, alpha: float):
         output_dir = filedialog.askdirectory(
             title="Select Ouput Directory for Masked Video Segments")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        frame_names = [
-            p for p in os.listdir(frame_video_path)
-            if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
-        ]
-        frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
-        
-        for frame_idx, masks in self.video_segments.items():
-            img = Image.open(os.path.join(frame_video_path, frame_names[frame_idx]))
-            img_array = np.array(img).astype(np.float32)
-            if img_array.ndim == 2:
-                img_array = np.stack([img_array] * 3, axis=-1)
-            elif img_array.ndim == 4:
-                img_array = img_array.squeeze()
-            colors = [
-                (255, 0, 0),    # Red
-                (0, 255, 0),    # Green
-                (0, 0, 255),    # Blue
-                (255, 255, 0),  # Yellow
-                (255, 0, 255),  # Magenta
-                (0, 255, 255),  # Cyan
-                (255, 128, 0),  # Orange
-                (128, 0, 255),  # Purple
-                (0, 255, 128),  # Spring Green
-                (255, 128, 128) # Light Pink
-            ]
-            colored_mask = np.zeros_like(img_array)
-            for num_id, (_, mask) in enumerate(masks.items()):
-                color = colors[num_id % len(colors)]
-                mask_rgb = np.stack([mask.squeeze()] * 3, axis=-1)
-                colored_mask += mask_rgb * np.array(color).reshape(1, 1, 3)
-            
-            colored_mask = colored_mask.astype(np.uint8) # 0-255
-            binary_mask = np.any(colored_mask != 0, axis=-1, keepdims=True)
-            blended_img = np.where(
-                binary_mask,
-                (1 - alpha) * img_array + alpha * colored_mask,
-                img_array
-            )
-            final_img = Image.fromarray(blended_img.astype(np.uint8))
-            final_img.save(os.path.join(output_dir, f'masked_frame_{frame_idx}.jpg'))
-        self.masked_output_dir = output_dir
-    
-    def convert_frames_to_video(self):
-        if not self.masked_output_dir:
-            messagebox.showerror("Error", "No masked frames directory selected")
-            exit()
+        self.write_video_segments(frame_video_path, alpha, output_dir)
+
+    def ask_video_name(self):
         video_name = filedialog.asksaveasfilename(
             title="Save Video As",
             filetypes=[("MP4 Files", "*.mp4")]
@@ -198,18 +957,45 @@ class SAM2Boot(SAM2ModelSelector):
         if not video_name:
             messagebox.showerror("Error", "No video name selected")
             exit()
-        input_pattern = os.path.join(self.masked_output_dir, "masked_frame_%d.jpg")
-        command = [
-            'ffmpeg',
-            '-framerate', str(self.output_video_fps),
-            '-i', input_pattern,
-            '-c:v', 'h264',
-            '-pix_fmt', 'yuv420p',
-            '-crf', '23',
-            video_name
-        ]
+        return video_name
+
+    def stream_video_segments(self, frame_video_path: str, alpha: float,
+                              video_name: str | None = None):
+        if not video_name:
+            video_name = self.ask_video_name()
+        try:
+            self.encode_video_segments(frame_video_path, alpha, video_name)
+            self.export_mask_files(video_name)
+            self.report_metrics(video_name)
+            messagebox.showinfo("Success", "Video created successfully.")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except subprocess.CalledProcessError as e:
+            messagebox.showerror("Error", f"Error creating video: {e}")
+
+    def export_mask_files(self, video_name: str):
+        base = os.path.splitext(video_name)[0]
+        if self.mask_export or self.coco_export:
+            self.export_masks(
+                base + ".masks" + self.mask_export if self.mask_export
+                else None,
+                base + ".coco.json" if self.coco_export else None)
+
+    def report_metrics(self, video_name: str):
+        # The run report sits next to the video; MELTSEG_PROMETHEUS_TEXTFILE
+        # points at a node exporter textfile collector *.prom file
+        self.write_metrics(os.path.splitext(video_name)[0] + ".metrics.json",
+                           os.environ.get("MELTSEG_PROMETHEUS_TEXTFILE"))
+
+    def convert_frames_to_video(self):
+        if not self.masked_output_dir:
+            messagebox.showerror("Error", "No masked frames directory selected")
+            exit()
+        video_name = self.ask_video_name()
         try:
-            subprocess.run(command, capture_output=True, text=True, check=True) 
+            self.encode_frames_dir(video_name)
+            self.export_mask_files(video_name)
+            self.report_metrics(video_name)
             messagebox.showinfo("Success", "Video created successfully.")
         except subprocess.CalledProcessError as e:
             messagebox.showerror("Error", f"Error creating video: {e}")
@@ -0,0 +1,100 @@
+import json
+import os
+import tkinter as tk
+from tkinter import ttk
+
+# Kept apart from sam2helpers so the model can be chosen before torch and
+# SAM2 are imported
+
+
+SAM2_MODELS = {
+    "tiny": ("SAM2 Tiny", "facebook/sam2.1-hiera-tiny"),
+    "small": ("SAM2 Small", "facebook/sam2.1-hiera-small"),
+    "base-plus": ("SAM2 Base+", "facebook/sam2.1-hiera-base-plus"),
+    "large": ("SAM2 Large", "facebook/sam2.1-hiera-large"),
+}
+
+
+def resolve_model_version(model: str) -> str:
+    # Accepts the short names above as well as full checkpoint ids
+    if model in SAM2_MODELS:
+        return SAM2_MODELS[model][1]
+    return model
+
+
+class SAM2ModelSelector:
+    def __init__(self, parent):
+        self.parent = parent
+        self.selected_model = tk.StringVar()
+        self.result = None
+        self.masked_output_dir = None
+        # A modelprofile.py report named by MELTSEG_MODEL_PROFILE puts each
+        # model's speed and accuracy next to it and preselects the
+        # recommended one
+        self.profile = None
+        if os.environ.get("MELTSEG_MODEL_PROFILE"):
+            with open(os.environ["MELTSEG_MODEL_PROFILE"], "r") as f:
+                self.profile = json.load(f)
+
+        # Create the top-level window
+        self.top = tk.Toplevel(parent)
+        self.top.title("Select SAM2 Model Version")
+        screen_width = self.top.winfo_screenwidth()
+        screen_height = self.top.winfo_screenheight()
+        window_width = 300 if self.profile is None else 460
+        window_height = 200
+        position_right = int((screen_width - window_width) / 2)
+        position_top = int((screen_height - window_height) / 2)
+        self.top.geometry(
+            f"{window_width}x{window_height}+{position_right}+{position_top}")
+        self.top.resizable(False, False)
+
+        # Make the popup modal
+        self.top.grab_set()
+
+        self.create_widgets()
+        
+        self.video_segments = {}
+
+    def create_widgets(self):
+        # Label
+        ttk.Label(self.top, text="Choose SAM2 Model Version:",
+                  padding=(10, 10)).pack()
+
+        # Radio buttons for model versions
+        profiled = {}
+        if self.profile is not None:
+            profiled = {r["model"]: r for r in self.profile["models"]
+                        if r["status"] == "ok"}
+        for text, value in SAM2_MODELS.values():
+            if value in profiled:
+                # mean_iou is None when there were no masks to compare
+                fps, iou = (profiled[value].get(key)
+                            for key in ("frames_per_second", "mean_iou"))
+                fps = "-" if fps is None else f"{fps:.1f}"
+                iou = "-" if iou is None else f"{iou:.2f}"
+                text += f"  ({fps} frames/s, IoU {iou})"
+            ttk.Radiobutton(self.top, text=text, value=value,
+                            variable=self.selected_model).pack(padx=20, pady=5,
+                                                               anchor='w')
+
+        # Set default selection
+        self.selected_model.set(
+            (self.profile or {}).get("recommended")
+            or SAM2_MODELS["base-plus"][1])
+
+        # OK and Cancel buttons
+        button_frame = ttk.Frame(self.top, padding=(0, 10))
+        button_frame.pack(fill='x')
+
+        ttk.Button(button_frame, text="OK", command=self.on_ok).pack(
+            side='right', padx=(0, 10))
+        ttk.Button(button_frame, text="Cancel", command=self.on_cancel).pack(
+            side='right', padx=(0, 10))
+
+    def on_ok(self):
+        self.result = self.selected_model.get()
+        self.top.destroy()
+
+    def on_cancel(self):
+        self.top.destroy()
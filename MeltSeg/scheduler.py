@@ -0,0 +1,300 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from multiprocessing.connection import wait
+
+# torch, cv2 and SAM2 are only imported inside functions: spawned workers
+# import this module first and must set their thread limits before them
+
+
+# Approximate resident size of each SAM2.1 checkpoint once loaded
+MODEL_BYTES = {
+    "facebook/sam2.1-hiera-tiny": 200 << 20,
+    "facebook/sam2.1-hiera-small": 250 << 20,
+    "facebook/sam2.1-hiera-base-plus": 450 << 20,
+    "facebook/sam2.1-hiera-large": 1200 << 20,
+}
+# SAM2 keeps memory features and low-resolution mask logits for every
+# propagated frame and object, independent of the video resolution
+STATE_BYTES_PER_OBJECT_FRAME = 1 << 20
+# Propagated masks are kept bit-packed, one bit per pixel and object
+MASK_BYTES_PER_OBJECT_PIXEL = 1 / 8
+# Read by OpenMP, MKL and OpenBLAS when torch is first imported
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                   "OPENBLAS_NUM_THREADS")
+
+
+def physical_memory() -> int | None:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_job_bytes(model: str, width: int, height: int, frames: int,
+                       objects: int, window_size: int | None = None,
+                       spill_masks: bool = False) -> int:
+    # Peak memory of one job: the model, SAM2's per-frame state (bounded by
+    # the window when propagating in windows) and the packed masks unless
+    # they spill to disk
+    state_frames = min(frames, window_size) if window_size else frames
+    estimate = MODEL_BYTES.get(model, max(MODEL_BYTES.values()))
+    estimate += state_frames * objects * STATE_BYTES_PER_OBJECT_FRAME
+    if not spill_masks:
+        estimate += frames * objects * width * height \
+            * MASK_BYTES_PER_OBJECT_PIXEL
+    return int(estimate)
+
+
+def probe_job(job: dict):
+    # (width, height, frames, objects) of a job before anything is extracted
+    from WeldPathTime import VideoProcessing
+    video = VideoProcessing(job["video"], fps=job["fps"], interactive=False,
+                            scale=job["scale"], crop=job["crop"])
+    width, height = video.probe_frame_size()
+    duration = video.probe_duration() or 0
+    with open(job["prompts"], "r") as f:
+        objects = len(json.load(f))
+    return width, height, int(duration * job["fps"]) + 1, max(objects, 1)
+
+
+def _job_process(job: dict, args: argparse.Namespace, threads: int, conn):
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    # Same as batch.py: SIGTERM unwinds so the job writes its checkpoint
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    import cv2
+    cv2.setNumThreads(threads)
+    from batch import BatchRunner, runner_options
+    runner = BatchRunner([job], None, **runner_options(args))
+    try:
+        conn.send(runner.run_one(job))
+    finally:
+        runner.close()
+    conn.close()
+
+
+class JobScheduler:
+    # Runs manifest jobs concurrently, each in its own spawned process with
+    # `threads` torch/OpenMP threads. Jobs start in manifest order as long
+    # as their estimated memory fits in what is left of memory_budget; a job
+    # that does not fit lets later, smaller ones start first, and one larger
+    # than the whole budget runs on its own. The queue is written to
+    # status_path on every change.
+
+    def __init__(self, jobs: list, summary_path: str, args: argparse.Namespace,
+                 workers: int = 2, memory_budget: int | None = None,
+                 threads: int | None = None, status_path: str | None = None):
+        self.jobs = jobs
+        self.summary_path = summary_path
+        self.args = args
+        self.workers = workers
+        self.memory_budget = memory_budget or physical_memory()
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.status_path = status_path
+        self.results = []
+        self.job_metrics = []
+        self.entries = [{"name": job["name"], "state": "queued",
+                         "estimate_bytes": None, "pid": None,
+                         "started": None, "finished": None}
+                        for job in jobs]
+
+    def estimate(self, job: dict) -> int:
+        if job.get("memory"):
+            from batchjobs import parse_size
+            return parse_size(str(job["memory"]))
+        try:
+            width, height, frames, objects = probe_job(job)
+        except (OSError, ValueError):
+            return MODEL_BYTES.get(job["model"], max(MODEL_BYTES.values()))
+        return estimate_job_bytes(job["model"], width, height, frames,
+                                  objects, self.args.window_size,
+                                  bool(self.args.mask_spill_dir))
+
+    @property
+    def reserved_bytes(self):
+        return sum(e["estimate_bytes"] for e in self.entries
+                   if e["state"] == "running")
+
+    def fits(self, entry: dict, running: int) -> bool:
+        if running == 0:
+            return True
+        if running >= self.workers:
+            return False
+        return (self.memory_budget is None or self.reserved_bytes
+                + entry["estimate_bytes"] <= self.memory_budget)
+
+    def write_status(self):
+        if not self.status_path:
+            return
+        status = {
+            "updated": time.time(),
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "memory_budget": self.memory_budget,
+            "reserved_bytes": self.reserved_bytes,
+            "jobs": self.entries,
+        }
+        directory = os.path.dirname(os.path.abspath(self.status_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def start(self, context, index: int):
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_job_process, name=f"meltseg-{self.jobs[index]['name']}",
+            args=(self.jobs[index], self.args, self.threads, child_conn))
+        process.start()
+        child_conn.close()
+        entry = self.entries[index]
+        entry.update(state="running", pid=process.pid, started=time.time())
+        return process, parent_conn
+
+    def finish(self, index: int, process, conn):
+        entry = self.entries[index]
+        try:
+            result, metrics = conn.recv()
+        except EOFError:
+            # Killed (often by the OOM killer) before reporting back
+            process.join()
+            job = self.jobs[index]
+            result = {"name": job["name"], "video": job["video"],
+                      "output": job["output"], "model": job["model"],
+                      "status": "error", "frames": 0, "timings": {},
+                      "error": f"Worker exited with code {process.exitcode}"}
+            metrics = None
+        conn.close()
+        process.join()
+        result["estimate_bytes"] = entry["estimate_bytes"]
+        entry.update(state=result["status"], finished=time.time())
+        self.results.append(result)
+        if metrics is not None:
+            self.job_metrics.append(metrics)
+        return result
+
+    def run(self):
+        from batchjobs import write_summary
+        from instrumentation import write_prometheus_textfile
+        for entry, job in zip(self.entries, self.jobs):
+            entry["estimate_bytes"] = self.estimate(job)
+        self.write_status()
+        context = multiprocessing.get_context("spawn")
+        pending = list(range(len(self.jobs)))
+        running = {}  # connection -> (job index, process)
+        stop = False
+        try:
+            while running or (pending and not stop):
+                while pending and not stop:
+                    index = next((i for i in pending
+                                  if self.fits(self.entries[i],
+                                               len(running))), None)
+                    if index is None:
+                        break
+                    pending.remove(index)
+                    process, conn = self.start(context, index)
+                    running[conn] = (index, process)
+                    self.write_status()
+                for conn in wait(list(running)):
+                    index, process = running.pop(conn)
+                    result = self.finish(index, process, conn)
+                    write_summary(self.summary_path, self.results)
+                    if self.args.prometheus_textfile and self.job_metrics:
+                        write_prometheus_textfile(
+                            self.args.prometheus_textfile, self.job_metrics)
+                    self.write_status()
+                    print(f"[{len(self.results)}/{len(self.jobs)}] "
+                          f"{result['name']}: {result['status']} "
+                          f"({result['timings'].get('total', 0):.1f}s)")
+                    if self.args.fail_fast and result["status"] != "ok":
+                        stop = True
+        finally:
+            for index, process in running.values():
+                process.terminate()
+            for conn, (index, process) in running.items():
+                process.join()
+                self.entries[index].update(state="interrupted",
+                                           finished=time.time())
+            for index in pending:
+                self.entries[index]["state"] = "skipped" if stop else "queued"
+            self.write_status()
+        return self.results
+
+
+def print_status(status_path: str):
+    with open(status_path, "r") as f:
+        status = json.load(f)
+    gib = 1 << 30
+    budget = status["memory_budget"]
+    print(f"{status['workers']} workers x {status['threads_per_worker']} "
+          f"threads, {status['reserved_bytes'] / gib:.1f} of "
+          f"{budget / gib if budget else float('inf'):.1f} GiB reserved")
+    now = time.time()
+    for entry in status["jobs"]:
+        if entry["started"]:
+            elapsed = (entry["finished"] or now) - entry["started"]
+            elapsed = f"{elapsed:.0f}s"
+        else:
+            elapsed = "-"
+        print(f"  {entry['name']:<30} {entry['state']:<12} "
+              f"{entry['estimate_bytes'] / gib:6.1f} GiB  "
+              f"pid {entry['pid'] or '-':<8} {elapsed}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the jobs of a batch manifest concurrently in worker "
+                    "processes, packed by estimated memory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run a manifest")
+    run_parser.add_argument("manifest", help="JSON manifest of jobs")
+    run_parser.add_argument("--summary", help="Summary JSON path (default: "
+                            "<manifest>_summary.json)")
+    run_parser.add_argument("--status", help="Queue status JSON path "
+                            "(default: <manifest>_status.json)")
+    run_parser.add_argument("--workers", type=int, default=2,
+                            help="Jobs running at the same time")
+    run_parser.add_argument("--memory-budget",
+                            help="Memory the running jobs' estimates may add "
+                                 "up to, e.g. 48G (default: physical RAM)")
+    run_parser.add_argument("--threads-per-worker", type=int,
+                            help="torch/OpenMP threads of each job (default: "
+                                 "cores / workers)")
+    from batchjobs import add_runner_arguments
+    add_runner_arguments(run_parser)
+    status_parser = subparsers.add_parser(
+        "status", help="Show the queue of a running or finished manifest")
+    status_parser.add_argument("status", help="Queue status JSON path")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print_status(args.status)
+        return 0
+
+    from batchjobs import load_manifest, parse_size
+    stem = os.path.splitext(args.manifest)[0]
+    scheduler = JobScheduler(load_manifest(args.manifest),
+                             args.summary or stem + "_summary.json", args,
+                             workers=args.workers,
+                             memory_budget=parse_size(args.memory_budget),
+                             threads=args.threads_per_worker,
+                             status_path=args.status or stem + "_status.json")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    results = scheduler.run()
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
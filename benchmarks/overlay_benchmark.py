@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "MeltSeg"))
+from overlay import OverlayCompositor, PALETTE  # noqa: E402
+
+
+def legacy_composite(img_array, masks, alpha):
+    # The per-frame blend save_video_segments used before OverlayCompositor
+    img_array = img_array.astype(np.float32)
+    colors = [tuple(int(c) for c in color) for color in PALETTE]
+    colored_mask = np.zeros_like(img_array)
+    for num_id, (_, mask) in enumerate(masks.items()):
+        color = colors[num_id % len(colors)]
+        mask_rgb = np.stack([mask.squeeze()] * 3, axis=-1)
+        colored_mask += mask_rgb * np.array(color).reshape(1, 1, 3)
+    colored_mask = colored_mask.astype(np.uint8)
+    binary_mask = np.any(colored_mask != 0, axis=-1, keepdims=True)
+    blended_img = np.where(
+        binary_mask,
+        (1 - alpha) * img_array + alpha * colored_mask,
+        img_array
+    )
+    return blended_img.astype(np.uint8)
+
+
+def synthetic_frames(num_frames, height, width, num_objects, seed=0):
+    # Melt pool like blobs: small ellipses drifting across a noisy frame
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    frames, masks = [], []
+    for i in range(num_frames):
+        frames.append(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        frame_masks = {}
+        for obj in range(num_objects):
+            cy = height * (0.3 + 0.2 * obj) % height
+            cx = (width * 0.2 + i * 3 + obj * width * 0.15) % width
+            ry, rx = height * 0.05, width * 0.08
+            frame_masks[obj] = (((yy - cy) / ry) ** 2
+                                + ((xx - cx) / rx) ** 2 <= 1)[None]
+        masks.append(frame_masks)
+    return frames, masks
+
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the legacy overlay blend with OverlayCompositor")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--objects", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--alpha", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frames, masks = synthetic_frames(args.frames, args.height, args.width,
+                                     args.objects)
+    compositor = OverlayCompositor(args.alpha)
+
+    def run_legacy():
+        for frame, frame_masks in zip(frames, masks):
+            legacy_composite(frame, frame_masks, args.alpha)
+
+    def run_lut():
+        for frame, frame_masks in zip(frames, masks):
+            compositor.render(frame, frame_masks)
+
+    def run_batch():
+        for start in range(0, len(frames), args.batch):
+            compositor.render_batch(np.stack(frames[start:start + args.batch]),
+                                    masks[start:start + args.batch])
+
+    max_diff = max(
+        int(np.abs(legacy_composite(f, m, args.alpha).astype(np.int16)
+                   - compositor.render(f, m)).max())
+        for f, m in zip(frames, masks))
+
+    print(f"{args.frames} frames {args.width}x{args.height}, "
+          f"{args.objects} objects")
+    results = [("legacy", timeit(run_legacy, args.repeat)),
+               ("lut", timeit(run_lut, args.repeat)),
+               (f"lut batch={args.batch}", timeit(run_batch, args.repeat))]
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f"{name:>16}: {seconds * 1000 / args.frames:8.2f} ms/frame  "
+              f"{baseline / seconds:5.1f}x")
+    print(f"max abs pixel difference vs legacy: {max_diff}")
+
+
+if __name__ == "__main__":
+    main()
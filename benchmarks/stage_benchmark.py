@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import types
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "MeltSeg"))
+import torch  # noqa: E402
+
+
+class StubSAM2VideoPredictor:
+    # Deterministic stand-in for SAM2VideoPredictor: emits the same melt pool
+    # ellipse that synthetic_frame draws, so only MeltSeg's own bookkeeping
+    # around propagate_in_video is timed
+    def __init__(self, height: int, width: int):
+        self.height = height
+        self.width = width
+
+    @classmethod
+    def from_pretrained(cls, model_version):
+        raise RuntimeError("The stub predictor is passed in explicitly")
+
+    def init_state(self, video_path, **kwargs):
+        frame_count = len([p for p in os.listdir(video_path)
+                           if p.lower().endswith((".jpg", ".jpeg"))])
+        return {"frame_count": frame_count, "obj_ids": []}
+
+    def add_new_points_or_box(self, inference_state, frame_idx, obj_id,
+                              points=None, labels=None, **kwargs):
+        if obj_id not in inference_state["obj_ids"]:
+            inference_state["obj_ids"].append(obj_id)
+        return frame_idx, inference_state["obj_ids"], None
+
+    def add_new_mask(self, inference_state, frame_idx, obj_id, mask):
+        return self.add_new_points_or_box(inference_state, frame_idx, obj_id)
+
+    def propagate_in_video(self, inference_state, **kwargs):
+        obj_ids = inference_state["obj_ids"]
+        for frame_idx in range(inference_state["frame_count"]):
+            logits = np.stack([
+                melt_pool_mask(frame_idx, obj, self.height, self.width)
+                for obj in range(len(obj_ids))
+            ])[:, None].astype(np.float32) * 2 - 1
+            yield frame_idx, obj_ids, torch.from_numpy(logits)
+
+    def reset_state(self, inference_state):
+        pass
+
+
+def install_sam2_stub():
+    # Lets sam2helpers import on machines without SAM2 installed
+    try:
+        import sam2.sam2_video_predictor  # noqa: F401
+    except ImportError:
+        sam2 = types.ModuleType("sam2")
+        predictor_module = types.ModuleType("sam2.sam2_video_predictor")
+        predictor_module.SAM2VideoPredictor = StubSAM2VideoPredictor
+        sys.modules["sam2"] = sam2
+        sys.modules["sam2.sam2_video_predictor"] = predictor_module
+
+
+def melt_pool_center(frame_idx: int, obj: int, height: int, width: int):
+    # The pool travels along the weld path and wobbles slightly
+    cx = (width * 0.1 + frame_idx * width * 0.004 + obj * width * 0.2) % width
+    cy = height * (0.5 + 0.02 * np.sin(frame_idx * 0.3) + 0.15 * obj)
+    return cy % height, cx
+
+
+def melt_pool_mask(frame_idx: int, obj: int, height: int, width: int):
+    cy, cx = melt_pool_center(frame_idx, obj, height, width)
+    yy, xx = np.ogrid[0:height, 0:width]
+    ry, rx = height * 0.06, width * 0.05
+    return ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 <= 1
+
+
+def synthetic_frame(frame_idx: int, objects: int, height: int, width: int,
+                    rng: np.random.Generator):
+    # Dark plate with sensor noise, a bright saturated pool per object and a
+    # cooling trail behind it
+    frame = rng.normal(30, 8, (height, width)).clip(0, 255)
+    for obj in range(objects):
+        cy, cx = melt_pool_center(frame_idx, obj, height, width)
+        yy, xx = np.ogrid[0:height, 0:width]
+        dist = (((yy - cy) / (height * 0.06)) ** 2
+                + ((xx - cx) / (width * 0.05)) ** 2)
+        frame += 220 * np.exp(-dist / 2)
+        trail = ((np.abs(yy - cy) < height * 0.02) & (xx < cx)
+                 & (xx > cx - width * 0.2))
+        frame += trail * 60
+    frame = frame.clip(0, 255).astype(np.uint8)
+    return np.stack([frame, (frame * 0.8).astype(np.uint8),
+                     (frame * 0.5).astype(np.uint8)], axis=-1)
+
+
+def write_synthetic_video(path: str, frames: int, objects: int, height: int,
+                          width: int, fps: float):
+    from ffmpegstream import FFmpegFrameWriter
+    rng = np.random.default_rng(0)
+    with FFmpegFrameWriter(path, width, height, fps) as writer:
+        for frame_idx in range(frames):
+            writer.write(synthetic_frame(frame_idx, objects, height, width,
+                                         rng))
+
+
+def write_synthetic_frames(frames_dir: str, frames: int, objects: int,
+                           height: int, width: int):
+    # Used when ffmpeg is unavailable so the later stages still run
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    os.makedirs(frames_dir, exist_ok=True)
+    for frame_idx in range(frames):
+        Image.fromarray(synthetic_frame(frame_idx, objects, height, width,
+                                        rng)).save(
+            os.path.join(frames_dir, f"{frame_idx:05d}.jpg"), quality=95)
+
+
+def write_prompts(path: str, objects: int, height: int, width: int,
+                  points_per_object: int):
+    rng = np.random.default_rng(1)
+    prompts = {}
+    for obj in range(objects):
+        cy, cx = melt_pool_center(0, obj, height, width)
+        coordinates = np.stack([
+            cx + rng.normal(0, width * 0.01, points_per_object),
+            cy + rng.normal(0, height * 0.01, points_per_object)], axis=1)
+        prompts[f"Object {obj + 1}"] = {
+            "coordinates": coordinates.round().astype(int).tolist(),
+            "labels": [1] * points_per_object,
+        }
+    with open(path, "w") as f:
+        json.dump(prompts, f, indent=2)
+
+
+def best_of(fn, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_suite(args, workdir: str):
+    install_sam2_stub()
+    from WeldPathTime import VideoProcessing
+    from sam2helpers import SAM2Pipeline
+    from ffmpegstream import FFmpegFrameWriter
+
+    stages = {}
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    frames_dir = os.path.join(workdir, "frames")
+    video_path = os.path.join(workdir, "synthetic.mp4")
+
+    def record(name, seconds, frames):
+        stages[name] = {"seconds": seconds,
+                        "frames": frames,
+                        "frames_per_second": frames / seconds if seconds else 0.0}
+
+    if have_ffmpeg:
+        write_synthetic_video(video_path, args.frames, args.objects,
+                              args.height, args.width, args.fps)
+
+        def extract():
+            shutil.rmtree(frames_dir, ignore_errors=True)
+            video = VideoProcessing(video_path, frames_dir, args.fps,
+                                    interactive=False, shards=args.shards)
+            return video.run_extraction()["frames"]
+        seconds, frame_count = best_of(extract, args.repeat)
+        record("extract", seconds, frame_count)
+    else:
+        write_synthetic_frames(frames_dir, args.frames, args.objects,
+                               args.height, args.width)
+
+    prompts_path = os.path.join(workdir, "prompts.json")
+    write_prompts(prompts_path, args.objects, args.height, args.width,
+                  args.points)
+    loader = SAM2Pipeline(frames_dir)
+    seconds, _ = best_of(lambda: [loader.load_prompts(prompts_path)
+                                  for _ in range(100)], args.repeat)
+    record("load_prompts", seconds / 100, 1)
+    prompts = loader.load_prompts(prompts_path)
+
+    predictor = StubSAM2VideoPredictor(args.height, args.width)
+    pipeline = None
+
+    def propagate():
+        nonlocal pipeline
+        pipeline = SAM2Pipeline(frames_dir, args.fps, model_version="stub",
+                                render_workers=args.render_workers or None)
+        pipeline.device = torch.device("cpu")
+        pipeline.propagate(prompts, predictor)
+        return len(pipeline.video_segments)
+    seconds, frame_count = best_of(propagate, args.repeat)
+    record("propagate_bookkeeping", seconds, frame_count)
+
+    def composite():
+        rendered = 0
+        for _ in pipeline.render_video_segments(frames_dir, args.alpha):
+            rendered += 1
+        return rendered
+    seconds, frame_count = best_of(composite, args.repeat)
+    record("composite", seconds, frame_count)
+
+    if have_ffmpeg:
+        frame = next(pipeline.render_video_segments(frames_dir, args.alpha))[1]
+
+        def encode():
+            with FFmpegFrameWriter(os.path.join(workdir, "encoded.mp4"),
+                                   args.width, args.height,
+                                   args.fps) as writer:
+                for _ in range(frame_count):
+                    writer.write(frame)
+            return frame_count
+        seconds, frame_count = best_of(encode, args.repeat)
+        record("encode", seconds, frame_count)
+    return stages
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    # Returns the stages that got slower than baseline by more than tolerance
+    regressions = []
+    print(f"{'stage':>22} {'baseline s':>11} {'current s':>11} {'ratio':>7}")
+    for name, stage in results["stages"].items():
+        if name not in baseline.get("stages", {}):
+            print(f"{name:>22} {'-':>11} {stage['seconds']:11.4f}")
+            continue
+        before = baseline["stages"][name]["seconds"]
+        ratio = stage["seconds"] / before if before else float("inf")
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:>22} {before:11.4f} {stage['seconds']:11.4f} "
+              f"{ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time MeltSeg's pipeline stages on a synthetic weld "
+                    "video with a stub SAM2 predictor")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--objects", type=int, default=2)
+    parser.add_argument("--points", type=int, default=8,
+                        help="Prompt points per object")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--alpha", type=float, default=0.25)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--render-workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown per stage before failing")
+    parser.add_argument("--workdir", help="Keep generated files here")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="meltseg_bench_")
+    try:
+        stages = run_suite(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline", "workdir")},
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+        },
+        "stages": stages,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for name, stage in stages.items():
+        print(f"{name:>22}: {stage['seconds']:9.4f}s "
+              f"{stage['frames_per_second']:9.1f} frames/s")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline was recorded with a different config")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+import json
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pytest
+from ffmpegstream import FFmpegFrameWriter
+
+
+def exiting_encoder(monkeypatch, returncode):
+    # Runs a process that exits straight away in place of ffmpeg
+    popen = subprocess.Popen
+
+    def start(command, **kwargs):
+        script = ("import sys; sys.stderr.write('no encoder'); "
+                  f"sys.exit({returncode})")
+        return popen([sys.executable, "-c", script], **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", start)
+
+
+@pytest.mark.parametrize("returncode", [1, 0])
+def test_encoder_exiting_early_fails_the_write(tmp_path, monkeypatch,
+                                               returncode):
+    exiting_encoder(monkeypatch, returncode)
+    writer = FFmpegFrameWriter(str(tmp_path / "out.mp4"), 64, 48, 10)
+    writer.process.wait()
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        writer.write(np.zeros((48, 64, 3), np.uint8))
+    assert error.value.stderr == "no encoder"
+    assert writer.frames_written == 0
+
+
+def test_rejects_other_frame_size(tmp_path, monkeypatch):
+    exiting_encoder(monkeypatch, 0)
+    writer = FFmpegFrameWriter(str(tmp_path / "out.mp4"), 64, 48, 10)
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((48, 63, 3), np.uint8))
+    writer.close()
+
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                    reason="needs ffmpeg and ffprobe")
+def test_odd_frame_size_is_padded(tmp_path):
+    # yuv420p needs even dimensions
+    path = str(tmp_path / "out.mp4")
+    with FFmpegFrameWriter(path, 7, 5, 10) as writer:
+        for value in range(3):
+            writer.write(np.full((5, 7), value * 50, np.uint8))
+    assert writer.frames_written == 3
+    probe = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_frames",
+         "-show_entries", "stream=width,height,nb_read_frames",
+         "-of", "json", path], capture_output=True, check=True, text=True)
+    stream = json.loads(probe.stdout)["streams"][0]
+    assert (stream["width"], stream["height"]) == (8, 6)
+    assert int(stream["nb_read_frames"]) == 3
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+from framesampling import fill_gap, select_keyframes  # noqa: E402
+from maskstore import MaskStore  # noqa: E402
+
+
+class ThumbnailFrames:
+    # Frames whose thumbnails are flat images of the given gray levels
+    def __init__(self, levels):
+        self.levels = levels
+
+    def __len__(self):
+        return len(self.levels)
+
+    def thumbnail(self, frame_idx, width=64):
+        return np.full((width, width), self.levels[frame_idx], dtype=float)
+
+
+def test_keeps_changed_frames_and_the_ends():
+    frames = ThumbnailFrames([0, 1, 2, 20, 21, 22, 22, 22])
+    assert select_keyframes(frames, threshold=5) == [0, 3, 7]
+
+
+def test_max_gap():
+    frames = ThumbnailFrames([0] * 10)
+    assert select_keyframes(frames, threshold=5, max_gap=4) == [0, 4, 8, 9]
+
+
+def test_prompted_frames_in_a_gap_are_kept():
+    # Frames between keyframes that carry prompts still go to SAM2, so their
+    # prompts are never dropped
+    frames = ThumbnailFrames([0] * 10)
+    assert select_keyframes(frames, threshold=5, max_gap=20,
+                            keep=[3, 6]) == [0, 3, 6, 9]
+
+
+def test_fill_nearest_copies_the_earlier_frame():
+    store = MaskStore()
+    first = np.zeros((1, 8, 8), dtype=bool)
+    first[0, 1:3, 1:3] = True
+    store.put(0, "a", first)
+    store.put(4, "a", np.zeros((1, 8, 8), dtype=bool))
+    assert fill_gap(store, 4, 0) == [1, 2, 3]
+    for frame_idx in (1, 2, 3):
+        assert np.array_equal(store.get(frame_idx, "a"), first)
+    assert fill_gap(store, 4, 5) == []
+
+
+def test_fill_interpolate_moves_between_masks():
+    store = MaskStore()
+    for frame_idx, x0 in ((0, 2), (4, 6)):
+        mask = np.zeros((1, 8, 16), dtype=bool)
+        mask[0, 2:6, x0:x0 + 6] = True
+        store.put(frame_idx, "a", mask)
+    fill_gap(store, 0, 4, mode="interpolate")
+    middle = store.get(2, "a")[0]
+    cols = np.flatnonzero(middle.any(axis=0))
+    assert middle.any()
+    assert 5 < cols.mean() < 8
@@ -0,0 +1,57 @@
+import time
+import numpy as np
+import pytest
+from PIL import Image
+from framesource import FrameSource, StoredFrameSource
+from framestore import FRAME_STORE_NAME, FrameStoreWriter
+
+
+@pytest.fixture
+def frames_dir(tmp_path):
+    for frame_idx in range(40):
+        Image.fromarray(np.full((8, 8, 3), frame_idx * 5, np.uint8)).save(
+            tmp_path / f"{frame_idx:05d}.jpg")
+    return str(tmp_path)
+
+
+def cached_after(source, delay=0.5):
+    deadline = time.time() + delay
+    while source._loading and time.time() < deadline:
+        time.sleep(0.01)
+    return sorted(source._cache)
+
+
+def test_get_and_subsets(frames_dir):
+    source = FrameSource.from_dir(frames_dir)
+    assert len(source) == 40
+    assert abs(int(source.get(10)[0, 0, 0]) - 50) <= 2
+    subset = source.subset([0, 10, 20]).window(1, 3)
+    assert len(subset) == 2
+    assert subset.video_index(0) == 10
+    assert np.array_equal(subset.get(1), source.get(20))
+    source.close()
+
+
+def test_prefetch_direction_is_per_reader(frames_dir):
+    # A reverse propagation pass interleaved with forward compositing: each
+    # reader keeps prefetching in its own direction
+    source = FrameSource.from_dir(frames_dir, prefetch=4, cache_frames=64)
+    for step in range(10):
+        source.get(30 - step, "sam2")
+        source.get(step)
+    cached = cached_after(source)
+    assert set(range(17, 35)) <= set(cached)
+    assert set(range(0, 14)) <= set(cached)
+    assert 15 not in cached
+    source.close()
+
+
+def test_frame_store_takes_the_place_of_images(frames_dir):
+    with FrameStoreWriter(f"{frames_dir}/{FRAME_STORE_NAME}", 4, 2) as writer:
+        writer.write(np.full((2, 4, 3), 7, np.uint8))
+    source = FrameSource.from_dir(frames_dir)
+    assert isinstance(source, StoredFrameSource)
+    assert source._executor is None
+    assert len(source) == 1
+    assert source.get(0, "sam2").tolist() == np.full((2, 4, 3), 7).tolist()
+    source.close()
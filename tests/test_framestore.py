@@ -0,0 +1,82 @@
+import gc
+import io
+import weakref
+import numpy as np
+import pytest
+from framestore import (FRAME_STORE_NAME, FrameStore, FrameStoreWriter,
+                        _read_ppm_header, frame_store_path)
+
+
+def frame(value, shape=(5, 7, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / FRAME_STORE_NAME)
+    with FrameStoreWriter(path, 7, 5) as writer:
+        for value in range(3):
+            writer.write(frame(value))
+        writer.write(frame(9).tobytes())
+    store = FrameStore(path)
+    assert len(store) == 4
+    assert store.shape == (5, 7, 3)
+    assert store.get(1).tolist() == frame(1).tolist()
+    assert store.get(3).tolist() == frame(9).tolist()
+    view = store.get(0)
+    assert not view.flags.writeable
+    store.close()
+    # Views stay valid after close
+    assert view.sum() == 0
+    assert frame_store_path(str(tmp_path)) == path
+
+
+def test_map_is_closed_with_the_last_view(tmp_path):
+    path = str(tmp_path / FRAME_STORE_NAME)
+    with FrameStoreWriter(path, 7, 5) as writer:
+        writer.write(frame(4))
+    store = FrameStore(path)
+    mapping = store._map
+    store.close()
+    assert mapping.closed
+
+    store = FrameStore(path)
+    view = store.get(0)
+    mapping = weakref.ref(store._map)
+    store.close()
+    assert mapping() is not None
+    assert view.sum() == 4 * view.size
+    del view
+    gc.collect()
+    assert mapping() is None
+
+
+def test_wrong_frame_size(tmp_path):
+    writer = FrameStoreWriter(str(tmp_path / FRAME_STORE_NAME), 7, 5)
+    with pytest.raises(ValueError):
+        writer.write(frame(0, (5, 6, 3)))
+    writer.abort()
+
+
+def test_failed_write_leaves_no_store(tmp_path):
+    path = str(tmp_path / FRAME_STORE_NAME)
+    with pytest.raises(RuntimeError):
+        with FrameStoreWriter(path, 7, 5) as writer:
+            writer.write(frame(0))
+            raise RuntimeError
+    assert list(tmp_path.iterdir()) == []
+    assert frame_store_path(str(tmp_path)) is None
+
+
+def test_not_a_frame_store(tmp_path):
+    path = tmp_path / FRAME_STORE_NAME
+    path.write_bytes(b"\0" * 4096)
+    with pytest.raises(ValueError):
+        FrameStore(str(path))
+
+
+def test_ppm_header():
+    stream = io.BytesIO(b"P6\n640 480\n255\n")
+    assert _read_ppm_header(stream) == (640, 480)
+    assert _read_ppm_header(stream) is None
+    with pytest.raises(ValueError):
+        _read_ppm_header(io.BytesIO(b"P5\n1 1\n255\n"))
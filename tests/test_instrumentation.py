@@ -0,0 +1,97 @@
+import json
+import time
+from instrumentation import RunMetrics, write_prometheus_textfile
+
+
+def test_stages_accumulate():
+    metrics = RunMetrics(rss_interval=0.01)
+    for _ in range(2):
+        with metrics.stage("propagate", frames=3) as stage:
+            stage.tick()
+    with metrics.stage("encode"):
+        pass
+    report = metrics.report()
+    assert list(report["stages"]) == ["propagate", "encode"]
+    propagate = report["stages"]["propagate"]
+    assert propagate["frames"] == 8
+    assert propagate["seconds"] >= 0
+    json.dumps(report)
+
+
+def test_stage_records_time_on_error():
+    metrics = RunMetrics()
+    try:
+        with metrics.stage("extract"):
+            time.sleep(0.01)
+            raise ValueError
+    except ValueError:
+        pass
+    assert metrics.stages["extract"].seconds >= 0.01
+
+
+def prometheus_samples(path):
+    with open(path) as f:
+        return [line for line in f.read().splitlines()
+                if not line.startswith("#")]
+
+
+def test_prometheus_writes_each_series_once(tmp_path):
+    # The textfile collector rejects a file with the same series twice;
+    # a later run with the same labels replaces the earlier one
+    path = str(tmp_path / "meltseg.prom")
+    runs = []
+    for job, frames in (("weld_01", 10), ("weld_02", 20), ("weld_01", 30)):
+        metrics = RunMetrics({"meltseg_job": job, "model": "tiny"})
+        with metrics.stage("propagate", frames=frames):
+            pass
+        metrics.values["skipped_frame_fraction"] = frames / 100
+        runs.append(metrics)
+    write_prometheus_textfile(path, runs)
+
+    samples = prometheus_samples(path)
+    series = [line.rsplit(" ", 1)[0] for line in samples]
+    assert len(series) == len(set(series))
+    frames = [line for line in samples
+              if line.startswith("meltseg_stage_frames_total")]
+    assert sorted(frames) == [
+        'meltseg_stage_frames_total{meltseg_job="weld_01",model="tiny",'
+        'stage="propagate"} 30.0',
+        'meltseg_stage_frames_total{meltseg_job="weld_02",model="tiny",'
+        'stage="propagate"} 20.0',
+    ]
+    with open(path) as f:
+        text = f.read()
+    assert text.count("# TYPE meltseg_stage_seconds gauge") == 1
+
+
+def test_prometheus_escapes_label_values(tmp_path):
+    path = str(tmp_path / "meltseg.prom")
+    metrics = RunMetrics({"meltseg_job": 'say "hi"\\'})
+    metrics.values["skipped_frame_fraction"] = 0.5
+    write_prometheus_textfile(path, [metrics])
+    assert prometheus_samples(path) == [
+        'meltseg_skipped_frame_fraction{meltseg_job="say \\"hi\\"\\\\"} 0.5']
+
+
+def test_frames_without_latency_are_only_counted():
+    metrics = RunMetrics()
+    with metrics.stage("propagate") as stage:
+        stage.tick()
+        time.sleep(0.02)
+        for _ in range(5):
+            stage.tick(latency=False)
+        stage.tick()
+    summary = metrics.report()["stages"]["propagate"]
+    assert summary["frames"] == 7
+    assert summary["frame_latency_seconds"]["p50"] >= 0.02
+
+
+def test_prometheus_types_unknown_values_as_gauges(tmp_path):
+    path = str(tmp_path / "meltseg.prom")
+    metrics = RunMetrics({"meltseg_job": "weld_01"})
+    metrics.values["restore_seconds"] = 1.5
+    write_prometheus_textfile(path, [metrics])
+    with open(path) as f:
+        assert f.read().splitlines() == [
+            "# TYPE meltseg_restore_seconds gauge",
+            'meltseg_restore_seconds{meltseg_job="weld_01"} 1.5']
@@ -0,0 +1,97 @@
+import json
+import numpy as np
+import pytest
+from maskexport import (COCOWriter, MaskExporter, encode_rle, mask_format,
+                        rle_counts)
+
+
+def decode_rle_string(counts: str) -> list:
+    # Inverse of rle_string, after pycocotools' rleFrString
+    values = []
+    pos = 0
+    while pos < len(counts):
+        x = 0
+        shift = 0
+        more = True
+        while more:
+            c = ord(counts[pos]) - 48
+            x |= (c & 0x1f) << shift
+            more = bool(c & 0x20)
+            pos += 1
+            shift += 5
+            if not more and c & 0x10:
+                x |= -1 << shift
+        if len(values) > 2:
+            x += values[-2]
+        values.append(x)
+    return values
+
+
+def decode_rle(rle: dict) -> np.ndarray:
+    height, width = rle["size"]
+    flat = np.zeros(height * width, dtype=bool)
+    pos = 0
+    for i, count in enumerate(decode_rle_string(rle["counts"])):
+        flat[pos:pos + count] = i % 2 == 1
+        pos += count
+    return flat.reshape((height, width), order="F")
+
+
+def test_rle_counts_are_column_major_starting_with_zeros():
+    mask = np.array([[1, 0],
+                     [1, 1]], dtype=bool)
+    assert rle_counts(mask).tolist() == [0, 2, 1, 1]
+    assert rle_counts(~mask).tolist() == [2, 1, 1]
+
+
+def test_known_strings():
+    assert encode_rle(np.ones((2, 2), dtype=bool)) == {"size": [2, 2],
+                                                       "counts": "04"}
+    assert encode_rle(np.zeros((3, 4), dtype=bool))["counts"] == "<"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rle_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    mask = rng.random((37, 53)) > rng.random()
+    assert np.array_equal(decode_rle(encode_rle(mask)), mask)
+
+
+def test_large_runs_round_trip():
+    mask = np.zeros((300, 400), dtype=bool)
+    mask[100:250, 50:390] = True
+    assert np.array_equal(decode_rle(encode_rle(mask)), mask)
+
+
+def test_coco_writer(tmp_path):
+    path = str(tmp_path / "coco.json")
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[1:3, 2:7] = True
+    writer = COCOWriter(path)
+    writer.write(1, "pool", mask)
+    writer.write(0, "pool", np.zeros((6, 8), dtype=bool))
+    writer.close()
+    with open(path) as f:
+        coco = json.load(f)
+    assert [image["id"] for image in coco["images"]] == [0, 1]
+    assert coco["categories"] == [{"id": 1, "name": "pool"}]
+    first, empty = coco["annotations"]
+    assert first["bbox"] == [2, 1, 5, 2]
+    assert first["area"] == 10
+    assert np.array_equal(decode_rle(first["segmentation"]), mask)
+    assert empty["bbox"] == [0, 0, 0, 0]
+
+
+def test_npz_export(tmp_path):
+    path = str(tmp_path / "masks.npz")
+    mask = np.eye(4, dtype=bool)[None]
+    with MaskExporter(path, 2, (4, 4)) as exporter:
+        exporter.write(1, {"a": mask})
+    with np.load(path) as masks:
+        assert masks.files == ["a/000001"]
+        assert np.array_equal(masks["a/000001"], mask[0])
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        mask_format("masks.tiff")
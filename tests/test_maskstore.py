@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from maskstore import MaskStore
+
+
+def random_mask(seed, shape=(1, 13, 17)):
+    return np.random.default_rng(seed).random(shape) > 0.5
+
+
+def test_round_trip_in_memory():
+    store = MaskStore()
+    store[3] = {"a": random_mask(0), "b": random_mask(1)}
+    store.put(0, "a", random_mask(2))
+    assert list(store) == [3, 0]
+    assert store.object_ids(3) == ["a", "b"]
+    assert np.array_equal(store.get(3, "b"), random_mask(1))
+    assert np.array_equal(store[0]["a"], random_mask(2))
+    assert not store.spilled
+    assert store.nbytes == 3 * ((13 * 17 + 7) // 8)
+
+
+def test_spills_past_memory_limit():
+    store = MaskStore(max_memory_bytes=60)
+    for frame_idx in range(4):
+        store.put(frame_idx, 1, random_mask(frame_idx))
+    assert store.spilled
+    assert store.nbytes == 0
+    for frame_idx in range(4):
+        assert np.array_equal(store.get(frame_idx, 1), random_mask(frame_idx))
+    store.close()
+    assert len(store) == 0
+
+
+def test_rejects_other_mask_shape():
+    store = MaskStore()
+    store.put(0, 1, random_mask(0))
+    with pytest.raises(ValueError):
+        store.put(1, 1, random_mask(1, shape=(1, 5, 5)))
+
+
+def test_save_and_load(tmp_path):
+    store = MaskStore(max_memory_bytes=0)
+    for frame_idx in range(5):
+        store[frame_idx] = {"a": random_mask(frame_idx),
+                            "b": random_mask(10 + frame_idx)}
+    store.save(str(tmp_path), frames=[0, 1, 2, 4])
+
+    loaded = MaskStore().load(str(tmp_path))
+    assert sorted(loaded) == [0, 1, 2, 4]
+    assert loaded.mask_shape == (1, 13, 17)
+    assert np.array_equal(loaded.get(4, "b"), random_mask(14))
+
+    before = MaskStore().load(str(tmp_path), before=2)
+    assert sorted(before) == [0, 1]
+
+    only_a = MaskStore().load(str(tmp_path), objects={"a"})
+    assert only_a.object_ids(4) == ["a"]
+
+
+def test_load_of_empty_save(tmp_path):
+    MaskStore().save(str(tmp_path), frames=[])
+    assert len(MaskStore().load(str(tmp_path))) == 0
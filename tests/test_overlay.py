@@ -0,0 +1,64 @@
+import numpy as np
+from overlay import PALETTE, OverlayCompositor, mask_bbox
+
+
+def baseline_blend(image, masks, alpha):
+    # The float blend the overlay was first rendered with
+    img_array = image.astype(np.float32)
+    colored_mask = np.zeros_like(img_array)
+    for num_id, mask in enumerate(masks.values()):
+        color = PALETTE[num_id % len(PALETTE)].astype(np.float32)
+        colored_mask += np.stack([mask.squeeze()] * 3, axis=-1) * color
+    colored_mask = colored_mask.astype(np.uint8)
+    binary_mask = np.any(colored_mask != 0, axis=-1, keepdims=True)
+    return np.where(binary_mask,
+                    (1 - alpha) * img_array + alpha * colored_mask,
+                    img_array).astype(np.uint8)
+
+
+def random_case(seed, objects=3, shape=(24, 32)):
+    # Non-overlapping masks; where masks overlap the baseline summed the
+    # colors and the compositor lets the later object win
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (*shape, 3), dtype=np.uint8)
+    owner = rng.integers(0, objects + 1, shape)
+    masks = {f"Object {i}": (owner == i)[None] for i in range(1, objects + 1)}
+    return image, masks
+
+
+def test_matches_baseline_blend():
+    for alpha in (0.0, 0.3, 0.5, 1.0):
+        compositor = OverlayCompositor(alpha)
+        for seed in range(5):
+            image, masks = random_case(seed)
+            assert np.array_equal(compositor.render(image, masks),
+                                  baseline_blend(image, masks, alpha))
+
+
+def test_batch_matches_single_frames():
+    compositor = OverlayCompositor(0.4)
+    cases = [random_case(seed) for seed in range(3)]
+    images = np.stack([image for image, _ in cases])
+    batch = compositor.render_batch(images, [masks for _, masks in cases])
+    for rendered, (image, masks) in zip(batch, cases):
+        assert np.array_equal(rendered, compositor.render(image, masks))
+
+
+def test_empty_masks_leave_the_frame():
+    image, masks = random_case(0)
+    empty = {obj_id: np.zeros_like(mask) for obj_id, mask in masks.items()}
+    assert np.array_equal(OverlayCompositor(0.5).render(image, empty), image)
+
+
+def test_later_objects_win_overlaps():
+    image = np.zeros((4, 4, 3), np.uint8)
+    mask = np.ones((1, 4, 4), bool)
+    rendered = OverlayCompositor(1.0).render(image, {"a": mask, "b": mask})
+    assert (rendered == PALETTE[1]).all()
+
+
+def test_mask_bbox():
+    labels = np.zeros((2, 6, 8), np.uint8)
+    assert mask_bbox(labels) is None
+    labels[0, 1, 2] = labels[1, 4, 6] = 1
+    assert mask_bbox(labels) == (1, 5, 2, 7)
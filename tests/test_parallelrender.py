@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from PIL import Image
+from framestore import FRAME_STORE_NAME, FrameStoreWriter
+from maskstore import MaskStore
+from overlay import OverlayCompositor
+from parallelrender import ParallelRenderer
+
+
+@pytest.fixture
+def video(tmp_path):
+    # Ten lossless 12x10 frames, two objects each, one frame without masks
+    rng = np.random.default_rng(0)
+    images, paths = [], []
+    store = MaskStore()
+    for frame_idx in range(10):
+        image = rng.integers(0, 256, (10, 12, 3), dtype=np.uint8)
+        path = str(tmp_path / f"{frame_idx:05d}.png")
+        Image.fromarray(image).save(path)
+        images.append(image)
+        paths.append(path)
+        if frame_idx != 4:
+            store[frame_idx] = {obj: rng.random((1, 10, 12)) > 0.6
+                                for obj in ("a", "b")}
+    return images, paths, store
+
+
+def serial(images, store, alpha):
+    compositor = OverlayCompositor(alpha)
+    return [(frame_idx, compositor.render(images[frame_idx], store[frame_idx]))
+            for frame_idx in sorted(store.keys())]
+
+
+def assert_same_frames(rendered, expected):
+    assert [f for f, _ in rendered] == [f for f, _ in expected]
+    for (_, frame), (_, reference) in zip(rendered, expected):
+        assert np.array_equal(frame, reference)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_pool_matches_the_serial_compositor(video, backend):
+    images, paths, store = video
+    renderer = ParallelRenderer(paths, store, 0.4, workers=2, chunk_size=3,
+                                backend=backend)
+    assert_same_frames(list(renderer.frames()), serial(images, store, 0.4))
+
+
+def test_frame_store_matches_the_serial_compositor(video, tmp_path):
+    images, paths, store = video
+    store_path = str(tmp_path / FRAME_STORE_NAME)
+    with FrameStoreWriter(store_path, 12, 10) as writer:
+        for image in images:
+            writer.write(image)
+    renderer = ParallelRenderer(paths, store, 0.4, workers=2,
+                                frame_store=store_path)
+    assert_same_frames(list(renderer.frames()), serial(images, store, 0.4))
+
+
+def test_large_frames_are_split_into_smaller_chunks(video):
+    images, paths, store = video
+    # Room for two single-frame chunks per worker, not more
+    frame_bytes = 10 * 12 * 3 + store.record_size
+    renderer = ParallelRenderer(paths, store, 0.4, workers=2, chunk_size=16,
+                                max_inflight_bytes=4 * frame_bytes)
+    assert [len(chunk) for chunk in renderer._chunks(None)] == [1] * 9
+    assert_same_frames(list(renderer.frames()), serial(images, store, 0.4))
+    # Saving to disk only passes masks through shared memory
+    assert [len(chunk) for chunk in renderer._chunks("out")] == [9]
@@ -0,0 +1,106 @@
+import os
+import pytest
+from pipelinecache import PipelineCache, digest, link_file, link_tree
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_insert_and_lookup(tmp_path):
+    cache = PipelineCache(str(tmp_path / "cache"))
+    with cache.insert("k1", "masks", meta={"scope": 1}) as staging:
+        write(os.path.join(staging, "index.json"), "{}")
+    path = cache.lookup("k1")
+    assert read(os.path.join(path, "index.json")) == "{}"
+    assert cache.find("masks", {"scope": 1}) == ["k1"]
+    assert cache.find("masks", {"scope": 2}) == []
+    assert cache.lookup("missing") is None
+    # Another instance sees the entry through the manifest
+    assert PipelineCache(str(tmp_path / "cache")).lookup("k1") == path
+
+
+def test_failed_insert_is_not_recorded(tmp_path):
+    cache = PipelineCache(str(tmp_path / "cache"))
+    with pytest.raises(RuntimeError):
+        with cache.insert("k1", "frames") as staging:
+            write(os.path.join(staging, "00000.jpg"), "x")
+            raise RuntimeError
+    assert cache.lookup("k1") is None
+    assert not [name for name in os.listdir(cache.root)
+                if name.startswith(".frames_")]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PipelineCache(str(tmp_path / "cache"), max_bytes=150)
+    for key in ("old", "new"):
+        with cache.insert(key, "frames") as staging:
+            write(os.path.join(staging, "frame"), "x" * 100)
+    assert cache.lookup("old") is None
+    assert cache.lookup("new") is not None
+
+
+def test_digest_separates_parts():
+    assert digest("ab", "c") != digest("a", "bc")
+    assert digest({"a": 1, "b": 2}) == digest({"b": 2, "a": 1})
+
+
+def test_frames_key_follows_video_content(tmp_path):
+    cache = PipelineCache(str(tmp_path / "cache"))
+    video = str(tmp_path / "weld.mp4")
+    write(video, "one")
+    key = cache.frames_key(video, 10, {"scale": None})
+    assert cache.frames_key(video, 10, {"scale": None}) == key
+    assert cache.frames_key(video, 5, {"scale": None}) != key
+    write(video, "two!")
+    assert cache.frames_key(video, 10, {"scale": None}) != key
+
+
+def test_linked_frames_are_replaced_not_rewritten(tmp_path):
+    # Frames linked out of the cache share its inodes; relinking a name
+    # must leave the cached file alone
+    cache = PipelineCache(str(tmp_path / "cache"))
+    with cache.insert("frames", "frames") as staging:
+        write(os.path.join(staging, "00000.jpg"), "cached")
+    entry = cache.lookup("frames")
+    folder = str(tmp_path / "frames")
+    link_tree(entry, folder)
+    frame = os.path.join(folder, "00000.jpg")
+    assert read(frame) == "cached"
+
+    fresh = str(tmp_path / "fresh.jpg")
+    write(fresh, "fresh")
+    link_file(fresh, frame)
+    assert read(frame) == "fresh"
+    assert read(os.path.join(entry, "00000.jpg")) == "cached"
+
+
+def test_clear_frames_unlinks_cached_frames(tmp_path):
+    pytest.importorskip("cv2")
+    pytest.importorskip("tkinter")
+    from WeldPathTime import VideoProcessing
+    cache = PipelineCache(str(tmp_path / "cache"))
+    with cache.insert("frames", "frames") as staging:
+        write(os.path.join(staging, "00000.jpg"), "cached")
+    entry = cache.lookup("frames")
+    folder = str(tmp_path / "frames")
+    link_tree(entry, folder)
+    write(os.path.join(folder, "00001.png"), "old frame")
+    write(os.path.join(folder, "frames.msf"), "old store")
+    # Files of the user's that happen to share the folder
+    kept = ["notes.txt", "masked_frame_00000.jpg", "photo.png", "1234.jpg"]
+    for name in kept:
+        write(os.path.join(folder, name), "kept")
+
+    video = VideoProcessing(output_folder=folder, interactive=False)
+    video.clear_frames()
+    assert sorted(os.listdir(folder)) == sorted(kept)
+    # What ffmpeg would do next: write the frame names in place
+    write(os.path.join(folder, "00000.jpg"), "new extraction")
+    assert read(os.path.join(entry, "00000.jpg")) == "cached"
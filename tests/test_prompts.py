@@ -0,0 +1,44 @@
+from prompts import first_changed_frame, prompt_entries
+
+
+def test_single_prompt_defaults_to_frame_0():
+    entries = prompt_entries({"Object 1": {"coordinates": [[1, 2]],
+                                           "labels": [1]}})
+    assert entries == [{"frame": 0, "object": "Object 1",
+                        "coordinates": [[1, 2]], "labels": [1]}]
+
+
+def test_entries_are_ordered_by_frame():
+    entries = prompt_entries({
+        "a": [{"frame": 9, "coordinates": [[0, 0]], "labels": [1]},
+              {"frame": 2, "coordinates": [[1, 1]], "labels": [1]}],
+        "b": {"frame": 5, "coordinates": [[2, 2]], "labels": [0]},
+    })
+    assert [(e["frame"], e["object"]) for e in entries] == [
+        (2, "a"), (5, "b"), (9, "a")]
+
+
+def test_points_on_the_same_frame_are_merged():
+    # SAM2 replaces the clicks of a frame, so they must arrive together
+    entries = prompt_entries({"a": [
+        {"frame": 4, "coordinates": [[0, 0]], "labels": [1]},
+        {"frame": "4", "coordinates": [[5, 5], [6, 6]], "labels": [0, 1]},
+    ]})
+    assert len(entries) == 1
+    assert entries[0]["coordinates"] == [[0, 0], [5, 5], [6, 6]]
+    assert entries[0]["labels"] == [1, 0, 1]
+
+
+def test_first_changed_frame():
+    base = {"a": [{"frame": 0, "coordinates": [[1, 1]], "labels": [1]},
+                  {"frame": 12, "coordinates": [[2, 2]], "labels": [0]}]}
+    moved = {"a": [base["a"][0],
+                   {"frame": 12, "coordinates": [[3, 3]], "labels": [0]}]}
+    added = {**base, "b": {"frame": 20, "coordinates": [[4, 4]],
+                           "labels": [1]}}
+    old = prompt_entries(base)
+    assert first_changed_frame(old, prompt_entries(base)) is None
+    assert first_changed_frame(old, prompt_entries(moved)) == 12
+    assert first_changed_frame(old, prompt_entries(added)) == 20
+    # Removing prompts changes their frame too
+    assert first_changed_frame(prompt_entries(added), old) == 20
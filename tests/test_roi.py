@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from roi import RegionOfInterest  # noqa: E402
+
+
+def tracking_roi(prompt_frame=14):
+    # A 40x40 crop at (60, 60) of a 200x200 frame, prompted on prompt_frame
+    return RegionOfInterest((60, 60, 100, 100), (200, 200), track=True,
+                            pinned_frames=[prompt_frame])
+
+
+def pool_box(x):
+    # (y0, y1, x0, x1) of a 10 px melt pool starting at x
+    return (75, 85, x, x + 10)
+
+
+def test_from_prompts():
+    roi = RegionOfInterest.from_prompts(
+        {"a": {"frame": 3, "coordinates": [[50, 60], [70, 65]],
+               "labels": [1, 1]}}, (100, 80), padding=20)
+    assert (roi.width, roi.height) == (61, 40)
+    assert roi.origins == {3: (30, 40)}
+    frame = np.zeros((80, 100, 3), dtype=np.uint8)
+    assert roi.crop(3, frame).shape == (40, 61, 3)
+
+
+def test_frames_keep_the_crop_they_were_read_with():
+    roi = tracking_roi()
+    assert roi.origin(15) == (60, 60)
+    roi.follow(15, pool_box(92))
+    assert roi.current != (60, 60)
+    assert roi.origin(15) == (60, 60)
+    assert roi.origin(16) == roi.current
+
+
+def test_forward_pass_restarts_at_the_prompted_frame():
+    # The reverse pass drags the crop towards the start of the video; the
+    # forward pass must continue from the prompted frame's crop, not there
+    roi = tracking_roi()
+    for frame_idx, x in zip(range(13, -1, -1), range(60, 0, -5)):
+        roi.origin(frame_idx)
+        roi.follow(frame_idx, pool_box(x))
+    assert roi.current[0] < 40
+    roi.follow_from(14)
+    assert roi.current == (60, 60)
+    assert roi.origin(15) == (60, 60)
+
+
+def test_released_frame_takes_the_tracked_crop():
+    # init_state reads a window's first frame before tracking reaches it
+    roi = tracking_roi()
+    assert roi.origin(0) == (60, 60)
+    roi.follow(13, pool_box(20))
+    roi.release(0)
+    roi.release(14)
+    assert roi.origin(0) == roi.current != (60, 60)
+    assert roi.origin(14) == (60, 60)
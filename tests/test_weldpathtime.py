@@ -0,0 +1,40 @@
+import os
+import subprocess
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("tkinter")
+from WeldPathTime import VideoProcessing  # noqa: E402
+
+
+def test_shards_are_renumbered_in_frame_order(tmp_path, monkeypatch):
+    # Frame numbers past 99999 get a sixth digit, which sorts before
+    # "99999" as text
+    def extract(command, **kwargs):
+        shard_dir = os.path.dirname(command[-1])
+        for number in (9, 10, 99999, 100000):
+            with open(os.path.join(shard_dir, f"{number:05d}.jpg"), "w") as f:
+                f.write(f"{os.path.basename(shard_dir)} {number}")
+
+    monkeypatch.setattr(subprocess, "run", extract)
+    video = VideoProcessing("weld.mp4", str(tmp_path), fps=10,
+                            interactive=False, shards=2)
+    monkeypatch.setattr(video, "probe_duration", lambda: 2.0)
+    assert video.extract_sharded("jpg") == 8
+    contents = []
+    for frame_idx in range(8):
+        with open(tmp_path / f"{frame_idx:05d}.jpg") as f:
+            contents.append(f.read())
+    assert contents == [f".shard_{shard} {number}" for shard in (0, 1)
+                        for number in (9, 10, 99999, 100000)]
+    assert sorted(os.listdir(tmp_path)) == [f"{i:05d}.jpg" for i in range(8)]
+
+
+def test_shard_keeps_the_single_pass_timestamps():
+    video = VideoProcessing("weld.mp4", "frames", fps=10, interactive=False)
+    command = video.extraction_command("out/%05d.jpg", 20, 40)
+    assert command[command.index("-ss") + 1] == "1.800000"
+    assert "-copyts" in command and "-start_at_zero" in command
+    assert "trim=start=1.950000:end=3.950000" in command[
+        command.index("-vf") + 1]
+    assert "-ss" not in video.extraction_command("out/%05d.jpg")